@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# viewهای async مسیرهای خواندنی (referral/async_views.py)
+os.environ.setdefault('REFERRAL_ASYNC_READS', '1')
 
 application = get_asgi_application()
@@ -49,14 +49,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'referral.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # نسخه‌های referral.middleware برای مسیرهای API (REFERRAL_API_PREFIX) کاری نمی‌کنند
+    'referral.middleware.ApiSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'referral.middleware.ApiCsrfViewMiddleware',
+    'referral.middleware.ApiAuthenticationMiddleware',
+    'referral.middleware.ApiMessageMiddleware',
+    'referral.middleware.ApiXFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -82,12 +84,62 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# تنظیمات از متغیرهای محیطی:
+# DB_ENGINE=sqlite (پیش‌فرض) یا postgres (سرویس db در docker-compose)
+# DB_CONN_MAX_AGE: عمر اتصال پایدار (ثانیه)؛ زیر ASGI پیش‌فرض 0 است چون
+# هر درخواست async اتصال خودش را در نخ جدا می‌گیرد و باید pool استفاده شود
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get(
+    'DB_CONN_MAX_AGE', '0' if os.environ.get('REFERRAL_ASYNC_READS') == '1' else '60'
+))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'mydb'),
+            'USER': os.environ.get('POSTGRES_USER', 'user'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'pass'),
+            'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    if os.environ.get('DB_POOL', '1') == '1':
+        # pool داخلی جنگو (psycopg_pool)؛ با اتصال پایدار ناسازگار است
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # انتظار برای قفل نوشتن به جای خطای فوری database is locked
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '20')),
+            },
+            # پایگاه تست روی فایل (نه حافظه) تا تست‌های هم‌زمانی با چند اتصال
+            # واقعی و قفل نوشتن اجرا شوند؛ manage.py test آن را در پایان حذف می‌کند
+            'TEST': {
+                'NAME': os.environ.get('SQLITE_TEST_PATH', BASE_DIR / 'test_db.sqlite3'),
+            },
+        }
+    }
+    if os.environ.get('SQLITE_TUNED', '1') == '1':
+        # WAL: خواننده‌ها نویسنده را متوقف نمی‌کنند؛ synchronous=NORMAL در WAL
+        # امن است و fsync هر commit را حذف می‌کند. IMMEDIATE قفل نوشتن را از
+        # ابتدای تراکنش می‌گیرد تا ارتقای قفل وسط تراکنش به بن‌بست نخورد.
+        DATABASES['default']['OPTIONS'].update({
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+        })
 
 
 # Password validation
@@ -135,5 +187,134 @@ CORS_ALLOWED_ORIGINS = [
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
-}
\ No newline at end of file
+    ],
+    # API کاربر جنگو ندارد؛ بدون این، DRF برای هر درخواست session را بارگذاری می‌کند
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    # محدودیت نرخ endpointهای REFERRAL_RATE_LIMITS (referral/throttling.py)
+    'DEFAULT_THROTTLE_CLASSES': [
+        'referral.throttling.TokenBucketThrottle',
+    ],
+    # تعداد پروکسی جلوی جنگو (nginx)؛ آدرس کلاینت از X-Forwarded-For
+    'NUM_PROXIES': int(os.environ.get('REFERRAL_NUM_PROXIES', '1')),
+    'DEFAULT_RENDERER_CLASSES': [
+        'referral.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# کش مشترک بین همه پردازش‌ها (workerهای وب، process_outbox، unlock_matured_stakes
+# و create_payouts)؛ ابطال کش خواندنی و سطل‌های محدودیت نرخ فقط با کش مشترک
+# بین پردازش‌ها دیده می‌شوند. بدون REDIS_URL کش LocMem همین پردازش است.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'referral',
+        },
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'ratelimit',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'referral',
+        },
+        # سطل‌های محدودیت نرخ
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'referral-ratelimit',
+        },
+    }
+
+
+# Referral app
+# get_user_stats از شمارنده‌های روی WalletUser می‌خواند؛ False = تجمیع شرطی مستقیم
+REFERRAL_STATS_USE_COUNTERS = os.environ.get('REFERRAL_STATS_USE_COUNTERS', '1') == '1'
+
+# صفحه‌بندی لیست استیکینگ‌ها (?page_size=&cursor=)
+REFERRAL_STAKINGS_PAGE_SIZE = 50
+REFERRAL_STAKINGS_MAX_PAGE_SIZE = 500
+
+# عمری که بعد از آن snapshot داشبورد ادمین کهنه نشان داده می‌شود (ثانیه)؛
+# محاسبه مجدد با اجرای دوره‌ای refresh_dashboard است
+REFERRAL_DASHBOARD_MAX_AGE = 900
+
+# اندازه پیش‌فرض و سقف ?limit= در leaderboard/<board>/
+REFERRAL_LEADERBOARD_SIZE = 10
+REFERRAL_LEADERBOARD_MAX_SIZE = 100
+
+# آمار روزانه (referral/rollups.py): تعداد ردیف هر روز برای نوشتن هم‌زمان،
+# بازه پیش‌فرض و حداکثر بازه stats/timeseries/ (روز)
+REFERRAL_ROLLUP_SHARDS = 8
+REFERRAL_TIMESERIES_DEFAULT_DAYS = 30
+REFERRAL_TIMESERIES_MAX_DAYS = 731
+
+# تعداد سطر هر بار خواندن از cursor در خروجی CSV/NDJSON (referral/export.py)
+REFERRAL_EXPORT_CHUNK_SIZE = 2000
+
+# تعداد پاداش برداشته‌شده در هر تراکنش دسته‌بندی پرداخت (referral/payouts.py)
+REFERRAL_PAYOUT_CHUNK_SIZE = 5000
+
+# حداکثر تعداد استیکینگ در هر درخواست staking/process-batch/
+REFERRAL_STAKING_BATCH_MAX = 1000
+
+# کش خواندنی آمار و لیست استیکینگ‌ها (ثانیه؛ 0 = غیرفعال). بدون کش مشترک
+# (REDIS_URL) خاموش است: ابطال‌های process_outbox و دستورهای دوره‌ای به
+# پردازش‌های وب نمی‌رسند و موجودی کهنه سرو می‌شد.
+REFERRAL_CACHE_ALIAS = 'default'
+REFERRAL_CACHE_TIMEOUT = int(os.environ.get('REFERRAL_CACHE_TIMEOUT', '30' if REDIS_URL else '0'))
+REFERRAL_CACHE_STALE_GRACE = 60
+
+# سرو مسیرهای خواندنی (user-stats و staking/list) با viewهای async؛
+# در اجرای ASGI (backend/asgi.py) به‌طور پیش‌فرض فعال است
+REFERRAL_ASYNC_READS = os.environ.get('REFERRAL_ASYNC_READS', '0') == '1'
+
+# 1 = process_staking فقط Staking و یک رویداد outbox ثبت می‌کند و پاداش‌ها و
+# موجودی‌ها را process_outbox اعمال می‌کند؛ فقط وقتی روشن شود که worker
+# (process_outbox) اجرا می‌شود. پیش‌فرض: اعمال هم‌زمان در همان درخواست
+REFERRAL_STAKING_OUTBOX = os.environ.get('REFERRAL_STAKING_OUTBOX', '0') == '1'
+REFERRAL_OUTBOX_BATCH_SIZE = 500
+REFERRAL_OUTBOX_MAX_ATTEMPTS = 10
+
+# محدودیت نرخ token bucket به ازای نام مسیر: 'N/period' = تا N درخواست
+# پشت‌سرهم و N توکن جدید در هر period (s، min، hour، day)؛ 'per_item' هزینه را
+# تعداد اعضای آن فیلد بدنه می‌کند
+REFERRAL_RATE_LIMITS = {
+    'save_wallet': {'wallet': '5/min', 'ip': '20/min'},
+    'process_staking': {'wallet': '30/min', 'ip': '60/min'},
+    # هر استیکینگ دسته یک توکن؛ ظرفیت دو دسته کامل (REFERRAL_STAKING_BATCH_MAX)
+    'process_staking_batch': {'ip': '2000/min', 'per_item': 'stakes'},
+}
+REFERRAL_RATE_LIMIT_CACHE = 'ratelimit'
+
+# پیشوند مسیرهای API در backend/urls.py (مسیر سبک middleware)
+REFERRAL_API_PREFIX = '/api/'
+
+# نوشتن Decimal در پاسخ‌های API (referral/renderers.py): 'number' = عدد JSON
+# دقیق با همان ارقام ذخیره‌شده، 'string' = رشته
+REFERRAL_JSON_DECIMAL = os.environ.get('REFERRAL_JSON_DECIMAL', 'number')
+
+# سنجش viewها (referral/metrics.py): درخواست‌های کندتر از این آستانه با
+# SQL اجراشده (حداکثر REFERRAL_SLOW_REQUEST_MAX_SQL کوئری) در لاگ ثبت می‌شوند
+REFERRAL_SLOW_REQUEST_MS = int(os.environ.get('REFERRAL_SLOW_REQUEST_MS', '500'))
+REFERRAL_SLOW_REQUEST_MAX_SQL = 50
+# اگر تنظیم شود، metrics/ فقط با هدر Authorization: Bearer <token> پاسخ می‌دهد
+REFERRAL_METRICS_TOKEN = os.environ.get('REFERRAL_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'referral.slow_requests': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
@@ -1,21 +1,67 @@
+from django.conf import settings
 from django.contrib import admin
 from django.utils import timezone
-from .models import WalletUser, Referral, Staking, TokenReward
+from .models import WalletUser, Referral, ReferralPath, Staking, TokenReward, LedgerEntry, OutboxEvent, PayoutBatch
+from .services import unlock_stakings, downline_levels
+from .cache import invalidate_wallets_on_commit
+from .export import export_queryset, export_response
+from .payouts import claim_payout_batches, mark_batches_paid, release_batches
+
+
+class WalletCacheInvalidationMixin:
+    """ویرایش یا حذف دستی در ادمین، کش خواندنی کیف‌پول‌های مرتبط را باطل می‌کند"""
+    wallet_address_lookup = 'user__wallet_address'
+    
+    def invalidate_wallet_cache(self, queryset):
+        invalidate_wallets_on_commit(
+            queryset.values_list(self.wallet_address_lookup, flat=True)
+        )
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.invalidate_wallet_cache(self.model.objects.filter(pk=obj.pk))
+    
+    def delete_model(self, request, obj):
+        self.invalidate_wallet_cache(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+    
+    def delete_queryset(self, request, queryset):
+        self.invalidate_wallet_cache(queryset)
+        super().delete_queryset(request, queryset)
+
+
+class ExportActionsMixin:
+    """اکشن‌های خروجی جریانی CSV و NDJSON (referral/export.py)
+
+    با «انتخاب همه» کل نتیجه فیلترهای فعلی changelist خروجی گرفته می‌شود.
+    """
+    export_kind = None
+    
+    def export_csv(self, request, queryset):
+        rows = export_queryset(self.export_kind, queryset=queryset)
+        return export_response(request, self.export_kind, rows, 'csv')
+    export_csv.short_description = "خروجی CSV"
+    
+    def export_ndjson(self, request, queryset):
+        rows = export_queryset(self.export_kind, queryset=queryset)
+        return export_response(request, self.export_kind, rows, 'ndjson')
+    export_ndjson.short_description = "خروجی NDJSON"
 
 @admin.register(WalletUser)
-class WalletUserAdmin(admin.ModelAdmin):
+class WalletUserAdmin(WalletCacheInvalidationMixin, admin.ModelAdmin):
+    wallet_address_lookup = 'wallet_address'
     list_display = (
         'wallet_address_short',
         'referral_code',
         'token_balance_display',
         'total_earned_display',
         'total_staked_display',
-        'referral_count',
+        'referral_count_display',
         'created_at'
     )
     list_filter = ('created_at', 'wallet_type')
     search_fields = ('wallet_address', 'referral_code')
-    readonly_fields = ('referral_code', 'created_at', 'token_balance', 'total_earned', 'total_staked')
+    readonly_fields = ('referral_code', 'created_at', 'token_balance', 'total_earned', 'total_staked', 'downline_info')
     ordering = ('-created_at',)
     list_per_page = 25
     
@@ -26,6 +72,9 @@ class WalletUserAdmin(admin.ModelAdmin):
         ('موجودی و درآمد', {
             'fields': ('token_balance', 'total_earned', 'total_staked')
         }),
+        ('زیرمجموعه‌ها', {
+            'fields': ('downline_info',)
+        }),
         ('تاریخ‌ها', {
             'fields': ('created_at',)
         }),
@@ -47,14 +96,29 @@ class WalletUserAdmin(admin.ModelAdmin):
         return f"{obj.total_staked:.4f} ETH"
     total_staked_display.short_description = 'کل استیک شده'
     
-    def referral_count(self, obj):
-        count = obj.made_referrals.count()
-        return f"{count} نفر"
-    referral_count.short_description = 'زیرمجموعه'
+    def referral_count_display(self, obj):
+        # شمارنده روی خود ردیف؛ بدون کوئری جدا برای هر سطر
+        return f"{obj.referral_count} نفر"
+    referral_count_display.short_description = 'زیرمجموعه'
+    referral_count_display.admin_order_field = 'referral_count'
+    
+    def downline_info(self, obj):
+        """فیلد فقط خواندنی: خلاصه سطوح زیرمجموعه از جدول بستار"""
+        if obj.pk is None:
+            return "-"
+        levels = downline_levels(obj)
+        if not levels:
+            return "بدون زیرمجموعه"
+        total = sum(level['members'] for level in levels)
+        staked = sum(level['total_staked'] or 0 for level in levels)
+        per_level = '، '.join(f"سطح {level['depth']}: {level['members']} نفر" for level in levels)
+        return f"{total} نفر ({staked:.4f} ETH استیک) — {per_level}"
+    downline_info.short_description = 'درخت زیرمجموعه'
 
 
 @admin.register(Referral)
 class ReferralAdmin(admin.ModelAdmin):
+    """رفرال‌ها فقط خواندنی؛ ثبت با register_referral همراه ReferralPath، referral_count و آمار روزانه است"""
     list_display = (
         'referrer_info',
         'referee_info',
@@ -70,6 +134,7 @@ class ReferralAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
+    list_select_related = ('referrer', 'referee')
     list_per_page = 25
     
     def referrer_info(self, obj):
@@ -85,10 +150,20 @@ class ReferralAdmin(admin.ModelAdmin):
             return "✅ پرداخت شده"
         return "❌ پرداخت نشده"
     has_received_signup_bonus_display.short_description = 'پاداش ثبت‌نام'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Staking)
-class StakingAdmin(admin.ModelAdmin):
+class StakingAdmin(ExportActionsMixin, WalletCacheInvalidationMixin, admin.ModelAdmin):
+    export_kind = 'stakings'
     list_display = (
         'user_info',
         'amount_display',
@@ -107,6 +182,7 @@ class StakingAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('staked_at', 'unlock_date', 'unlocked_at', 'days_remaining_info')
     ordering = ('-staked_at',)
+    list_select_related = ('user',)
     list_per_page = 25
     
     fieldsets = (
@@ -121,7 +197,7 @@ class StakingAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['mark_as_unlocked', 'force_unlock']
+    actions = ['mark_as_unlocked', 'force_unlock', 'export_csv', 'export_ndjson']
     
     def user_info(self, obj):
         return f"{obj.user.wallet_address[:10]}... (کد: {obj.user.referral_code})"
@@ -174,34 +250,29 @@ class StakingAdmin(admin.ModelAdmin):
     
     def mark_as_unlocked(self, request, queryset):
         """اکشن: علامت زدن به عنوان آزاد شده"""
-        updated = 0
-        for staking in queryset:
-            if not staking.is_unlocked:
-                staking.is_unlocked = True
-                staking.unlocked_at = timezone.now()
-                staking.save()
-                updated += 1
+        unlocked = unlock_stakings(
+            list(queryset.values_list('pk', flat=True)),
+            check_schedule=False
+        )
         
-        self.message_user(request, f"{updated} استیکینگ آزاد شد")
+        self.message_user(request, f"{len(unlocked)} استیکینگ آزاد شد")
     mark_as_unlocked.short_description = "علامت زدن به عنوان آزاد شده"
     
     def force_unlock(self, request, queryset):
         """اکشن: آزادسازی اجباری (برای تست)"""
-        updated = 0
-        for staking in queryset:
-            if not staking.is_unlocked:
-                staking.is_unlocked = True
-                staking.unlock_date = timezone.now()
-                staking.unlocked_at = timezone.now()
-                staking.save()
-                updated += 1
+        unlocked = unlock_stakings(
+            list(queryset.values_list('pk', flat=True)),
+            check_schedule=False,
+            reset_unlock_date=True
+        )
         
-        self.message_user(request, f"{updated} استیکینگ با موفقیت آزاد شد (اجباری)")
+        self.message_user(request, f"{len(unlocked)} استیکینگ با موفقیت آزاد شد (اجباری)")
     force_unlock.short_description = "آزادسازی اجباری (تست)"
 
 
 @admin.register(TokenReward)
-class TokenRewardAdmin(admin.ModelAdmin):
+class TokenRewardAdmin(ExportActionsMixin, WalletCacheInvalidationMixin, admin.ModelAdmin):
+    export_kind = 'rewards'
     list_display = (
         'user_info',
         'amount_display',
@@ -216,8 +287,9 @@ class TokenRewardAdmin(admin.ModelAdmin):
         'user__referral_code',
         'related_staking__tx_hash'
     )
-    readonly_fields = ('created_at', 'paid_at')
+    readonly_fields = ('created_at', 'paid_at', 'payout_batch')
     ordering = ('-created_at',)
+    list_select_related = ('user', 'related_staking')
     list_per_page = 25
     
     fieldsets = (
@@ -228,14 +300,14 @@ class TokenRewardAdmin(admin.ModelAdmin):
             'fields': ('related_staking', 'related_referral')
         }),
         ('وضعیت پرداخت', {
-            'fields': ('is_paid', 'paid_at')
+            'fields': ('is_paid', 'paid_at', 'payout_batch')
         }),
         ('تاریخ‌ها', {
             'fields': ('created_at',)
         }),
     )
     
-    actions = ['mark_as_paid']
+    actions = ['mark_as_paid', 'export_csv', 'export_ndjson']
     
     def user_info(self, obj):
         return f"{obj.user.wallet_address[:10]}... (کد: {obj.user.referral_code})"
@@ -264,18 +336,138 @@ class TokenRewardAdmin(admin.ModelAdmin):
     def related_info(self, obj):
         if obj.related_staking:
             return f"استیکینگ: {obj.related_staking.id} ({obj.related_staking.amount} ETH)"
-        elif obj.related_referral:
-            return f"رفرال: {obj.related_referral.id}"
+        elif obj.related_referral_id:
+            return f"رفرال: {obj.related_referral_id}"
         return "-"
     related_info.short_description = 'مرتبط با'
     
     def mark_as_paid(self, request, queryset):
-        """اکشن: علامت زدن به عنوان پرداخت شده"""
-        updated = queryset.update(is_paid=True, paid_at=timezone.now())
-        self.message_user(request, f"{updated} پاداش پرداخت شد")
+        """اکشن: پرداخت انتخاب‌شده‌ها در دسته‌های پرداخت (یک دسته برای هر کیف‌پول)"""
+        batch_ids = []
+        while True:
+            batches = claim_payout_batches(settings.REFERRAL_PAYOUT_CHUNK_SIZE, queryset=queryset)
+            if not batches:
+                break
+            batch_ids.extend(batch.pk for batch in batches)
+        paid = mark_batches_paid(batch_ids)
+        rewards = TokenReward.objects.filter(payout_batch_id__in=batch_ids).count()
+        self.message_user(request, f"{rewards} پاداش در {paid} دسته پرداخت شد")
     mark_as_paid.short_description = "علامت زدن به عنوان پرداخت شده"
 
 
+@admin.register(ReferralPath)
+class ReferralPathAdmin(admin.ModelAdmin):
+    """جدول بستار درخت رفرال (فقط خواندنی؛ از save_wallet نگهداری می‌شود)"""
+    list_display = ('ancestor_info', 'descendant_info', 'depth')
+    list_filter = ('depth',)
+    search_fields = ('ancestor__wallet_address', 'ancestor__referral_code')
+    list_select_related = ('ancestor', 'descendant')
+    ordering = ('ancestor', 'depth')
+    list_per_page = 25
+    
+    def ancestor_info(self, obj):
+        return f"{obj.ancestor.wallet_address[:10]}... (کد: {obj.ancestor.referral_code})"
+    ancestor_info.short_description = 'بالاسری'
+    
+    def descendant_info(self, obj):
+        return f"{obj.descendant.wallet_address[:10]}... (کد: {obj.descendant.referral_code})"
+    descendant_info.short_description = 'زیرمجموعه'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """دفتر کل فقط خواندنی است"""
+    list_display = (
+        'user_info',
+        'sequence',
+        'entry_type',
+        'token_delta',
+        'staked_delta',
+        'token_balance_after',
+        'total_staked_after',
+        'created_at'
+    )
+    list_filter = ('entry_type', 'created_at')
+    search_fields = ('user__wallet_address', 'user__referral_code')
+    list_select_related = ('user',)
+    ordering = ('-id',)
+    list_per_page = 25
+    
+    def user_info(self, obj):
+        return f"{obj.user.wallet_address[:10]}... (کد: {obj.user.referral_code})"
+    user_info.short_description = 'کاربر'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    """صف رویدادهای outbox؛ فقط خواندنی به جز تلاش دوباره"""
+    list_display = ('id', 'event_type', 'created_at', 'attempts', 'available_at', 'processed_at', 'last_error')
+    list_filter = ('event_type', ('processed_at', admin.EmptyFieldListFilter))
+    ordering = ('-id',)
+    list_per_page = 25
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        """اکشن: صفر کردن تلاش‌ها تا process_outbox دوباره برشان دارد"""
+        updated = queryset.filter(processed_at__isnull=True).update(attempts=0, available_at=timezone.now())
+        self.message_user(request, f"{updated} رویداد برای تلاش دوباره آماده شد")
+    retry_now.short_description = "تلاش دوباره"
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(PayoutBatch)
+class PayoutBatchAdmin(admin.ModelAdmin):
+    """دسته‌های پرداخت (referral/payouts.py)؛ وضعیت فقط با اکشن‌ها تغییر می‌کند"""
+    list_display = ('id', 'user', 'amount', 'reward_count', 'status', 'tx_hash', 'created_at', 'paid_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__wallet_address', 'tx_hash')
+    readonly_fields = ('user', 'amount', 'reward_count', 'status', 'created_at', 'paid_at')
+    ordering = ('-id',)
+    list_select_related = ('user',)
+    list_per_page = 25
+    actions = ['mark_paid', 'release']
+    
+    def mark_paid(self, request, queryset):
+        """اکشن: ثبت انتقال دسته‌ها و پرداخت‌شده کردن پاداش‌هایشان"""
+        paid = mark_batches_paid(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"{paid} دسته پرداخت شد")
+    mark_paid.short_description = "علامت زدن به عنوان پرداخت شده"
+    
+    def release(self, request, queryset):
+        """اکشن: ناموفق کردن دسته‌ها تا پاداش‌هایشان دوباره دسته شوند"""
+        released = release_batches(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"{released} دسته ناموفق شد و پاداش‌هایش آزاد شدند")
+    release.short_description = "ناموفق (آزاد کردن پاداش‌ها)"
+    
+    def has_add_permission(self, request):
+        return False
+
 # 📊 اضافه کردن فیلترهای پیشرفته
 class DaysRemainingFilter(admin.SimpleListFilter):
     title = 'روزهای باقی‌مانده'
@@ -317,8 +509,8 @@ StakingAdmin.list_filter += (DaysRemainingFilter,)
 # 🎯 داشبورد سفارسی
 from django.urls import path
 from django.shortcuts import render
-from django.db.models import Sum, Count, Avg
-from django.utils import timezone as tz
+from .dashboard import get_dashboard, is_stale
+from . import rollups
 
 class CustomAdminSite(admin.AdminSite):
     site_header = "🏦 مدیریت سیستم استیکینگ و رفرال"
@@ -334,71 +526,27 @@ class CustomAdminSite(admin.AdminSite):
         return custom_urls + urls
     
     def dashboard_view(self, request):
-        """داشبورد اصلی"""
-        # آمار کلی
-        total_users = WalletUser.objects.count()
-        total_referrals = Referral.objects.count()
-        total_stakings = Staking.objects.count()
-        total_rewards = TokenReward.objects.count()
-        
-        # آمار مالی
-        total_token_balance = WalletUser.objects.aggregate(
-            total=Sum('token_balance')
-        )['total'] or 0
-        
-        total_staked_amount = WalletUser.objects.aggregate(
-            total=Sum('total_staked')
-        )['total'] or 0
+        """داشبورد اصلی (از snapshot از پیش محاسبه‌شده؛ ?refresh=1 برای محاسبه مجدد)"""
+        snapshot = get_dashboard(force_refresh=request.GET.get('refresh') == '1')
         
-        total_earned_amount = WalletUser.objects.aggregate(
-            total=Sum('total_earned')
-        )['total'] or 0
-        
-        # استیکینگ‌های فعال
-        active_stakings = Staking.objects.filter(is_unlocked=False).count()
-        unlocked_stakings = Staking.objects.filter(is_unlocked=True).count()
-        
-        # کاربران امروز
-        today = tz.now().date()
-        new_users_today = WalletUser.objects.filter(created_at__date=today).count()
-        new_stakings_today = Staking.objects.filter(staked_at__date=today).count()
-        
-        # 10 کاربر برتر
-        top_referrers = WalletUser.objects.annotate(
-            ref_count=Count('made_referrals')
-        ).order_by('-ref_count')[:10]
-        
-        top_stakers = WalletUser.objects.order_by('-total_staked')[:10]
-        
-        # نمودار آماری (ساده)
         context = {
             **self.each_context(request),
-            'total_users': total_users,
-            'total_referrals': total_referrals,
-            'total_stakings': total_stakings,
-            'total_rewards': total_rewards,
-            'total_token_balance': total_token_balance,
-            'total_staked_amount': total_staked_amount,
-            'total_earned_amount': total_earned_amount,
-            'active_stakings': active_stakings,
-            'unlocked_stakings': unlocked_stakings,
-            'new_users_today': new_users_today,
-            'new_stakings_today': new_stakings_today,
-            'top_referrers': top_referrers,
-            'top_stakers': top_stakers,
+            **snapshot.data,
+            'snapshot_at': snapshot.created_at,
+            'snapshot_stale': is_stale(snapshot),
         }
         return render(request, 'admin/dashboard.html', context)
     
     def reports_view(self, request):
         """صفحه گزارشات"""
-        # آمار ماهانه
-        from django.db.models.functions import TruncMonth
-        monthly_stats = Staking.objects.annotate(
-            month=TruncMonth('staked_at')
-        ).values('month').annotate(
-            count=Count('id'),
-            total=Sum('amount')
-        ).order_by('-month')[:12]
+        # آمار ماهانه ۱۲ ماه اخیر از جدول روزانه (referral/rollups.py)
+        today = timezone.localdate()
+        months_back = today.year * 12 + today.month - 12
+        since = today.replace(year=months_back // 12, month=months_back % 12 + 1, day=1)
+        monthly_stats = [
+            {**row, 'month': row['period'], 'count': row['stakes'], 'total': row['staked_volume']}
+            for row in reversed(rollups.series('month', since, today))
+        ]
         
         context = {
             **self.each_context(request),
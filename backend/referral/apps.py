@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ReferralConfig(AppConfig):
     name = 'referral'
+
+    def ready(self):
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='referral_query_recorder')
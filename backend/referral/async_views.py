@@ -0,0 +1,81 @@
+# backend/referral/async_views.py
+"""نسخه async مسیرهای خواندنی (user-stats و staking/list)
+
+با ORM async جنگو (aget، aaggregate و پیمایش async) نوشته شده‌اند تا زیر
+ASGI هر درخواست در حال انتظار برای دیتابیس یا کش یک نخ را اشغال نکند.
+قالب پاسخ همان نسخه sync است (stats_payload و stakings_payload).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from .models import WalletUser, Staking
+from .ledger import stats_counters
+from .pagination import InvalidCursor, decode_cursor, keyset_queryset, split_page, page_size_from
+from .cache import aget_or_compute, awallet_key
+from .renderers import json_response
+from .views import STAKING_LIST_FIELDS, staking_counts, stakings_payload, user_counters, stats_payload
+
+
+async def _user_stats_payload(wallet_address):
+    """داده آمار کامل کاربر؛ None اگر کاربر پیدا نشود"""
+    try:
+        user = await WalletUser.objects.aget(wallet_address=wallet_address)
+    except WalletUser.DoesNotExist:
+        return None
+    
+    if settings.REFERRAL_STATS_USE_COUNTERS:
+        counters = user_counters(user)
+    else:
+        counters = (await sync_to_async(stats_counters)([user.pk]))[user.pk]
+    return stats_payload(user, counters)
+
+
+async def _user_stakings_payload(wallet_address, cursor, page_size):
+    """داده لیست استیکینگ‌های کاربر؛ None اگر کاربر پیدا نشود"""
+    try:
+        user = await WalletUser.objects.only('id', 'total_staked').aget(wallet_address=wallet_address)
+    except WalletUser.DoesNotExist:
+        return None
+    
+    stakings = Staking.objects.filter(user=user)
+    rows = [
+        staking async for staking in keyset_queryset(stakings.only(*STAKING_LIST_FIELDS), cursor, page_size)
+    ]
+    page, next_cursor = split_page(rows, page_size)
+    counts = await stakings.aaggregate(**staking_counts())
+    return stakings_payload(user, page, next_cursor, counts)
+
+
+@csrf_exempt
+@require_GET
+async def get_user_stats(request, wallet_address):
+    """دریافت آمار کامل کاربر"""
+    data = await aget_or_compute(
+        await awallet_key('stats', wallet_address),
+        lambda: _user_stats_payload(wallet_address)
+    )
+    if data is None:
+        return json_response({'error': 'User not found'}, status=404)
+    return json_response(data)
+
+
+@csrf_exempt
+@require_GET
+async def get_user_stakings(request, wallet_address):
+    """دریافت لیست استیکینگ‌های کاربر"""
+    cursor = request.GET.get('cursor') or ''
+    page_size = page_size_from(request)
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            return json_response({'error': 'Invalid cursor'}, status=400)
+    
+    data = await aget_or_compute(
+        await awallet_key('stakings', wallet_address, cursor, page_size),
+        lambda: _user_stakings_payload(wallet_address, cursor, page_size)
+    )
+    if data is None:
+        return json_response({'error': 'User not found'}, status=404)
+    return json_response(data)
@@ -0,0 +1,98 @@
+# backend/referral/benchmark.py
+"""ابزار مشترک دستورهای benchmark_db و benchmark_api
+
+همه اجراها روی یک دیتابیس موقت انجام می‌شوند (برای SQLite فایلی در یک پوشه
+موقت، برای PostgreSQL دیتابیس test_<name>) تا داده واقعی دست نخورد.
+"""
+import os
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import WalletUser, Staking
+from .services import register_referral, create_stakes
+
+
+@contextmanager
+def scratch_database(sqlite_path=None):
+    """ساخت دیتابیس موقت با همه migrationها و حذف آن در پایان
+
+    sqlite_path: فایل موقت SQLite؛ پیش‌فرض فایلی در یک پوشه tempfile.mkdtemp.
+    دیتابیس موقت پاک و دوباره ساخته می‌شود، پس مسیر دیتابیس اصلی پذیرفته نیست.
+    """
+    old_name = connection.settings_dict['NAME']
+    scratch_dir = None
+    if connection.vendor == 'sqlite':
+        if not sqlite_path:
+            scratch_dir = tempfile.mkdtemp(prefix='referral-bench-')
+            sqlite_path = os.path.join(scratch_dir, 'scratch.sqlite3')
+        if os.path.abspath(str(sqlite_path)) == os.path.abspath(str(old_name)):
+            raise ValueError(f'scratch database must not be the configured database: {old_name}')
+        connection.settings_dict['TEST']['NAME'] = str(sqlite_path)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def percentile(sorted_values, p):
+    """صدک p (0..1) از لیست مرتب‌شده؛ 0 برای لیست خالی"""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def seed_users(count, chain_window=5, rng=random):
+    """کاربران ساختگی با زنجیره‌های چندسطحی رفرال
+
+    معرف هر کاربر جدید از میان chain_window کاربر آخر انتخاب می‌شود، پس
+    زنجیره‌ها عمیق می‌شوند و هر کاربر چند زیرمجموعه مستقیم هم دارد.
+    """
+    users = []
+    for i in range(count):
+        with transaction.atomic():
+            user = WalletUser.objects.create(wallet_address=f'0xbench{i:034x}')
+            if users:
+                register_referral(user, rng.choice(users[-chain_window:]))
+        users.append(user)
+    return users
+
+
+def seed_stakings(users, mean=5, max_per_user=500, matured_ratio=0.1, batch_size=1000, rng=random):
+    """استیکینگ‌های ساختگی با توزیع دم‌بلند (پارتو) به ازای هر کاربر
+
+    بیشتر کاربران چند استیکینگ دارند و تعداد کمی صدها. سهم matured_ratio
+    از استیکینگ‌ها سررسیده علامت می‌خورند تا مسیر آزادسازی هم قابل اجرا باشد.
+    خروجی: شناسه استیکینگ‌های سررسیده
+    """
+    wallets = {
+        row['pk']: row
+        for row in WalletUser.objects.values('pk', 'referred_by__id', 'referred_by__referrer_id')
+    }
+    specs = []
+    for user in users:
+        wallet = wallets[user.pk]
+        count = min(max_per_user, int(rng.paretovariate(1.2) * mean / 6) + 1)
+        specs.extend(
+            {
+                'user_id': user.pk,
+                'amount': Decimal(rng.randint(1, 10000)) / 100,
+                'referral_id': wallet['referred_by__id'],
+                'referrer_id': wallet['referred_by__referrer_id'],
+            }
+            for _ in range(count)
+        )
+
+    staking_ids = []
+    for start in range(0, len(specs), batch_size):
+        staking_ids.extend(staking.pk for staking, _ in create_stakes(specs[start:start + batch_size]))
+
+    matured = rng.sample(staking_ids, int(len(staking_ids) * matured_ratio))
+    Staking.objects.filter(pk__in=matured).update(unlock_date=timezone.now() - timezone.timedelta(days=1))
+    return matured
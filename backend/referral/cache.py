@@ -0,0 +1,132 @@
+# backend/referral/cache.py
+import asyncio
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# کلیدهای هر کیف‌پول با یک شماره نسخه ساخته می‌شوند؛ ابطال = افزایش نسخه.
+# این کار همه صفحه‌های لیست استیکینگ را یک‌جا باطل می‌کند و اگر خواننده‌ای
+# مقدار قدیمی را بعد از ابطال بنویسد، زیر نسخه قدیمی می‌ماند و دیده نمی‌شود.
+KEY_PREFIX = 'referral'
+LOCK_TIMEOUT = 10  # ثانیه؛ سقف زمان محاسبه مجدد یک کلید
+LOCK_WAIT = 2  # ثانیه؛ حداکثر انتظار برای محاسبه‌ای که پردازش دیگری انجام می‌دهد
+LOCK_POLL = 0.05
+
+
+def get_cache():
+    return caches[settings.REFERRAL_CACHE_ALIAS]
+
+
+def _wallet_id(wallet_address):
+    return hashlib.md5(wallet_address.encode()).hexdigest()
+
+
+def _version_key(wallet_address):
+    return f'{KEY_PREFIX}:ver:{_wallet_id(wallet_address)}'
+
+
+def wallet_key(kind, wallet_address, *parts):
+    """کلید نسخه‌دار برای یک نوع داده از یک کیف‌پول"""
+    version = get_cache().get(_version_key(wallet_address), 0)
+    suffix = ':'.join(str(part) for part in parts)
+    return f'{KEY_PREFIX}:{kind}:{_wallet_id(wallet_address)}:{version}:{suffix}'
+
+
+async def awallet_key(kind, wallet_address, *parts):
+    """نسخه async از wallet_key"""
+    version = await get_cache().aget(_version_key(wallet_address), 0)
+    suffix = ':'.join(str(part) for part in parts)
+    return f'{KEY_PREFIX}:{kind}:{_wallet_id(wallet_address)}:{version}:{suffix}'
+
+
+def invalidate_wallets(wallet_addresses):
+    """ابطال همه داده‌های کش‌شده این کیف‌پول‌ها"""
+    cache = get_cache()
+    for wallet_address in set(wallet_addresses):
+        key = _version_key(wallet_address)
+        # add برای کلید جدید، incr برای کلید موجود (اتمیک در memcached/redis)
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=None)
+
+
+def invalidate_wallets_on_commit(wallet_addresses):
+    """ابطال بعد از commit تراکنش جاری (یا فوراً اگر تراکنشی باز نیست)"""
+    wallet_addresses = list(wallet_addresses)
+    transaction.on_commit(lambda: invalidate_wallets(wallet_addresses))
+
+
+def get_or_compute(key, compute):
+    """کش read-through با محافظت در برابر هجوم (stampede)
+
+    هر مقدار با یک «مهلت تازگی» ذخیره می‌شود و تا REFERRAL_CACHE_STALE_GRACE
+    بعد از آن هم در کش می‌ماند. وقتی مقدار کهنه شد فقط پردازشی که قفل را
+    بگیرد دوباره محاسبه می‌کند و بقیه همان مقدار کهنه را برمی‌گردانند. اگر
+    مقداری نباشد، بقیه کمی منتظر نتیجه صاحب قفل می‌مانند.
+    compute اگر None برگرداند چیزی ذخیره نمی‌شود (مثلاً کاربر پیدا نشد).
+    """
+    timeout = settings.REFERRAL_CACHE_TIMEOUT
+    if not timeout:
+        return compute()
+
+    cache = get_cache()
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until or not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        deadline = time.time() + LOCK_WAIT
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        return compute()
+
+    try:
+        value = compute()
+        if value is not None:
+            cache.set(key, (value, time.time() + timeout), timeout + settings.REFERRAL_CACHE_STALE_GRACE)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+async def aget_or_compute(key, compute):
+    """نسخه async از get_or_compute؛ compute یک تابع async است
+
+    انتظار برای صاحب قفل با asyncio.sleep انجام می‌شود و نخی را اشغال نمی‌کند.
+    """
+    timeout = settings.REFERRAL_CACHE_TIMEOUT
+    if not timeout:
+        return await compute()
+
+    cache = get_cache()
+    lock_key = f'{key}:lock'
+    entry = await cache.aget(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until or not await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+            return value
+    elif not await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+        deadline = time.time() + LOCK_WAIT
+        while time.time() < deadline:
+            await asyncio.sleep(LOCK_POLL)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry[0]
+        return await compute()
+
+    try:
+        value = await compute()
+        if value is not None:
+            await cache.aset(key, (value, time.time() + timeout), timeout + settings.REFERRAL_CACHE_STALE_GRACE)
+    finally:
+        await cache.adelete(lock_key)
+    return value
@@ -0,0 +1,79 @@
+# backend/referral/dashboard.py
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from . import leaderboard
+from .cache import KEY_PREFIX, get_or_compute
+from .models import WalletUser, Referral, Staking, TokenReward, DashboardSnapshot
+
+
+def compute_dashboard():
+    """محاسبه آمار داشبورد با چند تجمیع گروهی به جای ده‌ها count و Sum جدا"""
+    today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_end = today_start + timezone.timedelta(days=1)
+
+    users = WalletUser.objects.aggregate(
+        total_users=Count('id'),
+        total_token_balance=Sum('token_balance'),
+        total_staked_amount=Sum('total_staked'),
+        total_earned_amount=Sum('total_earned'),
+        new_users_today=Count('id', filter=Q(created_at__gte=today_start, created_at__lt=today_end)),
+    )
+    stakings = Staking.objects.aggregate(
+        total_stakings=Count('id'),
+        active_stakings=Count('id', filter=Q(is_unlocked=False)),
+        unlocked_stakings=Count('id', filter=Q(is_unlocked=True)),
+        new_stakings_today=Count('id', filter=Q(staked_at__gte=today_start, staked_at__lt=today_end)),
+    )
+
+    return {
+        **users,
+        **stakings,
+        'total_token_balance': users['total_token_balance'] or 0,
+        'total_staked_amount': users['total_staked_amount'] or 0,
+        'total_earned_amount': users['total_earned_amount'] or 0,
+        'total_referrals': Referral.objects.count(),
+        'total_rewards': TokenReward.objects.count(),
+        # از ایندکس‌های جدول رتبه خوانده می‌شوند (referral/leaderboard.py)
+        'top_referrers': leaderboard.top('referrers', 10),
+        'top_stakers': leaderboard.top('stakers', 10),
+    }
+
+
+def refresh_dashboard():
+    return DashboardSnapshot.objects.create(data=compute_dashboard())
+
+
+def get_dashboard(force_refresh=False):
+    """آخرین snapshot، حتی اگر کهنه باشد؛ محاسبه مجدد دوره‌ای کار refresh_dashboard است
+
+    فقط وقتی هنوز هیچ snapshotی نیست همین‌جا ساخته می‌شود، پشت قفل
+    get_or_compute تا درخواست‌های هم‌زمان یک بار محاسبه کنند.
+    force_refresh: محاسبه صریح (?refresh=1 در ادمین).
+    """
+    if force_refresh:
+        return refresh_dashboard()
+    snapshot = _latest_snapshot()
+    if snapshot is None:
+        snapshot = get_or_compute(f'{KEY_PREFIX}:dashboard:first', _first_snapshot)
+    return snapshot
+
+
+def is_stale(snapshot):
+    """آیا snapshot قدیمی‌تر از REFERRAL_DASHBOARD_MAX_AGE است؟"""
+    return timezone.now() - snapshot.created_at > timezone.timedelta(seconds=settings.REFERRAL_DASHBOARD_MAX_AGE)
+
+
+def _latest_snapshot():
+    return DashboardSnapshot.objects.order_by('-created_at').first()
+
+
+def _first_snapshot():
+    # صاحب قفل دوباره نگاه می‌کند؛ شاید درخواست دیگری همین حالا ساخته باشد
+    return _latest_snapshot() or refresh_dashboard()
+
+
+def prune_snapshots(keep):
+    """حذف snapshotهای قدیمی و نگه داشتن keep مورد آخر"""
+    stale_ids = DashboardSnapshot.objects.order_by('-created_at').values_list('id', flat=True)[keep:]
+    return DashboardSnapshot.objects.filter(id__in=list(stale_ids)).delete()[0]
@@ -0,0 +1,190 @@
+# backend/referral/export.py
+"""خروجی جریانی کامل پاداش‌ها و استیکینگ‌ها (CSV یا NDJSON) برای تطبیق مالی
+
+سطرها به ترتیب id و با iterator(chunk_size) خوانده می‌شوند (در PostgreSQL با
+cursor سمت سرور)، پس حافظه مصرفی مستقل از تعداد سطرهاست. ستون اول هر سطر id
+است و اگر خروجی نیمه‌کاره قطع شود با after_id = آخرین id نوشته‌شده ادامه
+می‌یابد. مبلغ‌ها همان ارقام Decimal ذخیره‌شده هستند (رشته در NDJSON) و
+زمان‌ها ISO 8601.
+
+زیر ASGI پاسخ با astream_rows (chunk به chunk با sync_to_async) ساخته می‌شود؛
+StreamingHttpResponse یک iterator همگام را زیر ASGI با sync_to_async(list)
+کامل در حافظه می‌خواند.
+"""
+import csv
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .models import Staking, TokenReward
+
+EXPORTS = {
+    'rewards': {
+        'model': TokenReward,
+        'date_field': 'created_at',
+        'columns': [
+            ('id', 'id'),
+            ('wallet_address', 'user__wallet_address'),
+            ('reward_type', 'reward_type'),
+            ('amount', 'amount'),
+            ('is_paid', 'is_paid'),
+            ('paid_at', 'paid_at'),
+            ('payout_batch_id', 'payout_batch_id'),
+            ('related_staking_id', 'related_staking_id'),
+            ('related_referral_id', 'related_referral_id'),
+            ('created_at', 'created_at'),
+        ],
+    },
+    'stakings': {
+        'model': Staking,
+        'date_field': 'staked_at',
+        'columns': [
+            ('id', 'id'),
+            ('wallet_address', 'user__wallet_address'),
+            ('amount', 'amount'),
+            ('bonus_received', 'bonus_received'),
+            ('referrer_bonus', 'referrer_bonus'),
+            ('tx_hash', 'tx_hash'),
+            ('staked_at', 'staked_at'),
+            ('unlock_date', 'unlock_date'),
+            ('is_unlocked', 'is_unlocked'),
+            ('unlocked_at', 'unlocked_at'),
+        ],
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def export_queryset(kind, queryset=None, since=None, until=None, reward_type=None, paid=None, after_id=0):
+    """سطرهای خروجی به ترتیب id با فیلترهای اختیاری
+
+    since و until روزهای شمول بازه هستند؛ reward_type و paid فقط برای rewards.
+    queryset: نقطه شروع (مثلاً انتخاب یا فیلترهای changelist ادمین).
+    """
+    export = EXPORTS[kind]
+    if queryset is None:
+        queryset = export['model'].objects.all()
+    date_field = export['date_field']
+    if since:
+        queryset = queryset.filter(**{f'{date_field}__gte': _day_start(since)})
+    if until:
+        queryset = queryset.filter(**{f'{date_field}__lt': _day_start(until + timedelta(days=1))})
+    if reward_type is not None or paid is not None:
+        if kind != 'rewards':
+            raise ValueError('reward_type and paid filters only apply to rewards')
+        if reward_type is not None:
+            queryset = queryset.filter(reward_type=reward_type)
+        if paid is not None:
+            queryset = queryset.filter(is_paid=paid)
+    if after_id:
+        queryset = queryset.filter(id__gt=after_id)
+    return queryset.order_by('id').values_list(*(path for _, path in export['columns']))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, Decimal):
+        # format 'f' بدون نماد علمی (1E-8)
+        return format(value, 'f')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return format(obj, 'f')
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+class _Echo:
+    """فایل‌نمای csv.writer که هر سطر را برمی‌گرداند به جای نوشتن"""
+
+    def write(self, value):
+        return value
+
+
+def _row_encoder(kind, fmt):
+    """(سطر سرآیند یا None، تابع تبدیل هر سطر به bytes)"""
+    names = [name for name, _ in EXPORTS[kind]['columns']]
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        return (
+            writer.writerow(names).encode(),
+            lambda row: writer.writerow([_text(value) for value in row]).encode(),
+        )
+    if fmt == 'ndjson':
+        return None, lambda row: orjson.dumps(
+            dict(zip(names, row)), default=_json_default, option=orjson.OPT_APPEND_NEWLINE
+        )
+    raise ValueError(f'Unknown export format: {fmt}')
+
+
+def stream_rows(kind, rows, fmt, chunk_size=None):
+    """تولید سطرهای خروجی (bytes) از export_queryset"""
+    chunk_size = chunk_size or settings.REFERRAL_EXPORT_CHUNK_SIZE
+    header, encode = _row_encoder(kind, fmt)
+    if header:
+        yield header
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield encode(row)
+
+
+async def astream_rows(kind, rows, fmt, chunk_size=None):
+    """نسخه async از stream_rows
+
+    هر chunk از همان iterator همگام (و cursor سمت سرور) در نخ
+    sync_to_async خوانده می‌شود. aiterator روی values_list کوئری را در نخ
+    event loop اجرا می‌کند و SynchronousOnlyOperation می‌دهد.
+    """
+    chunk_size = chunk_size or settings.REFERRAL_EXPORT_CHUNK_SIZE
+    header, encode = _row_encoder(kind, fmt)
+    if header:
+        yield header
+    iterator = None
+
+    def next_chunk():
+        nonlocal iterator
+        if iterator is None:
+            iterator = rows.iterator(chunk_size=chunk_size)
+        return list(islice(iterator, chunk_size))
+
+    try:
+        while True:
+            chunk = await sync_to_async(next_chunk)()
+            for row in chunk:
+                yield encode(row)
+            if len(chunk) < chunk_size:
+                break
+    finally:
+        if iterator is not None:
+            # بستن cursor اگر کلاینت وسط دانلود قطع شود
+            await sync_to_async(iterator.close)()
+
+
+def export_response(request, kind, rows, fmt):
+    """پاسخ جریانی فایل خروجی؛ زیر ASGI با iterator async تا حافظه ثابت بماند"""
+    stream = astream_rows if isinstance(request, ASGIRequest) else stream_rows
+    response = StreamingHttpResponse(stream(kind, rows, fmt), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(kind, fmt)}"'
+    return response
+
+
+def export_filename(kind, fmt):
+    return f'{kind}-{timezone.localtime():%Y%m%d-%H%M%S}.{fmt}'
@@ -0,0 +1,46 @@
+# backend/referral/leaderboard.py
+"""جدول‌های رتبه برترین معرف‌ها و برترین استیک‌کننده‌ها
+
+امتیاز هر جدول یکی از شمارنده‌های روی WalletUser است (referral_count و
+total_staked) که همراه ثبت رفرال و استیک در دفتر کل به‌روز می‌شوند. ایندکس
+(امتیاز نزولی، id) روی همین ستون‌ها همان «جدول مرتب» است که دیتابیس با هر
+به‌روزرسانی شمارنده نگه می‌دارد: N نفر اول فقط N سطر اول ایندکس است و رتبه
+یک کیف‌پول با شمردن سطرهای جلوتر از آن در ایندکس به دست می‌آید، بدون مرتب
+کردن کل جدول. تساوی امتیاز با id (زودتر ثبت‌نام‌کرده جلوتر) شکسته می‌شود.
+کاربر با امتیاز صفر در جدول نیست.
+"""
+from .models import WalletUser
+
+BOARDS = {
+    'referrers': 'referral_count',
+    'stakers': 'total_staked',
+}
+
+
+def top(board, limit):
+    """N نفر اول جدول به ترتیب رتبه"""
+    score = BOARDS[board]
+    rows = list(
+        WalletUser.objects.filter(**{f'{score}__gt': 0})
+        .order_by(f'-{score}', 'id')
+        .values('wallet_address', 'referral_code', score)[:limit]
+    )
+    for rank, row in enumerate(rows, start=1):
+        row['rank'] = rank
+    return rows
+
+
+def rank_of(board, wallet_address):
+    """(رتبه، امتیاز) یک کیف‌پول؛ رتبه None اگر امتیازش صفر است
+
+    WalletUser.DoesNotExist اگر کیف‌پول ثبت نشده باشد.
+    """
+    score = BOARDS[board]
+    user = WalletUser.objects.values('id', score).get(wallet_address=wallet_address)
+    value = user[score]
+    if not value:
+        return None, value
+    # دو بازه جدا روی ایندکس؛ OR در یک کوئری ممکن است به پیمایش کامل برسد
+    ahead = WalletUser.objects.filter(**{f'{score}__gt': value}).count()
+    ties_ahead = WalletUser.objects.filter(**{score: value, 'id__lt': user['id']}).count()
+    return ahead + ties_ahead + 1, value
@@ -0,0 +1,150 @@
+# backend/referral/ledger.py
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import WalletUser, Referral, TokenReward, LedgerEntry
+from .cache import invalidate_wallets_on_commit
+
+# فیلدهای تجمیعی WalletUser و دلتای متناظر در دفتر کل
+ROLLUP_FIELDS = {
+    'token_balance': 'token_delta',
+    'total_earned': 'earned_delta',
+    'total_staked': 'staked_delta',
+}
+
+# شمارنده مجموع پاداش هر نوع روی WalletUser (از earned_delta سطر)
+REWARD_TOTAL_FIELDS = {
+    'signup_referral': 'signup_rewards',
+    'staking_self': 'staking_self_rewards',
+    'staking_referral': 'staking_referral_rewards',
+}
+
+AMOUNT_FIELD = DecimalField(max_digits=20, decimal_places=8)
+AMOUNT_QUANT = Decimal('0.00000001')
+
+
+def post_entries(entries, counters=None):
+    """ثبت سطرهای دفتر کل و به‌روزرسانی تجمیعی موجودی‌ها
+
+    entries: لیست LedgerEntry ذخیره‌نشده با user_id، entry_type و دلتاها.
+    counters: شمارنده‌های صحیح اضافی برای همان UPDATE، مثل
+    {user_id: {'referral_count': 1}}.
+    ردیف کاربران با select_for_update به ترتیب صعودی pk قفل می‌شوند، سپس
+    شماره ترتیبی و موجودی بعد از هر سطر محاسبه و سطرها با یک bulk_create
+    نوشته می‌شوند. دلتاهای جمع‌شده هر کیف‌پول با یک UPDATE فیلترشده با F()
+    اعمال می‌شوند و کیف‌پول‌هایی که دلتای یکسان دارند یک UPDATE مشترک
+    می‌گیرند؛ هزینه با تعداد کیف‌پول‌ها خطی است (یک CASE با یک WHEN برای هر
+    کیف‌پول درجه دوم بود). کش خواندنی همین کیف‌پول‌ها بعد از commit باطل
+    می‌شود. باید داخل transaction.atomic صدا زده شود.
+    """
+    counters = counters or {}
+    if not entries and not counters:
+        return entries
+
+    user_ids = sorted({entry.user_id for entry in entries} | set(counters))
+    wallets = {
+        row['pk']: row
+        for row in WalletUser.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values(
+            'pk', 'wallet_address', 'ledger_sequence', *ROLLUP_FIELDS
+        )
+    }
+    invalidate_wallets_on_commit(wallet['wallet_address'] for wallet in wallets.values())
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    for entry in entries:
+        wallet = wallets[entry.user_id]
+        wallet['ledger_sequence'] += 1
+        entry.sequence = wallet['ledger_sequence']
+        user_deltas = deltas[entry.user_id]
+        for field, delta_field in ROLLUP_FIELDS.items():
+            delta = getattr(entry, delta_field) or Decimal('0')
+            wallet[field] += delta
+            setattr(entry, f'{field}_after', wallet[field])
+            user_deltas[field] += delta
+        if entry.entry_type in REWARD_TOTAL_FIELDS:
+            user_deltas[REWARD_TOTAL_FIELDS[entry.entry_type]] += entry.earned_delta
+        user_deltas['ledger_sequence'] += 1
+    for user_id, fields in counters.items():
+        for field, value in fields.items():
+            deltas[user_id][field] += value
+
+    # کیف‌پول‌های با دلتای یکسان (مثلاً استیک‌های هم‌مبلغ) یک UPDATE مشترک
+    groups = defaultdict(list)
+    for user_id, fields in deltas.items():
+        changes = tuple(sorted((field, value) for field, value in fields.items() if value))
+        if changes:
+            groups[changes].append(user_id)
+    for changes, group_ids in groups.items():
+        WalletUser.objects.filter(pk__in=group_ids).update(**{
+            field: F(field) + value for field, value in changes
+        })
+
+    return LedgerEntry.objects.bulk_create(entries)
+
+
+def stats_counters(user_ids=None):
+    """محاسبه مستقیم شمارنده‌های آمار با تجمیع شرطی (مسیر پشتیبان)
+
+    خروجی: {user_id: {'signup_rewards': ..., 'referral_count': ...}}
+    مجموع پاداش هر نوع با یک کوئری گروه‌بندی‌شده روی TokenReward به دست می‌آید.
+    """
+    rewards = TokenReward.objects.all()
+    referrals = Referral.objects.all()
+    if user_ids is not None:
+        rewards = rewards.filter(user_id__in=user_ids)
+        referrals = referrals.filter(referrer_id__in=user_ids)
+
+    result = defaultdict(lambda: {
+        **dict.fromkeys(REWARD_TOTAL_FIELDS.values(), Decimal('0')),
+        'referral_count': 0,
+    })
+    for row in rewards.values('user_id').annotate(**{
+        field: Sum('amount', filter=Q(reward_type=reward_type))
+        for reward_type, field in REWARD_TOTAL_FIELDS.items()
+    }):
+        user_id = row.pop('user_id')
+        result[user_id].update({field: value or Decimal('0') for field, value in row.items()})
+    for row in referrals.values('referrer_id').annotate(total=Count('id')):
+        result[row['referrer_id']]['referral_count'] = row['total']
+    return result
+
+
+def entry_for_reward(reward, **deltas):
+    """سطر دفتر کل متناظر با یک TokenReward"""
+    deltas.setdefault('related_staking_id', reward.related_staking_id)
+    return LedgerEntry(
+        user_id=reward.user_id,
+        entry_type=reward.reward_type,
+        related_reward=reward,
+        **deltas
+    )
+
+
+def find_drift():
+    """کاربرانی که موجودی تجمیعی‌شان با مجموع دفتر کل نمی‌خواند
+
+    مجموع‌ها با یک کوئری گروه‌بندی‌شده خوانده و در پایتون با دقت 8 رقم
+    مقایسه می‌شوند (SUM در SQLite روی REAL انجام می‌شود و دقیق نیست).
+    """
+    users = WalletUser.objects.annotate(**{
+        f'ledger_{field}': Coalesce(Sum(f'ledger_entries__{delta_field}'), Value(0, output_field=AMOUNT_FIELD))
+        for field, delta_field in ROLLUP_FIELDS.items()
+    })
+    for user in users.iterator(chunk_size=2000):
+        for field in ROLLUP_FIELDS:
+            expected = Decimal(getattr(user, f'ledger_{field}')).quantize(AMOUNT_QUANT)
+            setattr(user, f'ledger_{field}', expected)
+            if expected != getattr(user, field):
+                yield user
+                break
+
+
+def rebuild_rollup(user):
+    """بازسازی موجودی تجمیعی یک کاربر (از خروجی find_drift) از روی مجموع دفتر کل"""
+    with transaction.atomic():
+        WalletUser.objects.filter(pk=user.pk).update(**{
+            field: getattr(user, f'ledger_{field}') for field in ROLLUP_FIELDS
+        })
+        invalidate_wallets_on_commit([user.wallet_address])
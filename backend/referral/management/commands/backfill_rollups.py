@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from referral.models import WalletUser
+from referral.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = 'ساخت دوباره آمار روزانه (DailyStats) از جدول‌های کاربر، رفرال، استیکینگ و پاداش'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='اولین روز (YYYY-MM-DD)؛ پیش‌فرض روز ثبت اولین کاربر')
+        parser.add_argument('--until', help='آخرین روز (YYYY-MM-DD)؛ پیش‌فرض امروز')
+
+    def handle(self, *args, **options):
+        until = self.parse(options['until']) or timezone.localdate()
+        since = self.parse(options['since'])
+        if since is None:
+            first = WalletUser.objects.aggregate(first=Min('created_at'))['first']
+            since = timezone.localdate(first) if first else until
+        if since > until:
+            raise CommandError('--since بعد از --until است')
+
+        days = backfill(since, until)
+        self.stdout.write(self.style.SUCCESS(f'آمار {days} روز از {since} تا {until} ساخته شد'))
+
+    def parse(self, value):
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError(f'تاریخ نامعتبر: {value}')
+        return parsed
@@ -0,0 +1,220 @@
+import itertools
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from referral.benchmark import percentile, scratch_database, seed_stakings, seed_users
+from referral.models import WalletUser
+
+# سهم هر endpoint از درخواست‌ها (نام مسیرها در referral/urls.py)
+DEFAULT_MIX = {
+    'save_wallet': 10,
+    'user_stats': 30,
+    'process_staking': 15,
+    'process_staking_batch': 2,
+    'user_stakings': 25,
+    'unlock_staking': 5,
+    'user_downline': 8,
+    'downline_level': 5,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'بار هم‌زمان روی همه endpointهای referral/urls.py با داده ساختگی و ثبت '
+        'تأخیر p50/p95/p99، توان عملیاتی و تعداد کوئری هر درخواست در فایل JSON. '
+        'دیتابیس از تنظیمات فعلی (DB_ENGINE=sqlite یا postgres) گرفته می‌شود.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='تعداد کاربر ساختگی')
+        parser.add_argument('--stakes-per-user', type=float, default=5, help='میانگین استیکینگ هر کاربر (دم‌بلند)')
+        parser.add_argument('--threads', type=int, default=8, help='تعداد کلاینت هم‌زمان')
+        parser.add_argument('--seconds', type=float, default=30, help='مدت اجرای بار')
+        parser.add_argument('--mix', default='', help='سهم endpointها، مثل user_stats=50,process_staking=10')
+        parser.add_argument('--seed', type=int, default=1, help='seed تولید داده و درخواست‌ها')
+        parser.add_argument('--label', default='', help='برچسب نسخه برای مقایسه اجراها')
+        parser.add_argument(
+            '--output',
+            default=os.path.join(tempfile.gettempdir(), 'referral-benchmark-results.json'),
+            help='مسیر فایل نتیجه (پیش‌فرض در پوشه موقت سیستم)'
+        )
+
+    def handle(self, *args, **options):
+        mix = dict(DEFAULT_MIX)
+        for item in filter(None, options['mix'].split(',')):
+            name, _, weight = item.partition('=')
+            if name not in DEFAULT_MIX:
+                raise CommandError(f'endpoint ناشناخته: {name}')
+            mix[name] = float(weight)
+
+        # محدودیت نرخ خاموش است تا خود endpointها سنجیده شوند
+        with override_settings(ALLOWED_HOSTS=['*'], REFERRAL_RATE_LIMITS={}), tempfile.TemporaryDirectory() as tmp:
+            with scratch_database(os.path.join(tmp, 'bench.sqlite3')):
+                rng = random.Random(options['seed'])
+                self.stdout.write('ساخت داده ساختگی...')
+                seeded_at = time.perf_counter()
+                users = seed_users(options['users'], rng=rng)
+                matured = seed_stakings(users, mean=options['stakes_per_user'], rng=rng)
+                self.stdout.write(f'{len(users)} کاربر در {time.perf_counter() - seeded_at:.1f} ثانیه')
+                connection.close()
+
+                started_at = timezone.now()
+                results, elapsed = LoadRun(users, matured, mix, options).run()
+                vendor = connection.vendor
+
+        report = {
+            'label': options['label'],
+            'started_at': started_at.isoformat(),
+            'environment': {
+                'database': vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+            },
+            'parameters': {
+                key: options[key] for key in ('users', 'stakes_per_user', 'threads', 'seconds', 'seed')
+            },
+            'mix': mix,
+            'total': summarize(list(itertools.chain.from_iterable(results.values())), elapsed),
+            'endpoints': {name: summarize(samples, elapsed) for name, samples in sorted(results.items())},
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        self.stdout.write(f"{'endpoint':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+        for name, row in [*report['endpoints'].items(), ('total', report['total'])]:
+            self.stdout.write(
+                f"{name:<24}{row['throughput']:>9.1f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                f"{row['p99_ms']:>9.2f}{row['queries_mean']:>9.1f}{row['errors']:>8}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"نتیجه در {options['output']} ذخیره شد"))
+
+
+def summarize(samples, elapsed):
+    """samples: لیست (ثانیه تأخیر، تعداد کوئری، وضعیت HTTP)"""
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status in samples if status >= 400),
+        'throughput': len(samples) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries_mean': sum(queries) / len(queries) if queries else 0,
+        'queries_max': max(queries, default=0),
+    }
+
+
+class LoadRun:
+    """اجرای بار با چند نخ، هر نخ با Client جنگو (کل زنجیره middleware و DRF)"""
+
+    def __init__(self, users, matured, mix, options):
+        self.wallets = [user.wallet_address for user in users]
+        self.codes = list(WalletUser.objects.values_list('referral_code', flat=True))
+        self.matured = list(matured)
+        self.mix = mix
+        self.options = options
+        self.new_wallets = itertools.count()
+        self.lock = threading.Lock()
+        self.results = {name: [] for name in mix}
+
+    def run(self):
+        deadline = time.perf_counter() + self.options['seconds']
+        threads = [
+            threading.Thread(target=self.work, args=(self.options['seed'] + i, deadline))
+            for i in range(self.options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results, time.perf_counter() - started
+
+    def work(self, seed, deadline):
+        rng = random.Random(seed)
+        client = Client()
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        samples = {name: [] for name in names}
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        try:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                request = getattr(self, name)(rng)
+                if request is None:
+                    continue
+                method, path, body = request
+                queries[0] = 0
+                started = time.perf_counter()
+                with connection.execute_wrapper(count_queries):
+                    if method == 'post':
+                        response = client.post(path, body, content_type='application/json')
+                    else:
+                        response = client.get(path, body)
+                samples[name].append((time.perf_counter() - started, queries[0], response.status_code))
+        finally:
+            connection.close()
+            with self.lock:
+                for name, rows in samples.items():
+                    self.results[name].extend(rows)
+
+    # سازنده درخواست هر endpoint: (method, path, body) یا None اگر قابل ساخت نیست
+
+    def save_wallet(self, rng):
+        return 'post', reverse('save_wallet'), {
+            'wallet_address': f'0xnew{next(self.new_wallets):036x}',
+            'referral_code': rng.choice(self.codes),
+        }
+
+    def user_stats(self, rng):
+        return 'get', reverse('user_stats', args=[rng.choice(self.wallets)]), {}
+
+    def process_staking(self, rng):
+        return 'post', reverse('process_staking'), {
+            'wallet_address': rng.choice(self.wallets),
+            'amount': rng.randint(1, 10000) / 100,
+            'tx_hash': f'0x{rng.getrandbits(256):064x}',
+        }
+
+    def process_staking_batch(self, rng):
+        return 'post', reverse('process_staking_batch'), {'stakes': [
+            {
+                'wallet_address': rng.choice(self.wallets),
+                'amount': rng.randint(1, 10000) / 100,
+                'tx_hash': f'0x{rng.getrandbits(256):064x}',
+            }
+            for _ in range(20)
+        ]}
+
+    def user_stakings(self, rng):
+        return 'get', reverse('user_stakings', args=[rng.choice(self.wallets)]), {'page_size': 50}
+
+    def unlock_staking(self, rng):
+        with self.lock:
+            if not self.matured:
+                return None
+            staking_id = self.matured.pop()
+        return 'post', reverse('unlock_staking', args=[staking_id]), {}
+
+    def user_downline(self, rng):
+        return 'get', reverse('user_downline', args=[rng.choice(self.wallets)]), {}
+
+    def downline_level(self, rng):
+        return 'get', reverse('downline_level', args=[rng.choice(self.wallets), rng.randint(1, 3)]), {}
@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connection
+from referral.benchmark import percentile, scratch_database, seed_users
+from referral.services import stake
+from referral.views import _user_stakings_payload, _user_stats_payload
+
+# هر حالت = متغیرهای محیطی تنظیمات دیتابیس (backend/settings.py)
+MODES = {
+    'sqlite': {'DB_ENGINE': 'sqlite', 'SQLITE_TUNED': '0', 'DB_CONN_MAX_AGE': '0'},
+    'sqlite-tuned': {'DB_ENGINE': 'sqlite', 'SQLITE_TUNED': '1', 'DB_CONN_MAX_AGE': '60'},
+    'postgres': {'DB_ENGINE': 'postgres', 'DB_POOL': '0', 'DB_CONN_MAX_AGE': '0'},
+    'postgres-persistent': {'DB_ENGINE': 'postgres', 'DB_POOL': '0', 'DB_CONN_MAX_AGE': '60'},
+    'postgres-pool': {'DB_ENGINE': 'postgres', 'DB_POOL': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = 'مقایسه توان عملیاتی حالت‌های دیتابیس (SQLite ساده/تنظیم‌شده، PostgreSQL با و بدون pool)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='sqlite,sqlite-tuned', help=f'از بین: {", ".join(MODES)}')
+        parser.add_argument('--threads', type=int, default=8, help='تعداد نخ هم‌زمان')
+        parser.add_argument('--seconds', type=float, default=10, help='مدت اجرای هر حالت')
+        parser.add_argument('--users', type=int, default=200, help='تعداد کاربر ساختگی')
+        parser.add_argument('--write-ratio', type=float, default=0.3, help='سهم عملیات نوشتن (stake)')
+        parser.add_argument('--json', action='store_true', help='خروجی JSON')
+        parser.add_argument('--worker', action='store_true', help='(داخلی) اجرای یک حالت در همین پردازش')
+        parser.add_argument('--scratch-path', help='(داخلی) فایل SQLite موقت اجرای worker')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_worker(options)))
+            return
+
+        results = []
+        for mode in options['modes'].split(','):
+            if mode not in MODES:
+                raise CommandError(f'حالت ناشناخته: {mode}')
+            results.append({'mode': mode, **self.run_mode(mode, options)})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<22}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<22}{row['throughput']:>10.1f}{row['p50_ms']:>10.2f}"
+                f"{row['p95_ms']:>10.2f}{row['errors']:>8}"
+            )
+
+    def run_mode(self, mode, options):
+        """اجرای یک حالت در پردازش جدا تا تنظیمات دیتابیس از نو خوانده شود"""
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**os.environ, **MODES[mode], 'SQLITE_PATH': os.path.join(tmp, 'bench.sqlite3')}
+            command = [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_db', '--worker',
+                '--scratch-path', os.path.join(tmp, 'scratch.sqlite3'),
+                '--threads', str(options['threads']), '--seconds', str(options['seconds']),
+                '--users', str(options['users']), '--write-ratio', str(options['write_ratio']),
+            ]
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{mode}: {completed.stderr.strip()}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_worker(self, options):
+        if not options['scratch_path']:
+            raise CommandError('--worker نیاز به --scratch-path دارد')
+        with scratch_database(options['scratch_path']):
+            users = seed_users(options['users'])
+            connection.close()
+
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            deadline = time.perf_counter() + options['seconds']
+
+            def work(seed):
+                rng = random.Random(seed)
+                local = []
+                failed = 0
+                try:
+                    while time.perf_counter() < deadline:
+                        user = rng.choice(users)
+                        started = time.perf_counter()
+                        try:
+                            if rng.random() < options['write_ratio']:
+                                stake(user, Decimal(rng.randint(1, 1000)))
+                            elif rng.random() < 0.5:
+                                _user_stats_payload(user.wallet_address)
+                            else:
+                                _user_stakings_payload(user.wallet_address, '', 50)
+                            local.append(time.perf_counter() - started)
+                        except DatabaseError:
+                            failed += 1
+                        # همان کاری که جنگو در پایان هر درخواست انجام می‌دهد
+                        close_old_connections()
+                finally:
+                    connection.close()
+                    with lock:
+                        latencies.extend(local)
+                        errors[0] += failed
+
+            threads = [threading.Thread(target=work, args=(seed,)) for seed in range(options['threads'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+
+        return {
+            'threads': options['threads'],
+            'operations': len(latencies),
+            'errors': errors[0],
+            'throughput': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+        }
@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.auth.models import User
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.decorators import api_view, authentication_classes
+from rest_framework.response import Response
+from referral.benchmark import scratch_database
+
+# زنجیره قبلی: همه middlewareها برای همه مسیرها و احراز هویت پیش‌فرض DRF
+LEGACY_MIDDLEWARE = [
+    'referral.metrics.RequestMetricsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+def legacy_ping(request):
+    return Response({'ok': True})
+
+
+@api_view(['GET'])
+def ping(request):
+    return Response({'ok': True})
+
+
+# view بدون کار تا فقط هزینه middleware و DRF اندازه گرفته شود
+urlpatterns = [
+    path('api/legacy-ping/', legacy_ping),
+    path('api/ping/', ping),
+]
+
+
+class Command(BaseCommand):
+    help = 'هزینه هر درخواست API با زنجیره کامل middleware در برابر مسیر سبک /api/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='تعداد درخواست هر حالت')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            # کاربری که از ادمین همان دامنه کوکی session دارد
+            user = User.objects.create_user('bench')
+            session = SessionStore()
+            session['_auth_user_id'] = str(user.pk)
+            session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+            session['_auth_user_hash'] = user.get_session_auth_hash()
+            session.create()
+
+            rows = []
+            for name, session_key in (('no cookie', None), ('admin session cookie', session.session_key)):
+                full = self.measure(LEGACY_MIDDLEWARE, '/api/legacy-ping/', session_key, options['requests'])
+                lean = self.measure(settings.MIDDLEWARE, '/api/ping/', session_key, options['requests'])
+                rows.append((name, full, lean))
+
+        self.stdout.write(f"{'request':<24}{'full µs':>10}{'lean µs':>10}{'saved µs':>10}")
+        for name, full, lean in rows:
+            self.stdout.write(f'{name:<24}{full:>10.1f}{lean:>10.1f}{full - lean:>10.1f}')
+
+    def measure(self, middleware, url, session_key, count):
+        with override_settings(MIDDLEWARE=middleware):
+            handler = BaseHandler()
+            handler.load_middleware()
+
+        factory = RequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        if session_key:
+            factory.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        timings = []
+        # دور اول گرم‌کردن (import و کش resolver) حساب نمی‌شود
+        for index in range(count + 200):
+            request = factory.get(url, HTTP_ORIGIN='http://localhost:3000')
+            request.urlconf = __name__
+            started = time.perf_counter()
+            response = handler.get_response(request)
+            if index >= 200:
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: HTTP {response.status_code}')
+        return statistics.median(timings) * 1_000_000
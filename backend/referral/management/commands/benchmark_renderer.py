@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from referral.models import WalletUser, Staking
+from referral.renderers import ORJSONRenderer
+from referral.views import stakings_payload
+
+
+def legacy_payload(data):
+    """قالب قبلی پاسخ: هر Decimal با float و هر datetime با isoformat"""
+    if isinstance(data, dict):
+        return {key: legacy_payload(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [legacy_payload(value) for value in data]
+    if isinstance(data, Decimal):
+        return float(data)
+    if isinstance(data, datetime):
+        return data.isoformat()
+    return data
+
+
+class Command(BaseCommand):
+    help = 'مقایسه زمان ساخت و رندر پاسخ get_user_stakings بزرگ با JSONRenderer و ORJSONRenderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stakes', type=int, default=10000, help='تعداد استیکینگ در پاسخ')
+        parser.add_argument('--repeat', type=int, default=20, help='تعداد تکرار هر حالت')
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        now = timezone.now()
+        user = WalletUser(total_staked=Decimal('0'))
+        page = []
+        for pk in range(options['stakes'], 0, -1):
+            amount = Decimal(rng.randint(1, 10 ** 12)) / 10 ** 8
+            staked_at = now - timezone.timedelta(minutes=pk)
+            page.append(Staking(
+                id=pk,
+                amount=amount,
+                bonus_received=amount * Decimal('0.05'),
+                referrer_bonus=amount * Decimal('0.05'),
+                staked_at=staked_at,
+                unlock_date=staked_at + timezone.timedelta(days=Staking.LOCK_DAYS),
+                tx_hash=f'0x{rng.getrandbits(256):064x}',
+            ))
+            user.total_staked += amount
+        counts = {'active': len(page), 'completed': 0}
+
+        def build():
+            return stakings_payload(user, page, None, counts)
+
+        cases = {
+            'JSONRenderer (float)': lambda: JSONRenderer().render(legacy_payload(build())),
+            'ORJSONRenderer (number)': lambda: ORJSONRenderer().render(build()),
+        }
+        results = {name: self.measure(render, options['repeat']) for name, render in cases.items()}
+        with override_settings(REFERRAL_JSON_DECIMAL='string'):
+            results['ORJSONRenderer (string)'] = self.measure(cases['ORJSONRenderer (number)'], options['repeat'])
+
+        baseline = results['JSONRenderer (float)'][0]
+        self.stdout.write(f"{options['stakes']} استیکینگ، میانه {options['repeat']} اجرا")
+        self.stdout.write(f"{'renderer':<26}{'ms':>10}{'KB':>10}{'speedup':>10}")
+        for name, (seconds, size) in results.items():
+            self.stdout.write(f'{name:<26}{seconds * 1000:>10.1f}{size / 1024:>10.0f}{baseline / seconds:>9.1f}x')
+
+    def measure(self, render, repeat):
+        """میانه زمان ساخت + رندر پاسخ و اندازه خروجی"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = render()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings), len(body)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from referral.payouts import claim_payout_batches
+
+
+class Command(BaseCommand):
+    help = 'دسته‌بندی پاداش‌های پرداخت‌نشده در یک انتقال برای هر کیف‌پول (قابل اجرای هم‌زمان)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.REFERRAL_PAYOUT_CHUNK_SIZE, help='تعداد پاداش در هر تراکنش')
+        parser.add_argument('--max-chunks', type=int, default=0, help='حداکثر تعداد دسته (0 = تا پایان)')
+
+    def handle(self, *args, **options):
+        batches = 0
+        rewards = 0
+        chunks = 0
+        while not options['max_chunks'] or chunks < options['max_chunks']:
+            claimed = claim_payout_batches(options['chunk_size'])
+            if not claimed:
+                break
+            chunks += 1
+            batches += len(claimed)
+            rewards += sum(batch.reward_count for batch in claimed)
+            self.stdout.write(f'دسته {chunks}: {len(claimed)} دسته پرداخت ساخته شد')
+
+        self.stdout.write(self.style.SUCCESS(f'{rewards} پاداش در {batches} دسته پرداخت قرار گرفت'))
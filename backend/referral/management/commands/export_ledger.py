@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from referral.export import EXPORTS, FORMATS, export_queryset, stream_rows
+from referral.models import TokenReward
+
+
+class Command(BaseCommand):
+    help = 'خروجی جریانی کامل پاداش‌ها یا استیکینگ‌ها به CSV یا NDJSON (برای تطبیق مالی)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='مسیر فایل خروجی؛ پیش‌فرض stdout')
+        parser.add_argument('--since', help='اولین روز (YYYY-MM-DD)')
+        parser.add_argument('--until', help='آخرین روز (YYYY-MM-DD)')
+        parser.add_argument(
+            '--reward-type',
+            choices=[value for value, _ in TokenReward._meta.get_field('reward_type').choices],
+            help='فقط rewards'
+        )
+        parser.add_argument('--paid', choices=['yes', 'no'], help='فقط rewards')
+        parser.add_argument('--after-id', type=int, default=0, help='ادامه خروجی بعد از این id')
+        parser.add_argument('--chunk-size', type=int, default=settings.REFERRAL_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            rows = export_queryset(
+                options['kind'],
+                since=self.parse(options['since']),
+                until=self.parse(options['until']),
+                reward_type=options['reward_type'],
+                paid=None if options['paid'] is None else options['paid'] == 'yes',
+                after_id=options['after_id'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        chunks = stream_rows(options['kind'], rows, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
+
+    def parse(self, value):
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError(f'تاریخ نامعتبر: {value}')
+        return parsed
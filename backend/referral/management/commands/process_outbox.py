@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from referral.models import OutboxEvent
+from referral.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'اعمال رویدادهای outbox (پاداش‌ها و موجودی استیکینگ‌ها) به صورت دسته‌ای'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.REFERRAL_OUTBOX_BATCH_SIZE, help='تعداد رویداد در هر تراکنش')
+        parser.add_argument('--max-attempts', type=int, default=settings.REFERRAL_OUTBOX_MAX_ATTEMPTS, help='حداکثر تلاش برای هر رویداد')
+        parser.add_argument('--poll', type=float, default=1.0, help='فاصله بررسی وقتی رویدادی نیست (ثانیه)')
+        parser.add_argument('--once', action='store_true', help='خالی کردن صف فعلی و خروج')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            done, failed = drain_outbox(options['batch_size'], options['max_attempts'])
+            total += done
+            if done or failed:
+                self.stdout.write(f'{done} رویداد اعمال شد، {failed} ناموفق')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+
+        dead = OutboxEvent.objects.filter(processed_at__isnull=True, attempts__gte=options['max_attempts']).count()
+        if dead:
+            self.stdout.write(self.style.ERROR(f'{dead} رویداد بعد از {options["max_attempts"]} تلاش متوقف مانده است'))
+        self.stdout.write(self.style.SUCCESS(f'{total} رویداد اعمال شد'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from referral.dashboard import prune_snapshots, refresh_dashboard
+
+
+class Command(BaseCommand):
+    help = 'محاسبه snapshot جدید آمار داشبورد ادمین (برای اجرای دوره‌ای با cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=100, help='تعداد snapshotهای نگه‌داشته‌شده')
+
+    def handle(self, *args, **options):
+        snapshot = refresh_dashboard()
+        pruned = prune_snapshots(options['keep'])
+        self.stdout.write(self.style.SUCCESS(
+            f'snapshot {snapshot.pk} ساخته شد ({pruned} snapshot قدیمی حذف شد)'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from referral.services import unlock_matured_chunk
+
+
+class Command(BaseCommand):
+    help = 'آزادسازی گروهی استیکینگ‌هایی که موعدشان رسیده (قابل اجرای هم‌زمان و ادامه‌پذیر)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='تعداد استیکینگ در هر تراکنش')
+        parser.add_argument('--max-chunks', type=int, default=0, help='حداکثر تعداد دسته (0 = تا پایان)')
+
+    def handle(self, *args, **options):
+        total = 0
+        chunks = 0
+        while not options['max_chunks'] or chunks < options['max_chunks']:
+            unlocked = unlock_matured_chunk(options['chunk_size'])
+            if not unlocked:
+                break
+            chunks += 1
+            total += len(unlocked)
+            self.stdout.write(f'دسته {chunks}: {len(unlocked)} استیکینگ آزاد شد')
+
+        self.stdout.write(self.style.SUCCESS(f'{total} استیکینگ در {chunks} دسته آزاد شد'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from referral.ledger import find_drift, rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = 'بررسی همخوانی موجودی کاربران با مجموع دفتر کل'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='بازسازی موجودی‌های ناهمخوان از روی دفتر کل')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for user in find_drift():
+            drifted += 1
+            self.stdout.write(
+                f"{user.wallet_address}: "
+                f"token_balance={user.token_balance} (ledger {user.ledger_token_balance}), "
+                f"total_earned={user.total_earned} (ledger {user.ledger_total_earned}), "
+                f"total_staked={user.total_staked} (ledger {user.ledger_total_staked})"
+            )
+            if options['fix']:
+                rebuild_rollup(user)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('همه موجودی‌ها با دفتر کل همخوان است'))
+        elif options['fix']:
+            self.stdout.write(self.style.WARNING(f'{drifted} کاربر از روی دفتر کل بازسازی شد'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{drifted} کاربر ناهمخوان'))
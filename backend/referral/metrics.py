@@ -0,0 +1,255 @@
+# backend/referral/metrics.py
+"""سنجش هر view: تأخیر، تعداد و زمان کوئری‌ها و اندازه پاسخ
+
+RequestMetricsMiddleware برای هر درخواست یک QueryRecorder در contextvar
+می‌گذارد. record_query روی هر اتصال دیتابیس (سیگنال connection_created) نصب
+است و کوئری را برای recorder همان context ثبت می‌کند؛ زیر ASGI کوئری‌های ORM
+در نخ‌های sync_to_async اجرا می‌شوند که context درخواست را به ارث می‌برند
+ولی اتصال‌های خودشان را دارند. نتیجه در هیستوگرام‌های همان پردازش جمع
+می‌شود و با metrics_view (قالب Prometheus) و metrics_json_view خوانده
+می‌شود. با چند worker هر پردازش آمار خودش را دارد و هر scrape فقط آمار
+workerی را می‌بیند که درخواست به آن رسیده است.
+درخواست‌های کندتر از REFERRAL_SLOW_REQUEST_MS با SQL اجراشده در لاگ
+referral.slow_requests ثبت می‌شوند.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger('referral.slow_requests')
+
+# مرزهای هیستوگرام‌ها (مثل پیش‌فرض‌های کلاینت Prometheus)
+HISTOGRAMS = {
+    'request_duration_seconds': (
+        'تأخیر کل درخواست',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'db_queries': (
+        'تعداد کوئری SQL هر درخواست',
+        (1, 2, 3, 5, 10, 20, 50, 100),
+    ),
+    'db_duration_seconds': (
+        'زمان صرف‌شده در دیتابیس در هر درخواست',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'response_size_bytes': (
+        'اندازه بدنه پاسخ',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+    ),
+}
+
+# viewهایی که خودشان سنجیده نمی‌شوند
+EXCLUDED_VIEWS = {'metrics', 'metrics_json'}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """آمار تجمیعی هر view در حافظه همین پردازش"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.statuses = {}
+
+    def observe(self, view, status, **values):
+        with self.lock:
+            histograms = self.histograms.get(view)
+            if histograms is None:
+                histograms = self.histograms[view] = {
+                    name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()
+                }
+            for name, value in values.items():
+                histograms[name].observe(value)
+            key = (view, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: {
+                    'requests': histograms['request_duration_seconds'].count,
+                    'statuses': {
+                        str(status): count for (name, status), count in sorted(self.statuses.items())
+                        if name == view
+                    },
+                    **{
+                        name: {
+                            'sum': histogram.sum,
+                            'count': histogram.count,
+                            'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+                        }
+                        for name, histogram in histograms.items()
+                    },
+                }
+                for view, histograms in sorted(self.histograms.items())
+            }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP referral_requests_total تعداد درخواست‌ها به تفکیک view و وضعیت')
+            lines.append('# TYPE referral_requests_total counter')
+            for (view, status), count in sorted(self.statuses.items()):
+                lines.append(f'referral_requests_total{{view="{view}",status="{status}"}} {count}')
+            for name, (help_text, _) in HISTOGRAMS.items():
+                metric = f'referral_{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for view, histograms in sorted(self.histograms.items()):
+                    histogram = histograms[name]
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{view="{view}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{view}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    """execute_wrapper که تعداد، زمان و (با سقف) متن کوئری‌ها را نگه می‌دارد"""
+
+    def __init__(self, max_statements):
+        self.count = 0
+        self.duration = 0
+        self.statements = []
+        self.max_statements = max_statements
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.statements) < self.max_statements:
+                self.statements.append((elapsed, sql))
+
+
+# recorder درخواست جاری؛ نخ‌های sync_to_async همین context را می‌بینند
+current_recorder = ContextVar('referral_query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper دائمی هر اتصال؛ بیرون از درخواست سنجیده‌شده فقط اجرا می‌کند"""
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """گیرنده connection_created (ReferralConfig.ready)"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetricsMiddleware:
+    """هم sync و هم async؛ زیر ASGI زنجیره بدون گذر از نخ جدا اجرا می‌شود"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(settings.REFERRAL_SLOW_REQUEST_MAX_SQL)
+        started = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.observe(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(settings.REFERRAL_SLOW_REQUEST_MAX_SQL)
+        started = time.perf_counter()
+        with self.recording(recorder):
+            response = await self.get_response(request)
+        return self.observe(request, response, recorder, time.perf_counter() - started)
+
+    @contextmanager
+    def recording(self, recorder):
+        token = current_recorder.set(recorder)
+        try:
+            yield
+        finally:
+            current_recorder.reset(token)
+
+    def observe(self, request, response, recorder, duration):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        if view in EXCLUDED_VIEWS:
+            return response
+
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(
+            view,
+            response.status_code,
+            request_duration_seconds=duration,
+            db_queries=recorder.count,
+            db_duration_seconds=recorder.duration,
+            response_size_bytes=size,
+        )
+
+        if duration * 1000 >= settings.REFERRAL_SLOW_REQUEST_MS:
+            logger.warning(
+                'slow request %s %s view=%s status=%s duration=%.1fms queries=%d db=%.1fms\n%s',
+                request.method, request.get_full_path(), view, response.status_code,
+                duration * 1000, recorder.count, recorder.duration * 1000,
+                '\n'.join(f'  [{elapsed * 1000:.1f}ms] {sql}' for elapsed, sql in recorder.statements),
+            )
+        return response
+
+
+def _authorized(request):
+    token = settings.REFERRAL_METRICS_TOKEN
+    return not token or request.headers.get('Authorization') == f'Bearer {token}'
+
+
+def metrics_view(request):
+    """آمار در قالب متنی Prometheus"""
+    if not _authorized(request):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def metrics_json_view(request):
+    """snapshot همان آمار به صورت JSON"""
+    if not _authorized(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(registry.snapshot())
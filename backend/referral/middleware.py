@@ -0,0 +1,50 @@
+# backend/referral/middleware.py
+"""نسخه‌های middlewareهای ادمین که برای مسیرهای API کنار می‌روند
+
+API (referral.urls زیر REFERRAL_API_PREFIX) از session، کاربر جنگو، پیام‌ها،
+CSRF (همه viewها csrf_exempt هستند) و هدر X-Frame-Options استفاده نمی‌کند.
+این کلاس‌ها در MIDDLEWARE جای نسخه اصلی را می‌گیرند: برای ادمین همان رفتار
+قبلی را دارند و درخواست API را بدون هیچ کاری به لایه بعد می‌دهند. CORS و
+SecurityMiddleware برای همه مسیرها اجرا می‌شوند.
+"""
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+def is_api_request(request):
+    return request.path_info.startswith(settings.REFERRAL_API_PREFIX)
+
+
+class SkipForApiMixin:
+    def __call__(self, request):
+        if is_api_request(request):
+            # در حالت async خروجی get_response خودش awaitable است
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class ApiSessionMiddleware(SkipForApiMixin, SessionMiddleware):
+    pass
+
+
+class ApiCsrfViewMiddleware(SkipForApiMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class ApiAuthenticationMiddleware(SkipForApiMixin, AuthenticationMiddleware):
+    pass
+
+
+class ApiMessageMiddleware(SkipForApiMixin, MessageMiddleware):
+    pass
+
+
+class ApiXFrameOptionsMiddleware(SkipForApiMixin, XFrameOptionsMiddleware):
+    pass
@@ -0,0 +1,62 @@
+# Generated by Django 6.0 on 2026-10-18 06:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """سطر موجودی افتتاحیه برای کاربرانی که قبل از دفتر کل موجودی داشته‌اند"""
+    WalletUser = apps.get_model('referral', 'WalletUser')
+    LedgerEntry = apps.get_model('referral', 'LedgerEntry')
+    users = WalletUser.objects.exclude(token_balance=0, total_earned=0, total_staked=0)
+    for user in users.iterator(chunk_size=2000):
+        LedgerEntry.objects.create(
+            user=user,
+            sequence=1,
+            entry_type='opening_balance',
+            token_delta=user.token_balance,
+            earned_delta=user.total_earned,
+            staked_delta=user.total_staked,
+            token_balance_after=user.token_balance,
+            total_earned_after=user.total_earned,
+            total_staked_after=user.total_staked,
+        )
+    users.update(ledger_sequence=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0003_remove_tokenreward_related_purchase_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletuser',
+            name='ledger_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('entry_type', models.CharField(choices=[('opening_balance', 'موجودی افتتاحیه'), ('signup_referral', 'پاداش ثبت\u200cنام زیرمجموعه'), ('staking_self', 'استیکینگ و پاداش خود کاربر'), ('staking_referral', 'پاداش استیکینگ زیرمجموعه'), ('staking_unlock', 'برداشت از استیکینگ')], max_length=50)),
+                ('token_delta', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('earned_delta', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('staked_delta', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('token_balance_after', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('total_earned_after', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('total_staked_after', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('related_reward', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='referral.tokenreward')),
+                ('related_staking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='referral.staking')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='referral.walletuser')),
+            ],
+            options={
+                'ordering': ['user', 'sequence'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'sequence'), name='ledger_user_sequence_unique')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0 on 2026-10-18 06:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_counters(apps, schema_editor):
+    """مقداردهی اولیه شمارنده‌ها با تجمیع شرطی روی داده‌های موجود"""
+    WalletUser = apps.get_model('referral', 'WalletUser')
+    TokenReward = apps.get_model('referral', 'TokenReward')
+    Referral = apps.get_model('referral', 'Referral')
+    reward_fields = {
+        'signup_referral': 'signup_rewards',
+        'staking_self': 'staking_self_rewards',
+        'staking_referral': 'staking_referral_rewards',
+    }
+    for row in TokenReward.objects.values('user_id').annotate(**{
+        field: Sum('amount', filter=Q(reward_type=reward_type))
+        for reward_type, field in reward_fields.items()
+    }):
+        user_id = row.pop('user_id')
+        WalletUser.objects.filter(pk=user_id).update(**{k: v or 0 for k, v in row.items()})
+    for row in Referral.objects.values('referrer_id').annotate(total=Count('id')):
+        WalletUser.objects.filter(pk=row['referrer_id']).update(referral_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0004_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletuser',
+            name='referral_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='walletuser',
+            name='signup_rewards',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='walletuser',
+            name='staking_referral_rewards',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='walletuser',
+            name='staking_self_rewards',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=20),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-18 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0005_walletuser_stats_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['created_at'], name='referral_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staking',
+            index=models.Index(fields=['user', '-staked_at', '-id'], name='staking_user_staked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staking',
+            index=models.Index(condition=models.Q(('is_unlocked', False)), fields=['unlock_date'], name='staking_active_unlock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staking',
+            index=models.Index(fields=['staked_at'], name='staking_staked_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tokenreward',
+            index=models.Index(fields=['user', 'reward_type'], name='reward_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tokenreward',
+            index=models.Index(fields=['created_at'], name='reward_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletuser',
+            index=models.Index(fields=['created_at'], name='walletuser_created_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 06:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_closure(apps, schema_editor):
+    """ساخت جدول بستار از روی یال‌های مستقیم Referral موجود"""
+    Referral = apps.get_model('referral', 'Referral')
+    ReferralPath = apps.get_model('referral', 'ReferralPath')
+    parent = dict(Referral.objects.values_list('referee_id', 'referrer_id'))
+    batch = []
+    for descendant_id in parent:
+        ancestor_id = parent[descendant_id]
+        depth = 1
+        seen = {descendant_id}
+        while ancestor_id is not None and ancestor_id not in seen:
+            batch.append(ReferralPath(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth))
+            seen.add(ancestor_id)
+            ancestor_id = parent.get(ancestor_id)
+            depth += 1
+        if len(batch) >= 5000:
+            ReferralPath.objects.bulk_create(batch)
+            batch = []
+    ReferralPath.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0006_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='downline_paths', to='referral.walletuser')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upline_paths', to='referral.walletuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth', 'descendant'], name='referral_path_level_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_path_unique')],
+            },
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
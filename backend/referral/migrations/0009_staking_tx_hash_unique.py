@@ -0,0 +1,50 @@
+# Generated by Django 6.0 on 2026-10-18 06:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+REPORT_LIMIT = 50
+
+
+def check_duplicate_tx_hashes(apps, schema_editor):
+    """توقف migration اگر tx_hash تکراری وجود دارد
+
+    هر استیکینگ تکراری پاداش‌ها و سطرهای دفتر کل خودش را دارد، پس حذف یا
+    ادغام خودکار موجودی‌ها را خراب می‌کند. گزارش خطا گروه‌های تکراری را نشان
+    می‌دهد تا پیش از اجرای دوباره migration دستی برطرف شوند.
+    """
+    Staking = apps.get_model('referral', 'Staking')
+    duplicates = list(
+        Staking.objects.exclude(tx_hash='')
+        .values('tx_hash')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by('tx_hash')
+    )
+    if not duplicates:
+        return
+    lines = []
+    for group in duplicates[:REPORT_LIMIT]:
+        ids = list(Staking.objects.filter(tx_hash=group['tx_hash']).order_by('id').values_list('id', 'user_id'))
+        lines.append(f"  {group['tx_hash']}: " + ', '.join(f'staking {pk} (user {user_id})' for pk, user_id in ids))
+    if len(duplicates) > REPORT_LIMIT:
+        lines.append(f'  ... and {len(duplicates) - REPORT_LIMIT} more')
+    raise RuntimeError(
+        f'{len(duplicates)} non-empty tx_hash values are used by more than one Staking; '
+        'resolve them before adding staking_tx_hash_unique:\n' + '\n'.join(lines)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0008_dashboardsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_tx_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='staking',
+            constraint=models.UniqueConstraint(condition=models.Q(('tx_hash', ''), _negated=True), fields=('tx_hash',), name='staking_tx_hash_unique'),
+        ),
+    ]
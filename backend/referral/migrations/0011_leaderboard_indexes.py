@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0010_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='walletuser',
+            index=models.Index(fields=['-referral_count', 'id'], name='walletuser_referrers_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletuser',
+            index=models.Index(fields=['-total_staked', 'id'], name='walletuser_stakers_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0011_leaderboard_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('new_users', models.PositiveIntegerField(default=0)),
+                ('referrals', models.PositiveIntegerField(default=0)),
+                ('stakes', models.PositiveIntegerField(default=0)),
+                ('staked_volume', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+                ('signup_rewards', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+                ('staking_self_rewards', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+                ('staking_referral_rewards', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+                ('unlocked_volume', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'shard'), name='daily_stats_day_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 06:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0012_dailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('reward_count', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'در انتظار انتقال'), ('paid', 'پرداخت شده'), ('failed', 'ناموفق')], default='pending', max_length=20)),
+                ('tx_hash', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payout_batches', to='referral.walletuser')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tokenreward',
+            name='payout_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rewards', to='referral.payoutbatch'),
+        ),
+        migrations.AddIndex(
+            model_name='tokenreward',
+            index=models.Index(condition=models.Q(('is_paid', False), ('payout_batch__isnull', True)), fields=['user', 'id'], name='reward_unbatched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payoutbatch',
+            index=models.Index(fields=['status', 'id'], name='payout_status_idx'),
+        ),
+    ]
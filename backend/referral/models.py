@@ -1,28 +1,58 @@
 # backend/referral/models.py
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
 import secrets
 from decimal import Decimal
 from django.utils import timezone
 
 class WalletUser(models.Model):
+    REFERRAL_CODE_ATTEMPTS = 5
+    
     wallet_address = models.CharField(max_length=255, unique=True)
     wallet_type = models.CharField(max_length=20, default='ethereum')
     referral_code = models.CharField(max_length=20, unique=True)
     token_balance = models.DecimalField(max_digits=20, decimal_places=8, default=0)
     total_earned = models.DecimalField(max_digits=20, decimal_places=8, default=0)
     total_staked = models.DecimalField(max_digits=20, decimal_places=8, default=0)  # کل مقدار استیک شده
+    ledger_sequence = models.PositiveBigIntegerField(default=0)  # آخرین سطر دفتر کل اعمال‌شده
+    # شمارنده‌های آمار کاربر (به‌روزرسانی هم‌زمان با ثبت پاداش و رفرال)
+    referral_count = models.PositiveIntegerField(default=0)
+    signup_rewards = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    staking_self_rewards = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    staking_referral_rewards = models.DecimalField(max_digits=20, decimal_places=8, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # کاربران جدید در بازه زمانی (داشبورد و ادمین)
+            models.Index(fields=['created_at'], name='walletuser_created_idx'),
+            # جدول‌های رتبه (referral/leaderboard.py)
+            models.Index(fields=['-referral_count', 'id'], name='walletuser_referrers_rank_idx'),
+            models.Index(fields=['-total_staked', 'id'], name='walletuser_stakers_rank_idx'),
+        ]
+    
     def save(self, *args, **kwargs):
-        if not self.referral_code:
+        if self.referral_code:
+            return super().save(*args, **kwargs)
+        
+        # کد بدون پرس‌وجوی قبلی ساخته می‌شود و یکتایی را قید unique تضمین می‌کند؛
+        # فقط در صورت برخورد (بسیار نادر) دوباره تلاش می‌شود
+        for _ in range(self.REFERRAL_CODE_ATTEMPTS):
             self.referral_code = self.generate_referral_code()
-        super().save(*args, **kwargs)
+            try:
+                if not transaction.get_connection().in_atomic_block:
+                    return super().save(*args, **kwargs)
+                # داخل تراکنش، خطای insert بدون savepoint کل تراکنش را خراب می‌کند
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if not WalletUser.objects.filter(referral_code=self.referral_code).exists():
+                    raise  # خطای یکتایی دیگری (مثلاً wallet_address تکراری)
+        raise IntegrityError('Could not allocate a unique referral code')
     
-    def generate_referral_code(self):
-        while True:
-            code = secrets.token_urlsafe(10)[:10]
-            if not WalletUser.objects.filter(referral_code=code).exists():
-                return code
+    @staticmethod
+    def generate_referral_code():
+        return secrets.token_urlsafe(10)[:10]
     
     def __str__(self):
         return f"{self.wallet_address[:10]}..."
@@ -33,11 +63,36 @@ class Referral(models.Model):
     has_received_signup_bonus = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='referral_created_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.referrer.wallet_address[:5]} -> {self.referee.wallet_address[:5]}"
 
+class ReferralPath(models.Model):
+    """جدول بستار درخت رفرال: یک سطر برای هر جفت (بالاسری، زیرمجموعه) در هر عمق"""
+    ancestor = models.ForeignKey(WalletUser, on_delete=models.CASCADE, related_name='downline_paths')
+    descendant = models.ForeignKey(WalletUser, on_delete=models.CASCADE, related_name='upline_paths')
+    depth = models.PositiveIntegerField()  # 1 = زیرمجموعه مستقیم
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='referral_path_unique'),
+        ]
+        indexes = [
+            # اندازه هر سطح و فهرست اعضای یک سطح به ترتیب شناسه
+            models.Index(fields=['ancestor', 'depth', 'descendant'], name='referral_path_level_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor.wallet_address[:5]} -> {self.descendant.wallet_address[:5]} ({self.depth})"
+
 class Staking(models.Model):
     """مدل استیکینگ با قفل 365 روزه"""
+    LOCK_DAYS = 365
+    
     user = models.ForeignKey(WalletUser, on_delete=models.CASCADE, related_name='stakings')
     amount = models.DecimalField(max_digits=20, decimal_places=8)  # مقدار استیک شده
     bonus_received = models.DecimalField(max_digits=20, decimal_places=8, default=0)  # 5% دریافتی
@@ -50,23 +105,43 @@ class Staking(models.Model):
     
     class Meta:
         ordering = ['-staked_at']
+        indexes = [
+            # لیست استیکینگ‌های کاربر با صفحه‌بندی کلیدی (staked_at, id)
+            models.Index(fields=['user', '-staked_at', '-id'], name='staking_user_staked_idx'),
+            # فقط استیکینگ‌های فعال بر اساس موعد آزادسازی (فیلتر ادمین و آزادسازی گروهی)
+            models.Index(
+                fields=['unlock_date'],
+                condition=models.Q(is_unlocked=False),
+                name='staking_active_unlock_idx'
+            ),
+            # استیکینگ‌های جدید در بازه زمانی (داشبورد و گزارش‌ها)
+            models.Index(fields=['staked_at'], name='staking_staked_at_idx'),
+        ]
+        constraints = [
+            # هر تراکنش زنجیره فقط یک بار استیک می‌شود (تکرار درخواست = همان استیکینگ)
+            models.UniqueConstraint(
+                fields=['tx_hash'],
+                condition=~models.Q(tx_hash=''),
+                name='staking_tx_hash_unique'
+            ),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.unlock_date:
             # تاریخ آزادسازی: 365 روز بعد
-            self.unlock_date = timezone.now() + timezone.timedelta(days=365)
+            self.unlock_date = timezone.now() + timezone.timedelta(days=self.LOCK_DAYS)
         super().save(*args, **kwargs)
     
-    def days_remaining(self):
-        """روزهای باقیمانده تا آزادسازی"""
+    def days_remaining(self, now=None):
+        """روزهای باقیمانده تا آزادسازی (now: زمان ثابت برای کل درخواست)"""
         if self.is_unlocked:
             return 0
-        remaining = self.unlock_date - timezone.now()
+        remaining = self.unlock_date - (now or timezone.now())
         return max(remaining.days, 0)
     
-    def can_unlock(self):
+    def can_unlock(self, now=None):
         """آیا می‌تواند آزاد شود؟"""
-        return not self.is_unlocked and timezone.now() >= self.unlock_date
+        return not self.is_unlocked and (now or timezone.now()) >= self.unlock_date
     
     def __str__(self):
         return f"{self.user.wallet_address[:10]} - {self.amount} ETH ({self.days_remaining()} روز)"
@@ -84,7 +159,157 @@ class TokenReward(models.Model):
     related_referral = models.ForeignKey(Referral, on_delete=models.SET_NULL, null=True, blank=True)
     is_paid = models.BooleanField(default=False)
     paid_at = models.DateTimeField(null=True, blank=True)
+    # دسته پرداختی که این پاداش در آن انتقال داده می‌شود (referral/payouts.py)
+    payout_batch = models.ForeignKey(
+        'PayoutBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='rewards'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # تفکیک پاداش‌های کاربر بر اساس نوع
+            models.Index(fields=['user', 'reward_type'], name='reward_user_type_idx'),
+            models.Index(fields=['created_at'], name='reward_created_idx'),
+            # فقط پاداش‌های پرداخت‌نشده‌ای که هنوز در دسته‌ای نیستند، به تفکیک کیف‌پول
+            models.Index(
+                fields=['user', 'id'],
+                condition=models.Q(is_paid=False, payout_batch__isnull=True),
+                name='reward_unbatched_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.wallet_address[:10]} - {self.amount} ({self.reward_type})"
+
+
+class LedgerEntry(models.Model):
+    """دفتر کل فقط-افزودنی: هر تغییر موجودی یک سطر تغییرناپذیر با شماره ترتیبی"""
+    ENTRY_TYPES = [
+        ('opening_balance', 'موجودی افتتاحیه'),
+        ('signup_referral', 'پاداش ثبت‌نام زیرمجموعه'),
+        ('staking_self', 'استیکینگ و پاداش خود کاربر'),
+        ('staking_referral', 'پاداش استیکینگ زیرمجموعه'),
+        ('staking_unlock', 'برداشت از استیکینگ'),
+    ]
+    
+    user = models.ForeignKey(WalletUser, on_delete=models.CASCADE, related_name='ledger_entries')
+    sequence = models.PositiveBigIntegerField()  # شماره ترتیبی برای هر کاربر
+    entry_type = models.CharField(max_length=50, choices=ENTRY_TYPES)
+    token_delta = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    earned_delta = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    staked_delta = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    # موجودی‌ها بعد از اعمال این سطر
+    token_balance_after = models.DecimalField(max_digits=20, decimal_places=8)
+    total_earned_after = models.DecimalField(max_digits=20, decimal_places=8)
+    total_staked_after = models.DecimalField(max_digits=20, decimal_places=8)
+    related_staking = models.ForeignKey(Staking, on_delete=models.SET_NULL, null=True, blank=True)
+    related_reward = models.ForeignKey(TokenReward, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['user', 'sequence']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'sequence'], name='ledger_user_sequence_unique'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('سطرهای دفتر کل قابل ویرایش نیستند')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('سطرهای دفتر کل قابل حذف نیستند')
+    
+    def __str__(self):
+        return f"{self.user.wallet_address[:10]} #{self.sequence} ({self.entry_type})"
+
+
+class DashboardSnapshot(models.Model):
+    """آمار از پیش محاسبه‌شده داشبورد ادمین (با refresh_dashboard یا ?refresh=1)"""
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        get_latest_by = 'created_at'
+    
+    def __str__(self):
+        return f"Dashboard @ {self.created_at:%Y-%m-%d %H:%M}"
+
+
+class OutboxEvent(models.Model):
+    """رویدادهایی که در همان تراکنش درخواست ثبت و بعداً توسط process_outbox اعمال می‌شوند"""
+    EVENT_TYPES = [
+        ('staking_created', 'پاداش‌ها و موجودی استیکینگ جدید'),
+    ]
+    
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)  # زمان تلاش بعدی
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # فقط رویدادهای پردازش‌نشده به ترتیب نوبت
+            models.Index(
+                fields=['available_at', 'id'],
+                condition=models.Q(processed_at__isnull=True),
+                name='outbox_pending_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} #{self.pk}"
+
+
+class DailyStats(models.Model):
+    """آمار روزانه کل سامانه (referral/rollups.py)
+
+    هر روز چند ردیف (shard) دارد تا نوشتن‌های هم‌زمان روی یک ردیف صف نکشند؛
+    آمار روز = جمع shardهای آن روز.
+    """
+    day = models.DateField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    new_users = models.PositiveIntegerField(default=0)
+    referrals = models.PositiveIntegerField(default=0)
+    stakes = models.PositiveIntegerField(default=0)
+    staked_volume = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    signup_rewards = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    staking_self_rewards = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    staking_referral_rewards = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    unlocked_volume = models.DecimalField(max_digits=24, decimal_places=8, default=0)  # پاداش‌های staking_unlock
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shard'], name='daily_stats_day_shard_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} #{self.shard}"
+
+
+class PayoutBatch(models.Model):
+    """یک انتقال به یک کیف‌پول: جمع چند پاداش پرداخت‌نشده"""
+    STATUSES = [
+        ('pending', 'در انتظار انتقال'),
+        ('paid', 'پرداخت شده'),
+        ('failed', 'ناموفق'),
+    ]
+    
+    user = models.ForeignKey(WalletUser, on_delete=models.CASCADE, related_name='payout_batches')
+    amount = models.DecimalField(max_digits=24, decimal_places=8)
+    reward_count = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    tx_hash = models.CharField(max_length=100, blank=True)  # تراکنش انتقال
     created_at = models.DateTimeField(auto_now_add=True)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payout_status_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.wallet_address[:10]} - {self.amount} ({self.reward_type})"
\ No newline at end of file
+        return f"{self.user.wallet_address[:10]} - {self.amount} ({self.status})"
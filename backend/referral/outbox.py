@@ -0,0 +1,88 @@
+# backend/referral/outbox.py
+"""اعمال رویدادهای outbox (دستور process_outbox)
+
+درخواست فقط سطر اصلی (مثلاً Staking) و یک OutboxEvent را در یک تراکنش ثبت
+می‌کند. اینجا رویدادها دسته‌ای با SKIP LOCKED برداشته می‌شوند، اثرشان با
+نوشتن‌های گروهی اعمال می‌شود و در همان تراکنش processed_at می‌گیرند؛ پس
+هر رویداد دقیقاً یک بار اعمال می‌شود و چند worker دسته‌های جدا می‌گیرند.
+اگر دسته‌ای خطا بدهد رویدادها تک‌تک (هر کدام در savepoint خودش) دوباره
+امتحان می‌شوند تا فقط رویداد خراب با تأخیر فزاینده عقب بیفتد.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxEvent, Staking
+from .services import apply_stake_rewards
+
+RETRY_BASE = 30  # ثانیه؛ تأخیر تلاش n ام = RETRY_BASE * 2^(n-1)
+RETRY_MAX = 3600
+
+
+def _apply_staking_created(events):
+    stakings = Staking.objects.in_bulk([event.payload['staking_id'] for event in events])
+    # استیکینگ حذف‌شده (مثلاً از ادمین) اثری برای اعمال ندارد
+    events = [event for event in events if event.payload['staking_id'] in stakings]
+    apply_stake_rewards(
+        [event.payload for event in events],
+        [stakings[event.payload['staking_id']] for event in events]
+    )
+
+
+HANDLERS = {
+    'staking_created': _apply_staking_created,
+}
+
+
+def apply_events(events):
+    """اعمال گروهی رویدادها به تفکیک نوع؛ باید داخل transaction.atomic صدا زده شود"""
+    by_type = defaultdict(list)
+    for event in events:
+        by_type[event.event_type].append(event)
+    for event_type, group in by_type.items():
+        HANDLERS[event_type](group)
+
+
+def drain_outbox(batch_size, max_attempts):
+    """برداشتن و اعمال یک دسته از رویدادهای آماده
+
+    خروجی: (تعداد اعمال‌شده، تعداد ناموفق)
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=now, attempts__lt=max_attempts)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        try:
+            with transaction.atomic():
+                apply_events(events)
+            done, failed = events, []
+        except Exception:
+            done, failed = [], []
+            for event in events:
+                try:
+                    with transaction.atomic():
+                        apply_events([event])
+                    done.append(event)
+                except Exception as exc:
+                    event.attempts += 1
+                    event.last_error = f'{type(exc).__name__}: {exc}'
+                    event.available_at = now + timezone.timedelta(
+                        seconds=min(RETRY_MAX, RETRY_BASE * 2 ** (event.attempts - 1))
+                    )
+                    failed.append(event)
+
+        if done:
+            marked = OutboxEvent.objects.filter(
+                pk__in=[event.pk for event in done], processed_at__isnull=True
+            ).update(processed_at=now)
+            if marked != len(done):
+                # worker دیگری همین رویدادها را اعمال کرده است (دیتابیس بدون قفل سطری)
+                raise RuntimeError('outbox events were claimed twice; batch rolled back')
+        if failed:
+            OutboxEvent.objects.bulk_update(failed, ['attempts', 'last_error', 'available_at'])
+    return len(done), len(failed)
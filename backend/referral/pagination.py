@@ -0,0 +1,62 @@
+# backend/referral/pagination.py
+import base64
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(staked_at, pk):
+    raw = f"{staked_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """کرسر مات (staked_at, id) → تاپل؛ در صورت خرابی InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        staked_at, pk = raw.rsplit('|', 1)
+        staked_at = parse_datetime(staked_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if staked_at is None:
+        raise InvalidCursor(cursor)
+    return staked_at, pk
+
+
+def page_size_from(request):
+    """اندازه صفحه از ?page_size با سقف REFERRAL_STAKINGS_MAX_PAGE_SIZE"""
+    try:
+        size = int(request.GET.get('page_size', settings.REFERRAL_STAKINGS_PAGE_SIZE))
+    except (TypeError, ValueError):
+        size = settings.REFERRAL_STAKINGS_PAGE_SIZE
+    return max(1, min(size, settings.REFERRAL_STAKINGS_MAX_PAGE_SIZE))
+
+
+def keyset_queryset(queryset, cursor, page_size):
+    """صفحه‌بندی کلیدی روی (staked_at, id) به ترتیب نزولی
+
+    به جای OFFSET، از آخرین سطر صفحه قبل ادامه می‌دهد تا هزینه هر صفحه
+    مستقل از عمق آن باشد. یک سطر اضافه می‌خواند تا وجود صفحه بعد معلوم شود.
+    """
+    queryset = queryset.order_by('-staked_at', '-id')
+    if cursor:
+        staked_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(staked_at__lt=staked_at) | Q(staked_at=staked_at, id__lt=pk))
+    return queryset[:page_size + 1]
+
+
+def split_page(rows, page_size):
+    """سطرهای خوانده‌شده با keyset_queryset → (سطرهای صفحه، کرسر صفحه بعد یا None)"""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1].staked_at, rows[-1].pk)
+
+
+def keyset_page(queryset, cursor, page_size):
+    return split_page(list(keyset_queryset(queryset, cursor, page_size)), page_size)
@@ -0,0 +1,95 @@
+# backend/referral/payouts.py
+"""دسته‌بندی پاداش‌های پرداخت‌نشده برای انتقال (دستور create_payouts)
+
+پاداش‌های پرداخت‌نشده و بدون دسته از ایندکس جزئی reward_unbatched_idx به
+ترتیب (کیف‌پول، id) دسته‌دسته با SKIP LOCKED برداشته می‌شوند تا چند اجرای
+هم‌زمان دسته‌های جدا بگیرند. برای هر کیف‌پول یک PayoutBatch با جمع مبلغ‌ها
+ساخته و شناسه آن با یک UPDATE روی همه پاداش‌های دسته ثبت می‌شود. بعد از
+انتقال، mark_batches_paid دسته‌ها و پاداش‌هایشان را با دو UPDATE پرداخت‌شده
+می‌کند؛ release_batches دسته ناموفق را کنار می‌گذارد تا پاداش‌هایش در
+اجرای بعدی دوباره دسته شوند.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from .models import PayoutBatch, TokenReward
+
+
+def claim_payout_batches(limit, queryset=None):
+    """ساخت دسته‌های پرداخت از حداکثر limit پاداش در یک تراکنش
+
+    queryset: محدود کردن به بخشی از پاداش‌ها (مثلاً انتخاب ادمین).
+    اگر دسته پر شود، پاداش‌های آخرین کیف‌پول برای دسته بعد می‌مانند تا هر
+    کیف‌پول یک انتقال بگیرد (مگر همه دسته مال یک کیف‌پول باشد).
+    خروجی: لیست PayoutBatchهای ساخته‌شده
+    """
+    rewards = TokenReward.objects.all()
+    if queryset is not None:
+        rewards = rewards.filter(pk__in=queryset.values('pk'))
+    with transaction.atomic():
+        rows = list(
+            rewards.select_for_update(skip_locked=True)
+            .filter(is_paid=False, payout_batch__isnull=True)
+            .order_by('user_id', 'id')
+            .values_list('id', 'user_id', 'amount')[:limit]
+        )
+        if len(rows) == limit and rows[0][1] != rows[-1][1]:
+            rows = [row for row in rows if row[1] != rows[-1][1]]
+        if not rows:
+            return []
+
+        totals = defaultdict(lambda: [Decimal('0'), 0])
+        for _, user_id, amount in rows:
+            totals[user_id][0] += amount
+            totals[user_id][1] += 1
+        batches = PayoutBatch.objects.bulk_create([
+            PayoutBatch(user_id=user_id, amount=amount, reward_count=count)
+            for user_id, (amount, count) in totals.items()
+        ])
+
+        reward_ids = [reward_id for reward_id, _, _ in rows]
+        marked = TokenReward.objects.filter(pk__in=reward_ids, payout_batch__isnull=True).update(
+            payout_batch=Case(*[When(user_id=batch.user_id, then=Value(batch.pk)) for batch in batches])
+        )
+        if marked != len(reward_ids):
+            # اجرای دیگری همین پاداش‌ها را دسته کرده است (دیتابیس بدون قفل سطری)
+            raise RuntimeError('rewards were claimed twice; batch rolled back')
+    return batches
+
+
+def mark_batches_paid(batch_ids, tx_hash=''):
+    """پرداخت‌شده کردن دسته‌های در انتظار و همه پاداش‌هایشان
+
+    خروجی: تعداد دسته‌های پرداخت‌شده
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch_ids = list(
+            PayoutBatch.objects.select_for_update()
+            .filter(pk__in=batch_ids, status='pending')
+            .values_list('pk', flat=True)
+        )
+        changes = {'status': 'paid', 'paid_at': now}
+        if tx_hash:
+            changes['tx_hash'] = tx_hash
+        PayoutBatch.objects.filter(pk__in=batch_ids).update(**changes)
+        TokenReward.objects.filter(payout_batch_id__in=batch_ids, is_paid=False).update(is_paid=True, paid_at=now)
+    return len(batch_ids)
+
+
+def release_batches(batch_ids):
+    """ناموفق کردن دسته‌های در انتظار و آزاد کردن پاداش‌هایشان برای دسته‌بندی دوباره
+
+    خروجی: تعداد دسته‌های آزادشده
+    """
+    with transaction.atomic():
+        batch_ids = list(
+            PayoutBatch.objects.select_for_update()
+            .filter(pk__in=batch_ids, status='pending')
+            .values_list('pk', flat=True)
+        )
+        PayoutBatch.objects.filter(pk__in=batch_ids).update(status='failed')
+        TokenReward.objects.filter(payout_batch_id__in=batch_ids, is_paid=False).update(payout_batch=None)
+    return len(batch_ids)
@@ -0,0 +1,49 @@
+# backend/referral/renderers.py
+"""رندر JSON سریع با orjson و Decimal دقیق
+
+مبلغ‌ها به صورت Decimal در پاسخ قرار می‌گیرند و بدون گذر از float نوشته
+می‌شوند: پیش‌فرض به صورت عدد JSON با همان ارقام ذخیره‌شده (فرانت‌اند روی
+آن‌ها toFixed صدا می‌زند)، یا با REFERRAL_JSON_DECIMAL='string' به صورت رشته.
+datetime مستقیم توسط orjson به RFC 3339 تبدیل می‌شود.
+"""
+from decimal import Decimal
+import orjson
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_fallback = JSONEncoder()
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        if not obj.is_finite():
+            raise TypeError(f'{obj} is not valid JSON')
+        # format 'f' بدون نماد علمی (1E-8)
+        text = format(obj, 'f')
+        if settings.REFERRAL_JSON_DECIMAL == 'string':
+            return text
+        return orjson.Fragment(text)
+    # انواع دیگر (رشته‌های lazy، timedelta، QuerySet و ...) مثل JSONRenderer خود DRF
+    return _fallback.default(obj)
+
+
+def dumps(data):
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+def json_response(data, status=200):
+    """معادل JsonResponse با همین رندر (برای viewهای غیر DRF مثل async_views)"""
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
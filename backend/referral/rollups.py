@@ -0,0 +1,147 @@
+# backend/referral/rollups.py
+"""آمار روزانه سامانه (DailyStats) برای گزارش‌ها و سری زمانی
+
+هر تراکنش نوشتن (کاربر جدید، رفرال، استیک، پاداش) دلتاهایش را در یک
+DailyRollup جمع می‌کند و در پایان، بعد از قفل ردیف کیف‌پول‌ها در
+post_entries، یک بار save() می‌کند: برای هر روز یک UPDATE افزایشی روی یکی
+از REFERRAL_ROLLUP_SHARDS ردیف آن روز. shard تصادفی است تا تراکنش‌های
+هم‌زمان پشت قفل یک ردیف نمانند؛ چون هر تراکنش فقط یک بار و همیشه بعد از
+قفل کیف‌پول‌ها ردیف آمار را قفل می‌کند، ترتیب قفل‌ها بین تراکنش‌ها یکسان است.
+خواندن‌ها فقط روی DailyStats هستند، پس هزینه آن‌ها با تعداد روزها رشد
+می‌کند نه تعداد استیکینگ‌ها. backfill_rollups همین جدول را از جدول‌های اصلی
+از نو می‌سازد. روز هر رویداد با TIME_ZONE جنگو محاسبه می‌شود.
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import DailyStats, WalletUser, Referral, Staking, TokenReward
+
+# مجموع پاداش هر نوع در DailyStats
+REWARD_FIELDS = {
+    'signup_referral': 'signup_rewards',
+    'staking_self': 'staking_self_rewards',
+    'staking_referral': 'staking_referral_rewards',
+    'staking_unlock': 'unlocked_volume',
+}
+
+FIELDS = ('new_users', 'referrals', 'stakes', 'staked_volume', *REWARD_FIELDS.values())
+
+RESOLUTIONS = {
+    'day': F('day'),
+    'week': TruncWeek('day'),
+    'month': TruncMonth('day'),
+}
+
+
+class DailyRollup:
+    """جمع دلتاهای یک تراکنش به تفکیک روز و اعمال آن‌ها با save()"""
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: defaultdict(int))
+
+    def add(self, moment, **fields):
+        day = self.deltas[timezone.localdate(moment)]
+        for field, value in fields.items():
+            day[field] += value
+        return self
+
+    def stakes(self, stakings):
+        for staking in stakings:
+            self.add(staking.staked_at, stakes=1, staked_volume=staking.amount)
+        return self
+
+    def rewards(self, rewards):
+        for reward in rewards:
+            self.add(reward.created_at, **{REWARD_FIELDS[reward.reward_type]: reward.amount})
+        return self
+
+    def save(self):
+        """اعمال دلتاها؛ باید داخل transaction.atomic و یک بار در پایان آن صدا زده شود
+
+        روزها به ترتیب صعودی و از هر روز فقط یک ردیف قفل می‌شود. دو save در یک
+        تراکنش دو shard جدا قفل می‌کند و می‌تواند با تراکنش دیگر بن‌بست بسازد.
+        """
+        shard = random.randrange(settings.REFERRAL_ROLLUP_SHARDS)
+        for day in sorted(self.deltas):
+            fields = {field: value for field, value in self.deltas[day].items() if value}
+            if not fields:
+                continue
+            changes = {field: F(field) + value for field, value in fields.items()}
+            if DailyStats.objects.filter(day=day, shard=shard).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    DailyStats.objects.create(day=day, shard=shard, **fields)
+            except IntegrityError:
+                # تراکنش دیگری همین حالا ردیف را ساخت
+                DailyStats.objects.filter(day=day, shard=shard).update(**changes)
+        self.deltas.clear()
+
+
+def series(resolution, since=None, until=None):
+    """سری زمانی آمار در بازه [since, until] با دقت روز، هفته یا ماه
+
+    هفته از دوشنبه و ماه از روز اول شروع می‌شود؛ دوره‌های بدون رویداد در
+    خروجی نیستند.
+    """
+    rows = DailyStats.objects.all()
+    if since:
+        rows = rows.filter(day__gte=since)
+    if until:
+        rows = rows.filter(day__lte=until)
+    return list(
+        rows.annotate(period=RESOLUTIONS[resolution])
+        .values('period')
+        .annotate(**{field: Sum(field) for field in FIELDS})
+        .order_by('period')
+    )
+
+
+def _daily_counts(queryset, moment_field, start, end, group=(), **aggregates):
+    return (
+        queryset.filter(**{f'{moment_field}__gte': start, f'{moment_field}__lt': end})
+        .annotate(rollup_day=TruncDate(moment_field))
+        .values('rollup_day', *group)
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+
+def backfill(since, until):
+    """ساخت دوباره DailyStats روزهای [since, until] از جدول‌های اصلی
+
+    ردیف‌های آن روزها حذف و با یک shard جایگزین می‌شوند. برای روزهایی که
+    هنوز نوشتن هم‌زمان دارند (امروز) نتیجه ممکن است یکی دو رویداد جابه‌جا باشد.
+    خروجی: تعداد روزهای ساخته‌شده
+    """
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(since, time.min), tz)
+    end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min), tz)
+
+    days = defaultdict(dict)
+    sources = [
+        _daily_counts(WalletUser.objects, 'created_at', start, end, new_users=Count('id')),
+        _daily_counts(Referral.objects, 'created_at', start, end, referrals=Count('id')),
+        _daily_counts(Staking.objects, 'staked_at', start, end, stakes=Count('id'), staked_volume=Sum('amount')),
+    ]
+    for source in sources:
+        for row in source:
+            day = row.pop('rollup_day')
+            days[day].update(row)
+    rewards = _daily_counts(
+        TokenReward.objects, 'created_at', start, end, group=['reward_type'], total=Sum('amount')
+    )
+    for row in rewards:
+        days[row['rollup_day']][REWARD_FIELDS[row['reward_type']]] = row['total']
+
+    with transaction.atomic():
+        DailyStats.objects.filter(day__gte=since, day__lte=until).delete()
+        DailyStats.objects.bulk_create([
+            DailyStats(day=day, shard=0, **fields) for day, fields in sorted(days.items())
+        ])
+    return len(days)
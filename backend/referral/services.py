@@ -0,0 +1,430 @@
+# backend/referral/services.py
+from decimal import Decimal, ROUND_DOWN
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.db.models import BigIntegerField, Count, Exists, OuterRef, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+from .models import WalletUser, Referral, ReferralPath, Staking, TokenReward, LedgerEntry, OutboxEvent
+from .cache import invalidate_wallets_on_commit
+from .ledger import AMOUNT_QUANT, post_entries, entry_for_reward
+from .rollups import DailyRollup
+
+SIGNUP_BONUS = Decimal('3')  # پاداش ثبت‌نام زیرمجموعه
+STAKING_BONUS_RATE = Decimal('0.05')  # 5% به کاربر و 5% به بالاسری
+# سقف فیلدهای مبلغ و tx_hash (DecimalField(20, 8) و CharField(100) در Staking)
+AMOUNT_LIMIT = Decimal(10) ** 12
+TX_HASH_MAX_LENGTH = 100
+
+
+def to_amount(value):
+    """تبدیل ورودی به Decimal با دقت فیلدهای مبلغ"""
+    amount = Decimal(str(value)).quantize(AMOUNT_QUANT, rounding=ROUND_DOWN)
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    if amount >= AMOUNT_LIMIT:
+        raise ValueError('Amount too large')
+    return amount
+
+
+def staking_bonus(amount):
+    return (amount * STAKING_BONUS_RATE).quantize(AMOUNT_QUANT, rounding=ROUND_DOWN)
+
+
+def register_referral(user, referrer, rollup=None):
+    """ثبت رفرال و پاداش ثبت‌نام معرف؛ باید داخل transaction.atomic صدا زده شود
+
+    rollup: DailyRollup تراکنش فراخوان؛ اگر داده شود ذخیره آن با فراخوان است.
+    """
+    referral = Referral.objects.create(
+        referrer=referrer,
+        referee=user,
+        has_received_signup_bonus=True
+    )
+    reward = TokenReward.objects.create(
+        user=referrer,
+        amount=SIGNUP_BONUS,
+        reward_type='signup_referral',
+        related_referral=referral
+    )
+    post_entries(
+        [entry_for_reward(reward, token_delta=SIGNUP_BONUS, earned_delta=SIGNUP_BONUS)],
+        counters={referrer.pk: {'referral_count': 1}}
+    )
+    
+    # کاربر جدید زیر معرف و همه بالاسری‌های او در جدول بستار
+    ReferralPath.objects.bulk_create(
+        [ReferralPath(ancestor_id=referrer.pk, descendant=user, depth=1)] + [
+            ReferralPath(ancestor_id=ancestor_id, descendant=user, depth=depth + 1)
+            for ancestor_id, depth in ReferralPath.objects.filter(
+                descendant_id=referrer.pk
+            ).values_list('ancestor_id', 'depth')
+        ]
+    )
+    
+    own_rollup = rollup is None
+    rollup = DailyRollup() if own_rollup else rollup
+    rollup.add(referral.created_at, referrals=1).rewards([reward])
+    if own_rollup:
+        rollup.save()
+    return referral
+
+
+def downline_levels(user, max_depth=None):
+    """تعداد اعضا و حجم استیک هر سطح زیرمجموعه با یک کوئری روی ایندکس (ancestor, depth)"""
+    paths = ReferralPath.objects.filter(ancestor=user)
+    if max_depth:
+        paths = paths.filter(depth__lte=max_depth)
+    return list(
+        paths.values('depth').annotate(
+            members=Count('id'),
+            total_staked=Sum('descendant__total_staked')
+        ).order_by('depth')
+    )
+
+
+def resolve_wallets(wallet_addresses):
+    """کاربران و بالاسری‌شان با یک کوئری IN
+
+    خروجی: {wallet_address: {'id', 'referral_id', 'referrer_id'}}
+    """
+    return {
+        row['wallet_address']: {
+            'id': row['id'],
+            'referral_id': row['referred_by__id'],
+            'referrer_id': row['referred_by__referrer_id'],
+        }
+        for row in WalletUser.objects.filter(wallet_address__in=set(wallet_addresses)).values(
+            'id', 'wallet_address', 'referred_by__id', 'referred_by__referrer_id'
+        )
+    }
+
+
+def create_stakes(specs, defer_rewards=False):
+    """ثبت گروهی استیکینگ‌ها با پاداش کاربر و بالاسری در یک تراکنش
+
+    specs: لیست dict با user_id، wallet_address، amount، tx_hash و برای
+    کاربران دارای بالاسری referral_id و referrer_id. استیکینگ‌ها و پاداش‌ها
+    هر کدام با یک bulk_create و موجودی همه کیف‌پول‌ها با یک post_entries
+    نوشته می‌شوند.
+    defer_rewards: فقط استیکینگ‌ها و یک رویداد outbox برای هر کدام ثبت
+    می‌شود و پاداش‌ها و موجودی‌ها را process_outbox با apply_stake_rewards
+    اعمال می‌کند؛ سطر دفتر کل در خروجی None است.
+    خروجی: لیست (staking, سطر دفتر کل کاربر) به ترتیب specs
+    """
+    unlock_date = timezone.now() + timezone.timedelta(days=Staking.LOCK_DAYS)
+    with transaction.atomic():
+        stakings = Staking.objects.bulk_create([
+            Staking(
+                user_id=spec['user_id'],
+                amount=spec['amount'],
+                bonus_received=staking_bonus(spec['amount']),
+                referrer_bonus=staking_bonus(spec['amount']) if spec.get('referrer_id') else Decimal('0'),
+                unlock_date=unlock_date,
+                tx_hash=spec.get('tx_hash', '')
+            )
+            for spec in specs
+        ])
+        rollup = DailyRollup().stakes(stakings)
+        
+        if defer_rewards:
+            OutboxEvent.objects.bulk_create([
+                OutboxEvent(event_type='staking_created', payload={
+                    'staking_id': staking.pk,
+                    'referral_id': spec.get('referral_id'),
+                    'referrer_id': spec.get('referrer_id'),
+                })
+                for spec, staking in zip(specs, stakings)
+            ])
+            # لیست استیکینگ‌ها همین حالا تغییر کرده است؛ موجودی‌ها بعد از اعمال
+            invalidate_wallets_on_commit(spec['wallet_address'] for spec in specs if spec.get('wallet_address'))
+            rollup.save()
+            return [(staking, None) for staking in stakings]
+        
+        user_entries = apply_stake_rewards(specs, stakings, rollup=rollup)
+        rollup.save()
+    
+    return list(zip(stakings, user_entries))
+
+
+def apply_stake_rewards(specs, stakings, rollup=None):
+    """پاداش‌ها و سطرهای دفتر کل استیکینگ‌های ثبت‌شده (هم‌ترتیب با specs)
+
+    پاداش‌ها با یک bulk_create و موجودی همه کیف‌پول‌ها با یک post_entries
+    نوشته می‌شوند. باید داخل transaction.atomic صدا زده شود.
+    rollup: DailyRollup تراکنش فراخوان؛ اگر داده شود ذخیره آن با فراخوان است.
+    خروجی: سطر دفتر کل کاربر هر استیکینگ
+    """
+    rewards = []
+    for spec, staking in zip(specs, stakings):
+        rewards.append(TokenReward(
+            user_id=staking.user_id,
+            amount=staking.bonus_received,
+            reward_type='staking_self',
+            related_staking=staking
+        ))
+        if spec.get('referrer_id'):
+            rewards.append(TokenReward(
+                user_id=spec['referrer_id'],
+                amount=staking.referrer_bonus,
+                reward_type='staking_referral',
+                related_referral_id=spec['referral_id']
+            ))
+    rewards = TokenReward.objects.bulk_create(rewards)
+    
+    entries = []
+    user_entries = []
+    reward_iter = iter(rewards)
+    for spec, staking in zip(specs, stakings):
+        entry = entry_for_reward(
+            next(reward_iter),
+            token_delta=staking.bonus_received,
+            earned_delta=staking.bonus_received,
+            staked_delta=staking.amount
+        )
+        entries.append(entry)
+        user_entries.append(entry)
+        if spec.get('referrer_id'):
+            entries.append(entry_for_reward(
+                next(reward_iter),
+                token_delta=staking.referrer_bonus,
+                earned_delta=staking.referrer_bonus,
+                related_staking_id=staking.pk
+            ))
+    post_entries(entries)
+    
+    if rollup is None:
+        DailyRollup().rewards(rewards).save()
+    else:
+        rollup.rewards(rewards)
+    return user_entries
+
+
+def stake(user, amount, tx_hash='', defer_rewards=False):
+    """ثبت استیکینگ جدید با پاداش کاربر و بالاسری در یک تراکنش
+
+    خروجی: (staking, سطر دفتر کل کاربر یا None اگر defer_rewards)
+    """
+    referral = Referral.objects.filter(referee=user).values('id', 'referrer_id').first() or {}
+    return create_stakes([{
+        'user_id': user.pk,
+        'wallet_address': user.wallet_address,
+        'amount': amount,
+        'tx_hash': tx_hash,
+        'referral_id': referral.get('id'),
+        'referrer_id': referral.get('referrer_id'),
+    }], defer_rewards)[0]
+
+
+def find_stakes(tx_hashes):
+    """استیکینگ‌های ثبت‌شده این tx_hashها با سطر دفتر کل کاربر
+
+    خروجی: {tx_hash: (staking, سطر دفتر کل کاربر)} — همان داده‌ای که
+    پاسخ اولیه از آن ساخته شده بود. اگر رویداد outbox استیکینگ هنوز اعمال
+    نشده باشد سطر دفتر کل None است.
+    """
+    tx_hashes = {tx_hash for tx_hash in tx_hashes if tx_hash}
+    if not tx_hashes:
+        return {}
+    stakings = {staking.pk: staking for staking in Staking.objects.filter(tx_hash__in=tx_hashes)}
+    if not stakings:
+        return {}
+    entries = {
+        entry.related_staking_id: entry
+        for entry in LedgerEntry.objects.filter(entry_type='staking_self', related_staking_id__in=stakings)
+    }
+    return {staking.tx_hash: (staking, entries.get(pk)) for pk, staking in stakings.items()}
+
+
+def stake_once(user, amount, tx_hash='', defer_rewards=False):
+    """stake با تکرارپذیری امن روی tx_hash
+
+    اگر این tx_hash قبلاً ثبت شده باشد بدون هیچ نوشتنی همان استیکینگ
+    برمی‌گردد. اگر دو درخواست هم‌زمان هر دو از بررسی اول رد شوند، قید یکتای
+    staking_tx_hash_unique دومی را با IntegrityError متوقف می‌کند و او هم
+    استیکینگ اولی را برمی‌گرداند.
+    خروجی: (staking, سطر دفتر کل کاربر, created)
+    """
+    if tx_hash:
+        existing = find_stakes([tx_hash]).get(tx_hash)
+        if existing:
+            return (*existing, False)
+    try:
+        return (*stake(user, amount, tx_hash, defer_rewards), True)
+    except IntegrityError:
+        existing = find_stakes([tx_hash]).get(tx_hash)
+        if existing is None:
+            raise
+        return (*existing, False)
+
+
+def parse_stake_items(items):
+    """بررسی همه موارد دسته قبل از هر خواندن یا نوشتن
+
+    هر مورد dict با wallet_address (رشته)، amount (با قواعد to_amount) و
+    tx_hash اختیاری (حداکثر TX_HASH_MAX_LENGTH نویسه) است.
+    خروجی: (لیست (wallet_address, amount, tx_hash)، لیست {'index', 'error'})
+    """
+    parsed = []
+    errors = []
+    for index, item in enumerate(items):
+        address = item.get('wallet_address') if isinstance(item, dict) else None
+        if not address or not isinstance(address, str):
+            errors.append({'index': index, 'error': 'Wallet address required'})
+            continue
+        try:
+            amount = to_amount(item.get('amount'))
+        except (ArithmeticError, ValueError):
+            errors.append({'index': index, 'error': 'Invalid amount'})
+            continue
+        tx_hash = item.get('tx_hash') or ''
+        if not isinstance(tx_hash, str) or len(tx_hash) > TX_HASH_MAX_LENGTH:
+            errors.append({'index': index, 'error': 'Invalid tx_hash'})
+            continue
+        parsed.append((address, amount, tx_hash))
+    return parsed, errors
+
+
+def stake_batch(items, defer_rewards=False):
+    """پردازش گروهی استیکینگ‌های دریافتی از ایندکسر
+
+    items: خروجی parse_stake_items؛ همه با create_stakes در یک تراکنش ثبت
+    می‌شوند (defer_rewards مثل create_stakes).
+    tx_hashهای تکراری مثل stake_once بدون نوشتن همان استیکینگ قبلی را
+    برمی‌گردانند؛ اگر ثبت هم‌زمان دیگری به قید یکتا بخورد، کل دسته یک بار
+    دیگر بررسی و ثبت می‌شود.
+    خروجی هم‌ترتیب با items: (staking, سطر دفتر کل, created) یا پیام خطا
+    """
+    try:
+        return _stake_batch(items, defer_rewards)
+    except IntegrityError:
+        return _stake_batch(items, defer_rewards)
+
+
+def _stake_batch(items, defer_rewards):
+    results = [None] * len(items)
+    pending = [(index, *item) for index, item in enumerate(items)]
+
+    wallets = resolve_wallets(address for _, address, _, _ in pending)
+    existing = find_stakes(tx_hash for _, _, _, tx_hash in pending)
+    seen = set()
+    indexes = []
+    specs = []
+    for index, address, amount, tx_hash in pending:
+        wallet = wallets.get(address)
+        if wallet is None:
+            results[index] = 'User not found'
+            continue
+        if tx_hash in existing:
+            staking, entry = existing[tx_hash]
+            if staking.user_id != wallet['id'] or staking.amount != amount:
+                results[index] = 'tx_hash already used'
+            else:
+                results[index] = (staking, entry, False)
+            continue
+        if tx_hash:
+            if tx_hash in seen:
+                results[index] = 'Duplicate tx_hash in batch'
+                continue
+            seen.add(tx_hash)
+        indexes.append(index)
+        specs.append({
+            'user_id': wallet['id'],
+            'wallet_address': address,
+            'amount': amount,
+            'tx_hash': tx_hash,
+            'referral_id': wallet['referral_id'],
+            'referrer_id': wallet['referrer_id'],
+        })
+
+    if specs:
+        for index, (staking, entry) in zip(indexes, create_stakes(specs, defer_rewards)):
+            results[index] = (staking, entry, True)
+    return results
+
+
+def rewards_pending():
+    """شرط استیکینگ‌هایی که رویداد staking_created آن‌ها هنوز اعمال نشده است
+
+    رویداد در صف یا مرده (attempts تمام‌شده) هر دو processed_at خالی دارند.
+    آزادسازی قبل از اعمال، total_staked را پیش از افزایشش کم می‌کرد.
+    """
+    return Exists(
+        OutboxEvent.objects.filter(event_type='staking_created', processed_at__isnull=True)
+        .annotate(event_staking_id=Cast(KeyTextTransform('staking_id', 'payload'), BigIntegerField()))
+        .filter(event_staking_id=OuterRef('pk'))
+    )
+
+
+def unlock_stakings(staking_ids, check_schedule=True, reset_unlock_date=False):
+    """آزادسازی گروهی استیکینگ‌ها با UPDATE مجموعه‌ای
+
+    فقط استیکینگ‌هایی که هنوز آزاد نشده‌اند، پاداش‌هایشان اعمال شده (و اگر
+    check_schedule باشد موعدشان رسیده) آزاد می‌شوند. لیست استیکینگ‌های
+    آزادشده برمی‌گردد.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pending = (
+            Staking.objects.select_for_update()
+            .filter(pk__in=staking_ids, is_unlocked=False)
+            .exclude(rewards_pending())
+        )
+        if check_schedule:
+            pending = pending.filter(unlock_date__lte=now)
+        return _unlock_locked(list(pending.order_by('pk')), now, reset_unlock_date)
+
+
+def unlock_matured_chunk(limit):
+    """آزادسازی یک دسته از استیکینگ‌های سررسیده (برای اجرای دوره‌ای)
+
+    ردیف‌ها از ایندکس جزئی استیکینگ‌های فعال به ترتیب موعد خوانده می‌شوند و
+    با SKIP LOCKED قفل می‌شوند تا چند اجرای هم‌زمان دسته‌های جدا بگیرند. هر
+    دسته در تراکنش خودش commit می‌شود، پس توقف وسط کار چیزی را خراب نمی‌کند
+    و اجرای بعدی از همان‌جا ادامه می‌دهد. استیکینگ با پاداش در outbox تا
+    اعمال رویدادش کنار می‌ماند.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        stakings = list(
+            Staking.objects.select_for_update(skip_locked=True)
+            .filter(is_unlocked=False, unlock_date__lte=now)
+            .exclude(rewards_pending())
+            .order_by('unlock_date', 'id')
+            .only('id', 'user_id', 'amount')[:limit]
+        )
+        return _unlock_locked(stakings, now)
+
+
+def _unlock_locked(stakings, now, reset_unlock_date=False):
+    """آزادسازی استیکینگ‌هایی که ردیفشان در تراکنش جاری قفل شده است
+
+    وضعیت با یک UPDATE، پاداش‌های staking_unlock با یک bulk_create و کاهش
+    total_staked همه کاربران با یک post_entries اعمال می‌شود.
+    """
+    if not stakings:
+        return []
+
+    changes = {'is_unlocked': True, 'unlocked_at': now}
+    if reset_unlock_date:
+        changes['unlock_date'] = now
+    Staking.objects.filter(pk__in=[s.pk for s in stakings]).update(**changes)
+    for staking in stakings:
+        for field, value in changes.items():
+            setattr(staking, field, value)
+
+    rewards = TokenReward.objects.bulk_create([
+        TokenReward(
+            user_id=staking.user_id,
+            amount=staking.amount,
+            reward_type='staking_unlock',
+            related_staking=staking
+        )
+        for staking in stakings
+    ])
+    post_entries([
+        entry_for_reward(reward, staked_delta=-reward.amount)
+        for reward in rewards
+    ])
+    DailyRollup().rewards(rewards).save()
+    return stakings
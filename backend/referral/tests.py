@@ -1,3 +1,1207 @@
-from django.test import TestCase
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F, Q, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, views
+from .admin import DaysRemainingFilter
+from .benchmark import scratch_database
+from .cache import get_cache, get_or_compute
+from .metrics import RequestMetricsMiddleware, registry
+from .renderers import ORJSONRenderer
+from .ledger import find_drift, rebuild_rollup, stats_counters
+from . import services
+from .models import (
+    WalletUser, Referral, ReferralPath, Staking, TokenReward, LedgerEntry, OutboxEvent, DailyStats, PayoutBatch,
+    DashboardSnapshot,
+)
+from . import dashboard
+from .export import astream_rows, export_queryset, stream_rows
+from .outbox import drain_outbox
+from .payouts import claim_payout_batches, mark_batches_paid, release_batches
+from .rollups import backfill
+from .pagination import decode_cursor, encode_cursor
+from .services import register_referral, stake, unlock_stakings
+
+
+class HotQueryIndexTests(TestCase):
+    """هر کوئری پرتکرار باید از ایندکس استفاده کند، نه پیمایش کامل جدول"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + 'a' * 40)
+        Staking.objects.create(user=cls.user, amount=1)
+        TokenReward.objects.create(user=cls.user, amount=1, reward_type='staking_self')
+
+    def assertUsesIndex(self, queryset, index_name=None):
+        plan = queryset.explain()
+        if index_name:
+            self.assertIn(index_name, plan, msg=plan)
+        for line in plan.splitlines():
+            # SQLite: «SCAN table» بدون INDEX؛ PostgreSQL: «Seq Scan»
+            full_scan = ('SCAN' in line and 'INDEX' not in line) or 'Seq Scan' in line
+            self.assertFalse(full_scan, msg=plan)
+
+    def test_stakings_page_by_user(self):
+        self.assertUsesIndex(
+            Staking.objects.filter(user=self.user).order_by('-staked_at', '-id')[:51],
+            'staking_user_staked_idx'
+        )
+
+    def test_rewards_by_user_and_type(self):
+        self.assertUsesIndex(
+            TokenReward.objects.filter(user=self.user, reward_type='staking_self'),
+            'reward_user_type_idx'
+        )
+
+    def test_active_stakings_by_unlock_date(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            Staking.objects.filter(is_unlocked=False, unlock_date__lte=now).order_by('unlock_date'),
+            'staking_active_unlock_idx'
+        )
+
+    def test_days_remaining_filter(self):
+        list_filter = DaysRemainingFilter(None, {'days_remaining': ['less_than_30']}, Staking, None)
+        self.assertUsesIndex(
+            list_filter.queryset(None, Staking.objects.all()),
+            'staking_active_unlock_idx'
+        )
+
+    def test_today_ranges(self):
+        today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = today_start + timezone.timedelta(days=1)
+        self.assertUsesIndex(
+            Staking.objects.filter(staked_at__gte=today_start, staked_at__lt=today_end),
+            'staking_staked_at_idx'
+        )
+        self.assertUsesIndex(
+            WalletUser.objects.filter(created_at__gte=today_start, created_at__lt=today_end),
+            'walletuser_created_idx'
+        )
+
+    def test_leaderboard_rank_ranges(self):
+        self.assertUsesIndex(
+            WalletUser.objects.filter(total_staked__gt=0).order_by('-total_staked', 'id')[:10],
+            'walletuser_stakers_rank_idx'
+        )
+        self.assertUsesIndex(WalletUser.objects.filter(referral_count__gt=3), 'walletuser_referrers_rank_idx')
+        self.assertUsesIndex(
+            WalletUser.objects.filter(referral_count=3, id__lt=self.user.pk),
+            'walletuser_referrers_rank_idx'
+        )
+
+    def test_unbatched_rewards(self):
+        self.assertUsesIndex(
+            TokenReward.objects.filter(is_paid=False, payout_batch__isnull=True).order_by('user_id', 'id')[:5000]
+        )
+
+    def test_stats_fallback_breakdown(self):
+        rewards = TokenReward.objects.filter(user_id__in=[self.user.pk]).values('user_id').annotate(
+            total=Sum('amount', filter=Q(reward_type='staking_self'))
+        )
+        self.assertUsesIndex(rewards)
+        self.assertEqual(stats_counters([self.user.pk])[self.user.pk]['staking_self_rewards'], 1)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """تعداد کوئری هر changelist ادمین باید مستقل از تعداد سطرهای صفحه باشد"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        users = WalletUser.objects.bulk_create([
+            WalletUser(wallet_address=f'0x{i:040x}', referral_code=f'code{i}')
+            for i in range(110)
+        ])
+        referrals = Referral.objects.bulk_create([
+            Referral(referrer=users[0], referee=user, has_received_signup_bonus=True)
+            for user in users[1:]
+        ])
+        stakings = Staking.objects.bulk_create([
+            Staking(user=user, amount=1, unlock_date=timezone.now())
+            for user in users
+        ])
+        TokenReward.objects.bulk_create(
+            [
+                TokenReward(user=staking.user, amount=1, reward_type='staking_self', related_staking=staking)
+                for staking in stakings
+            ] + [
+                TokenReward(user=users[0], amount=3, reward_type='signup_referral', related_referral=referral)
+                for referral in referrals
+            ]
+        )
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def changelist_queries(self, model, per_page, params=None):
+        model_admin = admin.site._registry[model]
+        url = reverse(f'admin:referral_{model._meta.model_name}_changelist')
+        with mock.patch.object(model_admin, 'list_per_page', per_page):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), per_page)
+        return len(queries)
+
+    def assertConstantQueries(self, model, params=None):
+        small = self.changelist_queries(model, 25, params)
+        large = self.changelist_queries(model, 100, params)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 10)
+
+    def test_walletuser_changelist(self):
+        self.assertConstantQueries(WalletUser)
+
+    def test_walletuser_sorted_by_referral_count(self):
+        index = admin.site._registry[WalletUser].list_display.index('referral_count_display')
+        self.assertConstantQueries(WalletUser, {'o': f'-{index + 1}'})
+
+    def test_referral_changelist(self):
+        self.assertConstantQueries(Referral)
+
+    def test_staking_changelist(self):
+        self.assertConstantQueries(Staking)
+
+    def test_tokenreward_changelist(self):
+        self.assertConstantQueries(TokenReward)
+
+
+@override_settings(REFERRAL_CACHE_TIMEOUT=0)
+class AsyncReadViewTests(TestCase):
+    """viewهای async باید همان پاسخ نسخه sync را برگردانند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + 'b' * 40)
+        for _ in range(3):
+            stake(cls.user, Decimal('10'))
+
+    def assertSameResponse(self, name, path, *args):
+        sync_response = getattr(views, name)(RequestFactory().get(path), *args)
+        sync_response.render()
+        async_response = async_to_sync(getattr(async_views, name))(RequestFactory().get(path), *args)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+
+    def test_user_stats(self):
+        self.assertSameResponse('get_user_stats', '/', self.user.wallet_address)
+        self.assertSameResponse('get_user_stats', '/', '0xmissing')
+
+    def test_user_stakings(self):
+        self.assertSameResponse('get_user_stakings', '/?page_size=2', self.user.wallet_address)
+        self.assertSameResponse('get_user_stakings', '/?cursor=bad', self.user.wallet_address)
+
+
+@override_settings(REFERRAL_CACHE_TIMEOUT=0)
+class RequestMetricsTests(TestCase):
+    """middleware سنجش باید تأخیر، کوئری‌ها و اندازه پاسخ هر view را ثبت کند"""
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.user = WalletUser.objects.create(wallet_address='0x' + 'c' * 40)
+
+    def test_records_view_metrics(self):
+        response = self.client.get(reverse('user_stakings', args=[self.user.wallet_address]))
+        self.client.get(reverse('user_stats', args=['0xmissing']))
+
+        snapshot = self.client.get(reverse('metrics_json')).json()
+        self.assertEqual(set(snapshot), {'user_stakings', 'user_stats'})
+        stakings = snapshot['user_stakings']
+        self.assertEqual(stakings['statuses'], {'200': 1})
+        self.assertGreaterEqual(stakings['db_queries']['sum'], 2)
+        self.assertEqual(stakings['response_size_bytes']['sum'], len(response.content))
+        self.assertEqual(snapshot['user_stats']['statuses'], {'404': 1})
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('referral_requests_total{view="user_stats",status="404"} 1', text)
+        self.assertIn('referral_db_queries_count{view="user_stakings"} 1', text)
+
+    @override_settings(REFERRAL_SLOW_REQUEST_MS=0)
+    def test_slow_request_log_includes_sql(self):
+        with self.assertLogs('referral.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('user_stakings', args=[self.user.wallet_address]))
+        self.assertIn('view=user_stakings', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_asgi_requests_record_queries(self):
+        stake(self.user, Decimal('10'))
+        # زیر ASGI کوئری‌ها در نخ sync_to_async اجرا می‌شوند، نه نخ event loop
+        async_to_sync(self.async_client.get)(reverse('user_stakings', args=[self.user.wallet_address]))
+        async_to_sync(self.async_client.get)(reverse('user_stats', args=[self.user.wallet_address]))
+        snapshot = registry.snapshot()
+        for view in ('user_stakings', 'user_stats'):
+            self.assertGreaterEqual(snapshot[view]['db_queries']['sum'], 1, view)
+            self.assertGreater(snapshot[view]['db_duration_seconds']['sum'], 0, view)
+
+    def test_async_chain_stays_async(self):
+        async def async_view_handler(request):
+            return HttpResponse(b'ok')
+
+        middleware = RequestMetricsMiddleware(async_view_handler)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/api/ping/'))
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(registry.snapshot()['unmatched']['statuses'], {'200': 1})
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class IdempotentStakingTests(TestCase):
+    """تکرار process_staking با همان tx_hash نباید استیکینگ یا پاداش جدید بسازد"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + 'd' * 40)
+
+    def post_stake(self, amount=10, tx_hash='0xtx1'):
+        return self.client.post(reverse('process_staking'), {
+            'wallet_address': self.user.wallet_address,
+            'amount': amount,
+            'tx_hash': tx_hash,
+        }, content_type='application/json')
+
+    def assertReplayed(self, first, second):
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(second.json()['duplicate'])
+        self.assertEqual(
+            {**second.json(), 'duplicate': False},
+            first.json()
+        )
+        self.assertEqual(Staking.objects.count(), 1)
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 1)
+
+    def test_retry_returns_original_invoice(self):
+        first = self.post_stake()
+        self.assertFalse(first.json()['duplicate'])
+        self.assertReplayed(first, self.post_stake())
+
+    def test_concurrent_retry_hits_unique_constraint(self):
+        first = self.post_stake()
+        # درخواست هم‌زمانی که بررسی اول را قبل از commit اولی انجام داده است
+        with mock.patch.object(services, 'find_stakes', side_effect=[{}, services.find_stakes(['0xtx1'])]):
+            second = self.post_stake()
+        self.assertReplayed(first, second)
+
+    def test_reused_tx_hash_with_other_amount(self):
+        self.post_stake()
+        self.assertEqual(self.post_stake(amount=20).status_code, 409)
+
+    def test_empty_tx_hash_is_not_unique(self):
+        self.post_stake(tx_hash='')
+        self.post_stake(tx_hash='')
+        self.assertEqual(Staking.objects.count(), 2)
+
+
+class LedgerDriftTests(TestCase):
+    """موجودی تجمیعی هر کاربر باید با مجموع سطرهای دفتر کل او برابر باشد"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.referrer = WalletUser.objects.create(wallet_address='0x' + '3' * 40)
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '4' * 40)
+        register_referral(cls.user, cls.referrer)
+        # مبلغ‌هایی که جمعشان در REAL (SUM در SQLite) دقیق نیست
+        for amount in ('0.1', '0.2', '0.30000001', '12345.67890123') * 3:
+            stake(cls.user, Decimal(amount))
+
+    def test_no_drift_after_writes(self):
+        self.assertEqual(list(find_drift()), [])
+
+    def test_drift_is_found_and_rebuilt(self):
+        WalletUser.objects.filter(pk=self.user.pk).update(token_balance=Decimal('1'))
+        drifted = list(find_drift())
+        self.assertEqual([user.pk for user in drifted], [self.user.pk])
+        expected = LedgerEntry.objects.filter(user=self.user).aggregate(total=Sum('token_delta'))['total']
+        self.assertEqual(drifted[0].ledger_token_balance, expected)
+
+        rebuild_rollup(drifted[0])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, expected)
+        self.assertEqual(list(find_drift()), [])
+
+    def test_verify_ledger_command(self):
+        WalletUser.objects.filter(pk=self.referrer.pk).update(total_earned=F('total_earned') + 1)
+        out = io.StringIO()
+        call_command('verify_ledger', stdout=out)
+        self.assertIn(self.referrer.wallet_address, out.getvalue())
+        self.assertIn('1 کاربر ناهمخوان', out.getvalue())
+
+        call_command('verify_ledger', '--fix', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('verify_ledger', stdout=out)
+        self.assertIn('همه موجودی‌ها با دفتر کل همخوان است', out.getvalue())
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class StakingBatchTests(TestCase):
+    """process_staking_batch همان قواعد process_staking را گروهی اعمال می‌کند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.referrer = WalletUser.objects.create(wallet_address='0x' + '1' * 40)
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '2' * 40)
+        register_referral(cls.user, cls.referrer)
+
+    def post_batch(self, stakes):
+        return self.client.post(reverse('process_staking_batch'), {'stakes': stakes}, content_type='application/json')
+
+    def stakes(self, *tx_hashes):
+        return [{'wallet_address': self.user.wallet_address, 'amount': 100, 'tx_hash': tx} for tx in tx_hashes]
+
+    def test_batch_is_applied_once(self):
+        first = self.post_batch(self.stakes('0xb1', '0xb2') + [
+            {'wallet_address': '0xunknown', 'amount': 1, 'tx_hash': '0xb3'}
+        ]).json()
+        self.assertEqual((first['processed'], first['failed']), (2, 1))
+        self.assertEqual(first['results'][2]['error'], 'User not found')
+        self.assertEqual(first['results'][1]['total_staked'], 200)
+
+        replay = self.post_batch(self.stakes('0xb2', '0xb1')).json()
+        self.assertTrue(all(result['duplicate'] for result in replay['results']))
+        self.assertEqual(replay['results'][0]['staking_id'], first['results'][1]['staking_id'])
+        self.user.refresh_from_db()
+        self.referrer.refresh_from_db()
+        self.assertEqual((self.user.total_staked, self.user.token_balance), (200, 10))
+        self.assertEqual(self.referrer.staking_referral_rewards, 10)
+        self.assertEqual(Staking.objects.count(), 2)
+
+    def test_concurrent_retry_hits_unique_constraint(self):
+        first = self.post_batch(self.stakes('0xb1')).json()
+        # دسته هم‌زمانی که بررسی tx_hash را قبل از commit اولی انجام داده است
+        with mock.patch.object(services, 'find_stakes', side_effect=[{}, services.find_stakes(['0xb1'])]):
+            second = self.post_batch(self.stakes('0xb1')).json()
+        self.assertTrue(second['results'][0]['duplicate'])
+        self.assertEqual(second['results'][0]['staking_id'], first['results'][0]['staking_id'])
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 1)
+
+    def test_wallet_updates_scale_linearly(self):
+        def run(size):
+            users = WalletUser.objects.bulk_create([
+                WalletUser(wallet_address=f'0xscale{size}-{index}', referral_code=f's{size}-{index}')
+                for index in range(size)
+            ])
+            items = [(user.wallet_address, Decimal(index + 1), '') for index, user in enumerate(users)]
+            with CaptureQueriesContext(connection) as queries:
+                services.stake_batch(items)
+            return [
+                query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith('UPDATE "referral_walletuser"')
+            ]
+
+        small, large = run(10), run(100)
+        # یک UPDATE برای هر کیف‌پول با دلتای متفاوت؛ اندازه هر دستور به اندازه دسته بستگی ندارد
+        self.assertEqual((len(small), len(large)), (10, 100))
+        self.assertLessEqual(max(map(len, large)), max(map(len, small)) + 10)
+
+    def test_invalid_items_reject_the_batch(self):
+        response = self.post_batch(self.stakes('0xb1') + [
+            {'wallet_address': ['0xlist'], 'amount': 1},
+            {'wallet_address': self.user.wallet_address, 'amount': '1e12'},
+            {'wallet_address': self.user.wallet_address, 'amount': 'NaN'},
+            {'wallet_address': self.user.wallet_address, 'amount': 1, 'tx_hash': 'x' * 101},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 1, 'error': 'Wallet address required'},
+            {'index': 2, 'error': 'Invalid amount'},
+            {'index': 3, 'error': 'Invalid amount'},
+            {'index': 4, 'error': 'Invalid tx_hash'},
+        ])
+        self.assertFalse(Staking.objects.exists())
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class ConcurrentRewardTests(TransactionTestCase):
+    """استیک‌های هم‌زمان زیرمجموعه‌های یک معرف نباید پاداش‌های او را گم کنند"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # حافظه مشترک SQLite به جای انتظار برای قفل خطا می‌دهد
+            self.skipTest('needs PostgreSQL or a file-backed SQLite test database')
+
+    def test_concurrent_stakes_credit_referrer_once_each(self):
+        referrer = WalletUser.objects.create(wallet_address='0x' + '5' * 40)
+        referees = [WalletUser.objects.create(wallet_address=f'0x{index:040x}') for index in range(1, 7)]
+        for referee in referees:
+            register_referral(referee, referrer)
+        barrier = threading.Barrier(len(referees))
+        errors = []
+
+        def run(referee):
+            try:
+                barrier.wait()
+                stake(referee, Decimal('100'))
+            except Exception as exc:  # گزارش در رشته اصلی
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(referee,)) for referee in referees]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        referrer.refresh_from_db()
+        self.assertEqual(referrer.staking_referral_rewards, 30)
+        self.assertEqual(referrer.token_balance, 3 * len(referees) + 30)
+        self.assertEqual(referrer.ledger_sequence, 2 * len(referees))
+        self.assertEqual(list(find_drift()), [])
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False, REFERRAL_CACHE_TIMEOUT=0)
+class UserStatsCounterTests(TestCase):
+    """شمارنده‌های ردیف کاربر باید با تجمیع مستقیم پاداش‌ها برابر بمانند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.referrer = WalletUser.objects.create(wallet_address='0x' + '6' * 40)
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '7' * 40)
+        register_referral(cls.user, cls.referrer)
+        first, _ = stake(cls.user, Decimal('100'))
+        stake(cls.user, Decimal('50'))
+        unlock_stakings([first.pk], check_schedule=False)
+
+    def test_counters_after_stake_and_unlock(self):
+        self.referrer.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(views.user_counters(self.referrer), {
+            'referral_count': 1,
+            'signup_rewards': 3,
+            'staking_self_rewards': 0,
+            'staking_referral_rewards': Decimal('7.5'),
+        })
+        self.assertEqual(views.user_counters(self.user)['staking_self_rewards'], Decimal('7.5'))
+        self.assertEqual(self.user.total_staked, 50)
+        computed = stats_counters([self.referrer.pk, self.user.pk])
+        for user in (self.referrer, self.user):
+            self.assertEqual(views.user_counters(user), computed[user.pk])
+
+    def test_endpoint_matches_fallback(self):
+        for user in (self.referrer, self.user):
+            url = reverse('user_stats', args=[user.wallet_address])
+            from_counters = self.client.get(url).json()
+            with override_settings(REFERRAL_STATS_USE_COUNTERS=False):
+                self.assertEqual(self.client.get(url).json(), from_counters)
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False, REFERRAL_CACHE_TIMEOUT=0)
+class StakingListPaginationTests(TestCase):
+    """صفحه‌های لیست استیکینگ با next_cursor پشت هم و بدون تکرار می‌آیند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '8' * 40)
+        stakings = [stake(cls.user, Decimal(amount))[0] for amount in range(1, 6)]
+        # دو استیکینگ با زمان یکسان تا ترتیب با id شکسته شود
+        Staking.objects.filter(pk=stakings[2].pk).update(staked_at=stakings[1].staked_at)
+        cls.expected = list(Staking.objects.order_by('-staked_at', '-id').values_list('id', flat=True))
+
+    def get(self, **params):
+        return self.client.get(reverse('user_stakings', args=[self.user.wallet_address]), params)
+
+    def test_next_cursor_round_trip(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.get(**params).json()
+            self.assertEqual(data['active_stakings'], 5)
+            seen += [row['id'] for row in data['stakings']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_cursor_encoding(self):
+        staking = Staking.objects.get(pk=self.expected[0])
+        self.assertEqual(decode_cursor(encode_cursor(staking.staked_at, staking.pk)), (staking.staked_at, staking.pk))
+
+    def test_tampered_cursor_is_rejected(self):
+        valid = self.get(page_size=2).json()['next_cursor']
+        for cursor in (valid[:-3] + '!!!', 'bm90LWEtY3Vyc29y', valid + 'AAAA'):
+            response = self.get(cursor=cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False, REFERRAL_CACHE_TIMEOUT=30)
+class ReadCacheTests(TestCase):
+    """کش خواندنی بعد از commit باطل می‌شود و هر کلید را یک بار محاسبه می‌کند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '9' * 40)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def total_staked(self):
+        return self.client.get(reverse('user_stats', args=[self.user.wallet_address])).json()['total_staked']
+
+    def test_invalidated_on_commit(self):
+        self.assertEqual(self.total_staked(), 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            stake(self.user, Decimal('100'))
+        # تا commit نشده، کش همان مقدار قبلی را می‌دهد
+        self.assertEqual(self.total_staked(), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.total_staked(), 100)
+
+    def test_stampede_computes_once(self):
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'value': 1}
+
+        def read():
+            results.append(get_or_compute('referral:test:stampede', compute))
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 8)
+
+    def test_stale_value_is_served_while_one_reader_refreshes(self):
+        get_or_compute('referral:test:stale', lambda: 'old')
+        with mock.patch('referral.cache.time.time', return_value=time.time() + 31):
+            get_cache().add('referral:test:stale:lock', 1)
+            self.assertEqual(get_or_compute('referral:test:stale', lambda: 'new'), 'old')
+            get_cache().delete('referral:test:stale:lock')
+            self.assertEqual(get_or_compute('referral:test:stale', lambda: 'new'), 'new')
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class UnlockMaturedTests(TestCase):
+    """آزادسازی دوره‌ای فقط استیکینگ‌های سررسیده را به ترتیب موعد و دسته‌دسته آزاد می‌کند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = WalletUser.objects.create(wallet_address='0x' + 'aa' * 20)
+        cls.second = WalletUser.objects.create(wallet_address='0x' + 'bb' * 20)
+        now = timezone.now()
+        cls.matured = []
+        for days, user in ((3, cls.second), (2, cls.first), (1, cls.first)):
+            staking, _ = stake(user, Decimal('10'))
+            Staking.objects.filter(pk=staking.pk).update(unlock_date=now - timezone.timedelta(days=days))
+            cls.matured.append(staking.pk)
+        cls.active, _ = stake(cls.first, Decimal('20'))
+
+    def test_chunks_in_unlock_date_order(self):
+        self.assertEqual([s.pk for s in services.unlock_matured_chunk(2)], self.matured[:2])
+        self.assertEqual([s.pk for s in services.unlock_matured_chunk(2)], self.matured[2:])
+        self.assertEqual(services.unlock_matured_chunk(2), [])
+
+        self.assertEqual(
+            set(Staking.objects.filter(is_unlocked=True).values_list('pk', flat=True)), set(self.matured)
+        )
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.total_staked, self.second.total_staked), (20, 0))
+        self.assertEqual(TokenReward.objects.filter(reward_type='staking_unlock').count(), 3)
+        self.assertEqual(DailyStats.objects.aggregate(total=Sum('unlocked_volume'))['total'], 30)
+        self.assertEqual(list(find_drift()), [])
+
+    def test_command_runs_until_done(self):
+        out = io.StringIO()
+        call_command('unlock_matured_stakes', '--chunk-size', '2', stdout=out)
+        self.assertIn('3 استیکینگ در 2 دسته آزاد شد', out.getvalue())
+        self.assertFalse(Staking.objects.get(pk=self.active.pk).is_unlocked)
+
+
+class ReferralCodeTests(TestCase):
+    """کد معرف با insert و تلاش دوباره روی قید unique تخصیص داده می‌شود"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.taken = WalletUser.objects.create(wallet_address='0x' + 'cc' * 20, referral_code='taken')
+
+    def create(self, codes, wallet_address='0x' + 'dd' * 20):
+        with mock.patch.object(WalletUser, 'generate_referral_code', side_effect=codes) as generate:
+            try:
+                return WalletUser.objects.create(wallet_address=wallet_address)
+            finally:
+                self.calls = generate.call_count
+
+    def test_collision_is_retried_inside_atomic(self):
+        with transaction.atomic():
+            user = self.create(['taken', 'taken', 'fresh'])
+            # تراکنش بیرونی بعد از برخوردها هنوز قابل استفاده است
+            self.assertEqual(WalletUser.objects.filter(referral_code='fresh').count(), 1)
+        self.assertEqual((user.referral_code, self.calls), ('fresh', 3))
+
+    def test_gives_up_after_attempts(self):
+        with self.assertRaisesMessage(IntegrityError, 'Could not allocate a unique referral code'):
+            self.create(itertools.repeat('taken'))
+        self.assertEqual(self.calls, WalletUser.REFERRAL_CODE_ATTEMPTS)
+
+    def test_other_unique_errors_propagate(self):
+        with self.assertRaises(IntegrityError):
+            self.create(['fresh', 'other'], wallet_address=self.taken.wallet_address)
+        self.assertEqual(self.calls, 1)
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class ReferralTreeTests(TestCase):
+    """register_referral جدول بستار را نگه می‌دارد و سطوح زیرمجموعه از آن خوانده می‌شوند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root, cls.first, cls.second, cls.third, cls.other = [
+            WalletUser.objects.create(wallet_address=f'0x{index:040x}') for index in range(20, 25)
+        ]
+        register_referral(cls.first, cls.root)
+        register_referral(cls.second, cls.first)
+        register_referral(cls.third, cls.second)
+        register_referral(cls.other, cls.root)
+        stake(cls.second, Decimal('10'))
+        stake(cls.third, Decimal('20'))
+
+    def test_paths_to_every_ancestor(self):
+        self.assertEqual(
+            list(ReferralPath.objects.filter(descendant=self.third).order_by('depth').values_list('ancestor', 'depth')),
+            [(self.second.pk, 1), (self.first.pk, 2), (self.root.pk, 3)]
+        )
+        self.assertEqual(ReferralPath.objects.count(), 7)
+
+    def test_downline_levels(self):
+        self.assertEqual(services.downline_levels(self.root), [
+            {'depth': 1, 'members': 2, 'total_staked': 0},
+            {'depth': 2, 'members': 1, 'total_staked': 10},
+            {'depth': 3, 'members': 1, 'total_staked': 20},
+        ])
+        self.assertEqual(len(services.downline_levels(self.root, max_depth=2)), 2)
+        self.assertEqual(services.downline_levels(self.third), [])
+
+    def test_downline_endpoint(self):
+        data = self.client.get(reverse('user_downline', args=[self.root.wallet_address])).json()
+        self.assertEqual((data['downline_size'], data['depth'], data['total_staked_volume']), (4, 3, 30))
+
+    def test_referral_admin_is_read_only(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        referral = Referral.objects.get(referee=self.third)
+        self.assertEqual(self.client.get(reverse('admin:referral_referral_add')).status_code, 403)
+        change_url = reverse('admin:referral_referral_change', args=[referral.pk])
+        self.assertEqual(self.client.post(change_url, {'referrer': self.root.pk}).status_code, 403)
+        delete_url = reverse('admin:referral_referral_delete', args=[referral.pk])
+        self.assertEqual(self.client.post(delete_url, {'post': 'yes'}).status_code, 403)
+        self.assertEqual(Referral.objects.get(pk=referral.pk).referrer_id, self.second.pk)
+
+
+@override_settings(REFERRAL_CACHE_TIMEOUT=30, REFERRAL_DASHBOARD_MAX_AGE=900)
+class DashboardSnapshotTests(TestCase):
+    """داشبورد snapshot موجود را حتی اگر کهنه باشد می‌دهد و فقط بار اول محاسبه می‌کند"""
+
+    def setUp(self):
+        get_cache().clear()
+        patcher = mock.patch.object(dashboard, 'compute_dashboard', side_effect=lambda: {'total_users': 0})
+        self.compute = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def snapshot(self, age):
+        snapshot = DashboardSnapshot.objects.create(data={'total_users': age})
+        DashboardSnapshot.objects.filter(pk=snapshot.pk).update(
+            created_at=timezone.now() - timezone.timedelta(seconds=age)
+        )
+        return snapshot
+
+    def test_first_request_computes_once(self):
+        first = dashboard.get_dashboard()
+        self.assertEqual(dashboard.get_dashboard().pk, first.pk)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertFalse(dashboard.is_stale(first))
+
+    def test_stale_snapshot_is_served(self):
+        stale = self.snapshot(3600)
+        served = dashboard.get_dashboard()
+        self.assertEqual(served.pk, stale.pk)
+        self.assertTrue(dashboard.is_stale(served))
+        self.compute.assert_not_called()
+
+    def test_force_refresh_recomputes(self):
+        stale = self.snapshot(3600)
+        self.assertNotEqual(dashboard.get_dashboard(force_refresh=True).pk, stale.pk)
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_waits_for_concurrent_first_computation(self):
+        key = 'referral:dashboard:first'
+        get_cache().add(f'{key}:lock', 1)
+        built = self.snapshot(0)
+
+        def other_request_finishes(seconds):
+            get_cache().set(key, (built, time.time() + 30))
+
+        # صاحب قفل (درخواست دیگر) در حین انتظار نتیجه را در کش می‌گذارد
+        DashboardSnapshot.objects.all().delete()
+        with mock.patch('referral.cache.time.sleep', side_effect=other_request_finishes):
+            self.assertEqual(dashboard.get_dashboard().pk, built.pk)
+        self.compute.assert_not_called()
+
+    def test_refresh_command_prunes(self):
+        old = [self.snapshot(age).pk for age in (300, 200, 100)]
+        call_command('refresh_dashboard', '--keep', '2', stdout=io.StringIO())
+        kept = list(DashboardSnapshot.objects.order_by('-created_at').values_list('pk', flat=True))
+        self.assertEqual(kept[1:], [old[2]])
+        self.assertEqual(self.compute.call_count, 1)
+
+
+class ORJSONRendererTests(TestCase):
+    """Decimal بدون گذر از float و datetime به صورت RFC 3339 نوشته می‌شود"""
+
+    def test_decimal_as_exact_number(self):
+        rendered = ORJSONRenderer().render({'amount': Decimal('123456789012.12345678'), 'count': 3})
+        self.assertEqual(rendered, b'{"amount":123456789012.12345678,"count":3}')
+
+    @override_settings(REFERRAL_JSON_DECIMAL='string')
+    def test_decimal_as_string(self):
+        rendered = ORJSONRenderer().render({'amount': Decimal('0.00000001')})
+        self.assertEqual(rendered, b'{"amount":"0.00000001"}')
+
+    def test_datetime(self):
+        moment = timezone.datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.get_fixed_timezone(0))
+        self.assertEqual(ORJSONRenderer().render({'at': moment}), b'{"at":"2025-01-02T03:04:05+00:00"}')
+
+
+class ApiMiddlewarePathTests(TestCase):
+    """مسیرهای API بدون session، احراز هویت و CSRF اجرا می‌شوند؛ ادمین مثل قبل"""
+
+    def test_api_skips_session_and_auth(self):
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(superuser)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user_stats', args=['0xmissing']), HTTP_ORIGIN='http://localhost:3000')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(any('django_session' in query['sql'] for query in queries))
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'http://localhost:3000')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_admin_keeps_full_stack(self):
+        response = self.client.get(reverse('admin:login'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertIn('csrftoken', response.cookies)
+
+
+@override_settings(REFERRAL_RATE_LIMITS={'save_wallet': {'wallet': '2/min', 'ip': '3/min'}})
+class RateLimitTests(TestCase):
+    """درخواست بیش از سقف با 429 و بدون هیچ کوئری رد می‌شود"""
+
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.addCleanup(caches['ratelimit'].clear)
+
+    def save_wallet(self, wallet_address, ip='10.0.0.1'):
+        return self.client.post(
+            reverse('save_wallet'), {'wallet_address': wallet_address},
+            content_type='application/json', HTTP_X_FORWARDED_FOR=f'1.2.3.4, {ip}'
+        )
+
+    def test_per_wallet_limit(self):
+        self.assertEqual(self.save_wallet('0xw1').status_code, 200)
+        self.assertEqual(self.save_wallet('0xw1').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.save_wallet('0xw1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.save_wallet('0xw2').status_code, 200)
+
+    def test_per_ip_limit_uses_proxy_address(self):
+        for i in range(3):
+            self.assertEqual(self.save_wallet(f'0xip{i}').status_code, 200)
+        self.assertEqual(self.save_wallet('0xip3').status_code, 429)
+        self.assertEqual(self.save_wallet('0xip3', ip='10.0.0.2').status_code, 200)
+
+    def test_rejected_request_does_not_consume_other_bucket(self):
+        self.save_wallet('0xa')
+        self.save_wallet('0xa')
+        self.assertEqual(self.save_wallet('0xa').status_code, 429)
+        # سطل IP فقط دو توکن مصرف کرده است
+        self.assertEqual(self.save_wallet('0xb').status_code, 200)
+        self.assertEqual(self.save_wallet('0xc').status_code, 429)
+
+
+@override_settings(REFERRAL_RATE_LIMITS={'process_staking_batch': {'ip': '5/min', 'per_item': 'stakes'}})
+class BatchRateLimitTests(TestCase):
+    """هر استیکینگ process_staking_batch یک توکن از سطل IP مصرف می‌کند"""
+
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.addCleanup(caches['ratelimit'].clear)
+
+    def post_batch(self, count, ip='10.0.0.1'):
+        stakes = [{'wallet_address': '0xnobody', 'amount': 1, 'tx_hash': f'0xrl{i}'} for i in range(count)]
+        return self.client.post(
+            reverse('process_staking_batch'), {'stakes': stakes},
+            content_type='application/json', HTTP_X_FORWARDED_FOR=f'1.2.3.4, {ip}'
+        )
+
+    def test_charged_per_item(self):
+        self.assertEqual(self.post_batch(3).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.post_batch(3)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.post_batch(2).status_code, 200)
+        self.assertEqual(self.post_batch(1).status_code, 429)
+        self.assertEqual(self.post_batch(3, ip='10.0.0.2').status_code, 200)
+
+    def test_batch_larger_than_bucket_needs_full_bucket(self):
+        self.assertEqual(self.post_batch(8).status_code, 200)
+        self.assertEqual(self.post_batch(1).status_code, 429)
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=True)
+class StakingOutboxTests(TestCase):
+    """درخواست فقط Staking و رویداد outbox می‌نویسد؛ worker پاداش‌ها را یک بار اعمال می‌کند"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.referrer = WalletUser.objects.create(wallet_address='0x' + 'e' * 40)
+        cls.user = WalletUser.objects.create(wallet_address='0x' + 'f' * 40)
+        register_referral(cls.user, cls.referrer)
+
+    def post_stake(self, tx_hash):
+        return self.client.post(reverse('process_staking'), {
+            'wallet_address': self.user.wallet_address,
+            'amount': 100,
+            'tx_hash': tx_hash,
+        }, content_type='application/json')
+
+    def test_request_defers_rewards(self):
+        response = self.post_stake('0xout1').json()
+        self.assertTrue(response['rewards_pending'])
+        self.assertIsNone(response['new_token_balance'])
+        self.assertEqual(OutboxEvent.objects.filter(processed_at__isnull=True).count(), 1)
+        self.assertFalse(TokenReward.objects.filter(related_staking__isnull=False).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_staked, 0)
+
+    def test_worker_applies_once(self):
+        self.post_stake('0xout1')
+        self.post_stake('0xout2')
+        self.assertEqual(drain_outbox(100, 3), (2, 0))
+        self.assertEqual(drain_outbox(100, 3), (0, 0))
+
+        self.user.refresh_from_db()
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.user.total_staked, 200)
+        self.assertEqual(self.user.token_balance, 10)
+        self.assertEqual(self.referrer.staking_referral_rewards, 10)
+        self.assertEqual(TokenReward.objects.filter(reward_type__startswith='staking').count(), 4)
+
+        replay = self.post_stake('0xout1').json()
+        self.assertTrue(replay['duplicate'])
+        self.assertFalse(replay['rewards_pending'])
+
+    def test_replay_while_pending_returns_same_invoice(self):
+        first = self.post_stake('0xout1').json()
+        self.post_stake('0xout2')
+        replay = self.post_stake('0xout1').json()
+        self.assertTrue(replay.pop('duplicate'))
+        self.assertFalse(first.pop('duplicate'))
+        self.assertEqual(replay, first)
+
+    def test_unlock_waits_for_rewards(self):
+        self.post_stake('0xout1')
+        staking = Staking.objects.get(tx_hash='0xout1')
+        Staking.objects.filter(pk=staking.pk).update(unlock_date=timezone.now())
+
+        self.assertEqual(unlock_stakings([staking.pk], check_schedule=False), [])
+        self.assertEqual(services.unlock_matured_chunk(10), [])
+        response = self.client.post(reverse('unlock_staking', args=[staking.pk]))
+        self.assertEqual(response.status_code, 409)
+        staking.refresh_from_db()
+        self.assertFalse(staking.is_unlocked)
+
+        drain_outbox(100, 3)
+        self.assertEqual(self.client.post(reverse('unlock_staking', args=[staking.pk])).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_staked, 0)
+        self.assertEqual(self.user.token_balance, 5)
+
+    def test_failing_event_is_retried_later(self):
+        self.post_stake('0xout1')
+        self.post_stake('0xout2')
+        broken = OutboxEvent.objects.order_by('id').first()
+
+        def apply(specs, stakings):
+            if any(staking.pk == broken.payload['staking_id'] for staking in stakings):
+                raise IntegrityError('broken event')
+            return services.apply_stake_rewards(specs, stakings)
+
+        with mock.patch('referral.outbox.apply_stake_rewards', side_effect=apply):
+            self.assertEqual(drain_outbox(100, 3), (1, 1))
+
+        broken.refresh_from_db()
+        self.assertIsNone(broken.processed_at)
+        self.assertEqual(broken.attempts, 1)
+        self.assertGreater(broken.available_at, timezone.now())
+        self.assertEqual(drain_outbox(100, 3), (0, 0))
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False)
+class LeaderboardTests(TestCase):
+    """جدول رتبه از شمارنده‌های به‌روزشده با هر رفرال و استیک خوانده می‌شود"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [WalletUser.objects.create(wallet_address=f'0x{index:040x}') for index in range(4)]
+        first, second, third, idle = cls.users
+        register_referral(third, first)
+        register_referral(idle, second)
+        stake(first, Decimal('50'))
+        stake(second, Decimal('80'))
+        stake(third, Decimal('50'))
+
+    def get(self, name, *args):
+        return self.client.get(reverse(name, args=args)).json()
+
+    def test_top_stakers(self):
+        entries = self.get('leaderboard', 'stakers')['entries']
+        self.assertEqual([entry['wallet_address'] for entry in entries], [
+            self.users[1].wallet_address, self.users[0].wallet_address, self.users[2].wallet_address
+        ])
+        self.assertEqual([entry['rank'] for entry in entries], [1, 2, 3])
+
+    def test_rank_breaks_ties_by_signup_order(self):
+        self.assertEqual(self.get('leaderboard_rank', 'stakers', self.users[2].wallet_address)['rank'], 3)
+        self.assertEqual(self.get('leaderboard_rank', 'referrers', self.users[1].wallet_address)['rank'], 2)
+        self.assertIsNone(self.get('leaderboard_rank', 'referrers', self.users[3].wallet_address)['rank'])
+
+    def test_rank_follows_new_stake(self):
+        stake(self.users[2], Decimal('100'))
+        self.assertEqual(self.get('leaderboard_rank', 'stakers', self.users[2].wallet_address)['rank'], 1)
+
+    def test_unknown_board_and_wallet(self):
+        self.assertEqual(self.client.get(reverse('leaderboard', args=['whales'])).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('leaderboard_rank', args=['stakers', '0xmissing'])).status_code, 404
+        )
+
+
+@override_settings(REFERRAL_STAKING_OUTBOX=False, REFERRAL_ROLLUP_SHARDS=4)
+class DailyRollupTests(TestCase):
+    """آمار روزانه با هر نوشتن به‌روز می‌شود و با backfill از جدول‌های اصلی یکی است"""
+
+    def setUp(self):
+        self.client.post(reverse('save_wallet'), {'wallet_address': '0xroll1'}, content_type='application/json')
+        code = WalletUser.objects.get(wallet_address='0xroll1').referral_code
+        self.client.post(reverse('save_wallet'), {
+            'wallet_address': '0xroll2', 'referral_code': code
+        }, content_type='application/json')
+        for index, wallet_address in enumerate(['0xroll1', '0xroll2', '0xroll2']):
+            self.client.post(reverse('process_staking'), {
+                'wallet_address': wallet_address, 'amount': 100, 'tx_hash': f'0xrolltx{index}'
+            }, content_type='application/json')
+        unlock_stakings(Staking.objects.filter(tx_hash='0xrolltx0').values_list('id', flat=True), check_schedule=False)
+
+    def totals(self):
+        return self.client.get(reverse('stats_timeseries'), {'resolution': 'month'}).json()['series'][0]
+
+    def test_incremental_matches_backfill(self):
+        incremental = self.totals()
+        self.assertEqual(incremental['new_users'], 2)
+        self.assertEqual(incremental['referrals'], 1)
+        self.assertEqual(incremental['stakes'], 3)
+        self.assertEqual(incremental['staked_volume'], 300)
+        self.assertEqual(incremental['signup_rewards'], 3)
+        self.assertEqual(incremental['staking_self_rewards'], 15)
+        self.assertEqual(incremental['staking_referral_rewards'], 10)
+        self.assertEqual(incremental['unlocked_volume'], 100)
+
+        today = timezone.localdate()
+        self.assertEqual(backfill(today, today), 1)
+        self.assertEqual(DailyStats.objects.count(), 1)
+        self.assertEqual(self.totals(), incremental)
+
+    def test_series_reads_only_rollups(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('stats_timeseries'), {'resolution': 'week'})
+        self.assertEqual(len(response.json()['series']), 1)
+
+    def test_one_rollup_row_per_transaction(self):
+        referrer = WalletUser.objects.get(wallet_address='0xroll1')
+        referee = WalletUser.objects.get(wallet_address='0xroll2')
+        spec = {'referral_id': referee.referred_by.pk, 'referrer_id': referrer.pk}
+        DailyStats.objects.all().delete()
+        # هر save یک shard تازه می‌گیرد؛ دو save در یک تراکنش دو ردیف می‌سازد
+        with mock.patch('referral.rollups.random.randrange', side_effect=itertools.count()):
+            services.create_stakes([
+                {'user_id': referee.pk, 'wallet_address': referee.wallet_address, 'amount': Decimal('10'), **spec},
+                {'user_id': referee.pk, 'wallet_address': referee.wallet_address, 'amount': Decimal('20'), **spec},
+            ])
+            self.assertEqual(DailyStats.objects.count(), 1)
+
+            self.client.post(reverse('save_wallet'), {
+                'wallet_address': '0xroll3', 'referral_code': referrer.referral_code
+            }, content_type='application/json')
+            self.assertEqual(DailyStats.objects.count(), 2)
+
+        totals = self.totals()
+        self.assertEqual((totals['stakes'], totals['staking_referral_rewards']), (2, Decimal('1.5')))
+        self.assertEqual((totals['new_users'], totals['referrals'], totals['signup_rewards']), (1, 1, 3))
+
+    def test_invalid_parameters(self):
+        url = reverse('stats_timeseries')
+        self.assertEqual(self.client.get(url, {'resolution': 'year'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2026-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2020-01-01', 'until': '2026-01-01'}).status_code, 400)
+
+
+class LedgerExportTests(TestCase):
+    """خروجی جریانی کامل، فیلترشده و قابل ادامه از یک id"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = WalletUser.objects.create(wallet_address='0x' + '9' * 40)
+        cls.rewards = TokenReward.objects.bulk_create([
+            TokenReward(
+                user=cls.user,
+                amount=Decimal('0.00000001') * (index + 1),
+                reward_type=reward_type,
+                is_paid=index % 2 == 0
+            )
+            for index, reward_type in enumerate(['staking_self', 'staking_referral', 'staking_self', 'signup_referral'])
+        ])
+
+    def export(self, fmt='csv', **filters):
+        return b''.join(stream_rows('rewards', export_queryset('rewards', **filters), fmt, chunk_size=2))
+
+    def test_csv_keeps_exact_amounts(self):
+        rows = list(csv.DictReader(io.StringIO(self.export().decode())))
+        self.assertEqual([int(row['id']) for row in rows], [reward.pk for reward in self.rewards])
+        self.assertEqual(rows[0]['amount'], '0.00000001')
+        self.assertEqual(rows[0]['wallet_address'], self.user.wallet_address)
+
+    def test_filters_and_resume(self):
+        lines = self.export('ndjson', reward_type='staking_self', paid=True, after_id=self.rewards[0].pk).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.rewards[2].pk])
+        self.assertEqual(json.loads(lines[0])['amount'], '0.00000003')
+        with self.assertRaises(ValueError):
+            export_queryset('stakings', paid=True)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rewards.csv')
+            call_command('export_ledger', 'rewards', '--paid', 'no', '--output', path)
+            with open(path, newline='') as output:
+                self.assertEqual(len(list(csv.DictReader(output))), 2)
+
+    def test_admin_action_streams(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post(reverse('admin:referral_tokenreward_changelist'), {
+            'action': 'export_ndjson',
+            'select_across': '1',
+            '_selected_action': [self.rewards[0].pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+    def test_async_stream_matches_sync(self):
+        async def collect():
+            rows = export_queryset('rewards')
+            return [chunk async for chunk in astream_rows('rewards', rows, 'csv', chunk_size=3)]
+
+        self.assertEqual(b''.join(async_to_sync(collect)()), self.export())
+
+    async def test_admin_action_streams_async_under_asgi(self):
+        user = await User.objects.acreate_superuser('admin', 'admin@example.com', 'password')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.post(reverse('admin:referral_tokenreward_changelist'), {
+            'action': 'export_csv',
+            'select_across': '1',
+            '_selected_action': [self.rewards[0].pk],
+        })
+        # iterator همگام زیر ASGI با sync_to_async(list) کامل در حافظه خوانده می‌شد
+        self.assertTrue(response.is_async)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            chunks = [chunk async for chunk in response]
+        self.assertEqual(len(b''.join(chunks).splitlines()), 5)
+
+
+class PayoutBatchTests(TestCase):
+    """پاداش‌های پرداخت‌نشده هر کیف‌پول در یک دسته با مبلغ تجمیعی"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [WalletUser.objects.create(wallet_address=f'0xpay{index}') for index in range(3)]
+        TokenReward.objects.bulk_create([
+            TokenReward(user=user, amount=Decimal('0.5'), reward_type='staking_self')
+            for user in cls.users
+            for _ in range(3)
+        ])
+        TokenReward.objects.create(user=cls.users[0], amount=1, reward_type='staking_self', is_paid=True)
+
+    def test_one_batch_per_wallet(self):
+        # دسته پر: کیف‌پول آخر کامل به دسته بعد می‌رود
+        first = claim_payout_batches(7)
+        self.assertEqual([batch.user_id for batch in first], [self.users[0].pk, self.users[1].pk])
+        second = claim_payout_batches(7)
+        self.assertEqual([(batch.user_id, batch.amount, batch.reward_count) for batch in second], [
+            (self.users[2].pk, Decimal('1.5'), 3)
+        ])
+        self.assertEqual(claim_payout_batches(7), [])
+        self.assertFalse(TokenReward.objects.filter(is_paid=False, payout_batch__isnull=True).exists())
+
+    def test_mark_paid_and_release(self):
+        batches = claim_payout_batches(100)
+        with self.assertNumQueries(5):
+            self.assertEqual(mark_batches_paid([batches[0].pk], tx_hash='0xtransfer'), 1)
+        self.assertEqual(TokenReward.objects.filter(payout_batch=batches[0], is_paid=True).count(), 3)
+
+        self.assertEqual(release_batches([batch.pk for batch in batches]), 2)
+        self.assertEqual(TokenReward.objects.filter(is_paid=False, payout_batch__isnull=True).count(), 6)
+        self.assertEqual(PayoutBatch.objects.get(pk=batches[0].pk).status, 'paid')
+
+    def test_admin_mark_as_paid_batches_selection(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        selected = TokenReward.objects.filter(user=self.users[1]).values_list('pk', flat=True)
+        self.client.post(reverse('admin:referral_tokenreward_changelist'), {
+            'action': 'mark_as_paid',
+            '_selected_action': list(selected),
+        })
+        batch = PayoutBatch.objects.get()
+        self.assertEqual((batch.user_id, batch.amount, batch.status), (self.users[1].pk, Decimal('1.5'), 'paid'))
+        self.assertEqual(TokenReward.objects.filter(payout_batch=batch, is_paid=True).count(), 3)
+
+
+class ScratchDatabaseTests(TestCase):
+    """دستورهای benchmark هرگز نباید دیتابیس تنظیم‌شده را پاک کنند"""
+
+    def test_refuses_configured_database(self):
+        with self.assertRaises(ValueError):
+            with scratch_database(connection.settings_dict['NAME']):
+                pass
@@ -0,0 +1,91 @@
+# backend/referral/throttling.py
+"""محدودیت نرخ token bucket برای endpointهای نوشتنی
+
+هر endpoint (نام مسیر در referral/urls.py) در REFERRAL_RATE_LIMITS یک یا هر
+دو کلید 'wallet' و 'ip' با نرخ 'N/period' دارد: سطل N توکن جا دارد و در هر
+period دوباره N توکن پر می‌شود، پس تا N درخواست پشت‌سرهم مجاز است.
+با 'per_item': '<فیلد>' هزینه درخواست تعداد اعضای آن فیلد لیستی در بدنه است
+(مثلاً هر استیکینگ در process_staking_batch یک توکن).
+آدرس کلاینت با NUM_PROXIES از X-Forwarded-For که nginx می‌سازد خوانده می‌شود.
+
+DRF throttleها را قبل از اجرای view بررسی می‌کند، پس درخواست رد‌شده هیچ
+کوئری‌ای اجرا نمی‌کند و با 429 و هدر Retry-After برمی‌گردد. وضعیت سطل‌ها در
+کش REFERRAL_RATE_LIMIT_CACHE است (بدون REDIS_URL، LocMem همین پردازش؛ با
+REDIS_URL بین workerها مشترک می‌شود).
+"""
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+# خواندن و نوشتن سطل در همین پردازش اتمیک است؛ بین پردازش‌ها در بدترین حالت
+# چند درخواست هم‌زمان از سقف عبور می‌کنند
+_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """'10/min' → (ظرفیت سطل، توکن در ثانیه)"""
+    count, _, period = rate.partition('/')
+    count = int(count)
+    return count, count / PERIODS[period]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        match = getattr(request, 'resolver_match', None)
+        limits = settings.REFERRAL_RATE_LIMITS.get(match.url_name if match else None)
+        if not limits:
+            return True
+
+        buckets = []
+        if 'ip' in limits:
+            buckets.append((f'ip:{self.get_ident(request)}', limits['ip']))
+        if 'wallet' in limits:
+            wallet_address = request.data.get('wallet_address') if hasattr(request.data, 'get') else None
+            if wallet_address:
+                buckets.append((f'wallet:{wallet_address}', limits['wallet']))
+
+        cost = 1
+        if 'per_item' in limits:
+            items = request.data.get(limits['per_item']) if hasattr(request.data, 'get') else None
+            if isinstance(items, list) and items:
+                cost = len(items)
+
+        self.retry_after = self.consume(match.url_name, buckets, cost)
+        return self.retry_after is None
+
+    def consume(self, endpoint, buckets, cost=1):
+        """cost توکن از همه سطل‌ها؛ اگر یکی کم داشته باشد هیچ‌کدام کم نمی‌شود
+
+        هزینه بیش از ظرفیت سطل به اندازه ظرفیت حساب می‌شود (سطل پر لازم است)،
+        وگرنه آن درخواست هیچ‌وقت مجاز نمی‌شد.
+
+        خروجی: None اگر مجاز است، وگرنه ثانیه تا توکن بعدی
+        """
+        cache = caches[settings.REFERRAL_RATE_LIMIT_CACHE]
+        now = time.time()
+        with _lock:
+            keys = [f'throttle:{endpoint}:{key}' for key, _ in buckets]
+            stored = cache.get_many(keys)
+            updated = {}
+            waits = []
+            for key, (_, rate) in zip(keys, buckets):
+                capacity, refill = parse_rate(rate)
+                tokens, last = stored.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - last) * refill)
+                needed = min(cost, capacity)
+                if tokens < needed:
+                    waits.append((needed - tokens) / refill)
+                updated[key] = (tokens - needed, now, capacity / refill)
+            if waits:
+                return max(waits)
+            for key, (tokens, stamp, full_after) in updated.items():
+                # بعد از پر شدن کامل سطل نیازی به نگه‌داشتن کلید نیست
+                cache.set(key, (tokens, stamp), timeout=int(full_after) + 1)
+        return None
+
+    def wait(self):
+        return self.retry_after
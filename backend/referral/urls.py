@@ -1,11 +1,23 @@
 # backend/referral/urls.py
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views, metrics
+
+# زیر ASGI مسیرهای خواندنی با نسخه async سرو می‌شوند
+read_views = async_views if settings.REFERRAL_ASYNC_READS else views
 
 urlpatterns = [
     path('save-wallet/', views.save_wallet, name='save_wallet'),
-    path('user-stats/<str:wallet_address>/', views.get_user_stats, name='user_stats'),
+    path('user-stats/<str:wallet_address>/', read_views.get_user_stats, name='user_stats'),
     path('staking/process/', views.process_staking, name='process_staking'),
-    path('staking/list/<str:wallet_address>/', views.get_user_stakings, name='user_stakings'),
+    path('staking/process-batch/', views.process_staking_batch, name='process_staking_batch'),
+    path('staking/list/<str:wallet_address>/', read_views.get_user_stakings, name='user_stakings'),
     path('staking/unlock/<int:staking_id>/', views.unlock_staking, name='unlock_staking'),
+    path('downline/<str:wallet_address>/', views.get_user_downline, name='user_downline'),
+    path('downline/<str:wallet_address>/level/<int:depth>/', views.get_downline_level, name='downline_level'),
+    path('leaderboard/<str:board>/', views.get_leaderboard, name='leaderboard'),
+    path('leaderboard/<str:board>/<str:wallet_address>/', views.get_leaderboard_rank, name='leaderboard_rank'),
+    path('stats/timeseries/', views.get_stats_timeseries, name='stats_timeseries'),
+    path('metrics/', metrics.metrics_view, name='metrics'),
+    path('metrics/json/', metrics.metrics_json_view, name='metrics_json'),
 ]
\ No newline at end of file
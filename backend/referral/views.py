@@ -3,10 +3,17 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from .models import WalletUser, Referral, Staking, TokenReward
+from django.utils.dateparse import parse_date
+from .models import WalletUser, ReferralPath, Staking
+from .services import to_amount, register_referral, stake_once, parse_stake_items, stake_batch, unlock_stakings, rewards_pending, downline_levels
+from .ledger import stats_counters
+from .pagination import InvalidCursor, decode_cursor, keyset_page, page_size_from
+from .cache import get_or_compute, wallet_key
+from . import leaderboard, rollups
 
 from django.views.decorators.csrf import csrf_exempt
 
@@ -20,129 +27,144 @@ def save_wallet(request):
     if not wallet_address:
         return Response({'error': 'Wallet address required'}, status=400)
     
-    user, created = WalletUser.objects.get_or_create(
-        wallet_address=wallet_address
-    )
-    
-    response_data = {
-        'wallet_address': user.wallet_address,
-        'referral_code': user.referral_code,
-        'is_new': created,
-        'token_balance': float(user.token_balance),
-        'total_earned': float(user.total_earned),
-        'total_staked': float(user.total_staked)
-    }
-    
-    if created and referral_code:
-        try:
-            referrer = WalletUser.objects.get(referral_code=referral_code)
-            referral = Referral.objects.create(referrer=referrer, referee=user)
-            
-            referrer.token_balance += Decimal('3')
-            referrer.total_earned += Decimal('3')
-            referrer.save()
-            
-            referral.has_received_signup_bonus = True
-            referral.save()
-            
-            TokenReward.objects.create(
-                user=referrer,
-                amount=Decimal('3'),
-                reward_type='signup_referral',
-                related_referral=referral
-            )
-            
-            response_data['referrer_bonus_given'] = True
-            response_data['referrer_received'] = 3
-            
-        except WalletUser.DoesNotExist:
-            response_data['referrer_bonus_given'] = False
+    with transaction.atomic():
+        user, created = WalletUser.objects.get_or_create(
+            wallet_address=wallet_address
+        )
+        rollup = rollups.DailyRollup()
+        if created:
+            rollup.add(user.created_at, new_users=1)
+        
+        response_data = {
+            'wallet_address': user.wallet_address,
+            'referral_code': user.referral_code,
+            'is_new': created,
+            'token_balance': user.token_balance,
+            'total_earned': user.total_earned,
+            'total_staked': user.total_staked
+        }
+        
+        if created and referral_code:
+            try:
+                referrer = WalletUser.objects.only('id').get(referral_code=referral_code)
+                register_referral(user, referrer, rollup=rollup)
+                
+                response_data['referrer_bonus_given'] = True
+                response_data['referrer_received'] = 3
+                
+            except WalletUser.DoesNotExist:
+                response_data['referrer_bonus_given'] = False
+        
+        # آمار روزانه آخر تراکنش و یک بار (referral/rollups.py)
+        rollup.save()
     
     return Response(response_data)
 
+def _staking_invoice(staking, entry, user, created=True):
+    """پاسخ process_staking از روی داده ذخیره‌شده (برای تکرار هم یکسان است)
+
+    اگر پاداش‌ها هنوز در outbox باشند (entry None) موجودی‌های بعد از استیک
+    هنوز معلوم نیستند و None برمی‌گردند، مثل process_staking_batch.
+    """
+    user_bonus = staking.bonus_received
+    referrer_bonus = staking.referrer_bonus
+    new_token_balance = entry.token_balance_after if entry else None
+    total_staked = entry.total_staked_after if entry else None
+    return {
+        'success': True,
+        'duplicate': not created,
+        'rewards_pending': entry is None,
+        'staking_id': staking.id,
+        'amount': staking.amount,
+        'user_bonus': user_bonus,
+        'referrer_bonus': referrer_bonus,
+        'new_token_balance': new_token_balance,
+        'total_staked': total_staked,
+        'unlock_date': staking.unlock_date,
+        'invoice': {
+            'user_address': user.wallet_address,
+            'amount': staking.amount,
+            'bonus_5_percent': user_bonus,
+            'referrer_bonus': referrer_bonus,
+            'staked_amount': staking.amount * Decimal('0.95'),  # 95% قفل شده
+            'staked_until': staking.unlock_date,
+            'days_remaining': Staking.LOCK_DAYS,
+            'tx_hash': staking.tx_hash
+        }
+    }
+
+
 @csrf_exempt
 @api_view(['POST'])
 def process_staking(request):
     """پردازش استیکینگ جدید"""
     wallet_address = request.data.get('wallet_address')
     amount = request.data.get('amount')
-    tx_hash = request.data.get('tx_hash', '')
+    tx_hash = str(request.data.get('tx_hash') or '')
     
     try:
         user = WalletUser.objects.get(wallet_address=wallet_address)
-        amount_decimal = Decimal(str(amount))
+        amount_decimal = to_amount(amount)
         
-        # محاسبه پاداش‌ها
-        user_bonus = amount_decimal * Decimal('0.05')  # 5% به کاربر
-        referrer_bonus = Decimal('0')
-        
-        # بررسی بالاسری
-        try:
-            referral = Referral.objects.get(referee=user)
-            referrer = referral.referrer
-            referrer_bonus = amount_decimal * Decimal('0.05')  # 5% به بالاسری
-            
-            # افزایش موجودی بالاسری
-            referrer.token_balance += referrer_bonus
-            referrer.total_earned += referrer_bonus
-            referrer.save()
-            
-            TokenReward.objects.create(
-                user=referrer,
-                amount=referrer_bonus,
-                reward_type='staking_referral',
-                related_referral=referral
-            )
-            
-        except Referral.DoesNotExist:
-            pass
-        
-        # افزایش موجودی کاربر
-        user.token_balance += user_bonus
-        user.total_earned += user_bonus
-        user.total_staked += amount_decimal
-        user.save()
-        
-        # ایجاد رکورد استیکینگ
-        staking = Staking.objects.create(
-            user=user,
-            amount=amount_decimal,
-            bonus_received=user_bonus,
-            referrer_bonus=referrer_bonus,
-            tx_hash=tx_hash
+        # ثبت استیکینگ، پاداش‌ها و سطرهای دفتر کل در یک تراکنش؛ تکرار همان
+        # tx_hash بدون نوشتن، پاسخ ثبت اولیه را برمی‌گرداند
+        staking, entry, created = stake_once(
+            user, amount_decimal, tx_hash, defer_rewards=settings.REFERRAL_STAKING_OUTBOX
         )
+        if not created and (staking.user_id != user.pk or staking.amount != amount_decimal):
+            return Response({'error': 'tx_hash already used'}, status=409)
         
-        # ثبت پاداش کاربر
-        TokenReward.objects.create(
-            user=user,
-            amount=user_bonus,
-            reward_type='staking_self',
-            related_staking=staking
-        )
+        return Response(_staking_invoice(staking, entry, user, created))
         
+    except Exception as e:
+        return Response({'error': str(e)}, status=400)
+
+
+@csrf_exempt
+@api_view(['POST'])
+def process_staking_batch(request):
+    """پردازش گروهی استیکینگ‌ها (ایندکسر زنجیره) با همان قواعد process_staking"""
+    items = request.data.get('stakes')
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'stakes list required'}, status=400)
+    if len(items) > settings.REFERRAL_STAKING_BATCH_MAX:
         return Response({
+            'error': f'At most {settings.REFERRAL_STAKING_BATCH_MAX} stakes per batch'
+        }, status=400)
+    
+    # موارد نامعتبر کل دسته را رد می‌کنند، پیش از هر نوشتن
+    parsed, errors = parse_stake_items(items)
+    if errors:
+        return Response({'error': 'Invalid stakes', 'errors': errors}, status=400)
+    
+    results = []
+    for index, outcome in enumerate(stake_batch(parsed, defer_rewards=settings.REFERRAL_STAKING_OUTBOX)):
+        if isinstance(outcome, str):
+            results.append({'index': index, 'success': False, 'error': outcome})
+            continue
+        staking, entry, created = outcome
+        results.append({
+            'index': index,
             'success': True,
+            'duplicate': not created,
+            'rewards_pending': entry is None,
             'staking_id': staking.id,
-            'amount': float(amount_decimal),
-            'user_bonus': float(user_bonus),
-            'referrer_bonus': float(referrer_bonus),
-            'new_token_balance': float(user.token_balance),
-            'total_staked': float(user.total_staked),
-            'unlock_date': staking.unlock_date.isoformat(),
-            'invoice': {
-                'user_address': user.wallet_address,
-                'amount': float(amount_decimal),
-                'bonus_5_percent': float(user_bonus),
-                'referrer_bonus': float(referrer_bonus),
-                'staked_amount': float(amount_decimal * Decimal('0.95')),  # 95% قفل شده
-                'staked_until': staking.unlock_date.isoformat(),
-                'days_remaining': 365,
-                'tx_hash': tx_hash
-            }
+            'amount': staking.amount,
+            'user_bonus': staking.bonus_received,
+            'referrer_bonus': staking.referrer_bonus,
+            'new_token_balance': entry.token_balance_after if entry else None,
+            'total_staked': entry.total_staked_after if entry else None,
+            'unlock_date': staking.unlock_date,
+            'tx_hash': staking.tx_hash
         })
-        
-    except Exception as e:
-        return Response({'error': str(e)}, status=400)
+    
+    processed = sum(1 for result in results if result['success'])
+    return Response({
+        'success': True,
+        'processed': processed,
+        'failed': len(results) - processed,
+        'results': results
+    })
 
 
 @csrf_exempt
@@ -162,111 +184,318 @@ def unlock_staking(request, staking_id):
                 'days_remaining': days_left
             }, status=400)
         
-        # آزادسازی
-        staking.is_unlocked = True
-        staking.unlocked_at = timezone.now()
-        staking.save()
-        
-        # کاهش موجودی استیک شده کاربر
-        user = staking.user
-        user.total_staked -= staking.amount
-        user.save()
+        if Staking.objects.filter(pk=staking.pk).filter(rewards_pending()).exists():
+            return Response({'error': 'پاداش‌های این استیکینگ هنوز در حال اعمال است'}, status=409)
         
-        # ثبت پاداش برداشت
-        TokenReward.objects.create(
-            user=user,
-            amount=staking.amount,
-            reward_type='staking_unlock',
-            related_staking=staking
-        )
+        # آزادسازی
+        if not unlock_stakings([staking.pk]):
+            return Response({'error': 'این استیکینگ قبلاً آزاد شده است'}, status=400)
+        staking.refresh_from_db(fields=['is_unlocked', 'unlocked_at'])
         
         return Response({
             'success': True,
             'message': f'{staking.amount} ETH با موفقیت آزاد شد',
-            'amount': float(staking.amount),
-            'unlocked_at': staking.unlocked_at.isoformat()
+            'amount': staking.amount,
+            'unlocked_at': staking.unlocked_at
         })
         
     except Staking.DoesNotExist:
         return Response({'error': 'استیکینگ پیدا نشد'}, status=404)
 
 
+STAKING_LIST_FIELDS = (
+    'id', 'amount', 'bonus_received', 'referrer_bonus', 'staked_at',
+    'unlock_date', 'is_unlocked', 'tx_hash'
+)
+
+
+def staking_counts():
+    """شمارش فعال/تکمیل‌شده با یک تجمیع شرطی"""
+    return {
+        'active': models.Count('id', filter=models.Q(is_unlocked=False)),
+        'completed': models.Count('id', filter=models.Q(is_unlocked=True)),
+    }
+
+
+def stakings_payload(user, page, next_cursor, counts):
+    """قالب پاسخ لیست استیکینگ‌ها (مشترک بین نسخه sync و async)"""
+    # یک زمان ثابت برای همه سطرهای این درخواست
+    now = timezone.now()
+    staking_list = []
+    for staking in page:
+        staking_list.append({
+            'id': staking.id,
+            'amount': staking.amount,
+            'bonus_received': staking.bonus_received,
+            'referrer_bonus': staking.referrer_bonus,
+            'staked_at': staking.staked_at,
+            'unlock_date': staking.unlock_date,
+            'days_remaining': staking.days_remaining(now),
+            'is_unlocked': staking.is_unlocked,
+            'can_unlock': staking.can_unlock(now),
+            'tx_hash': staking.tx_hash
+        })
+    
+    return {
+        'total_staked': user.total_staked,
+        'active_stakings': counts['active'],
+        'completed_stakings': counts['completed'],
+        'stakings': staking_list,
+        'next_cursor': next_cursor
+    }
+
+
+def _user_stakings_payload(wallet_address, cursor, page_size):
+    """داده لیست استیکینگ‌های کاربر؛ None اگر کاربر پیدا نشود"""
+    try:
+        user = WalletUser.objects.only('id', 'total_staked').get(wallet_address=wallet_address)
+    except WalletUser.DoesNotExist:
+        return None
+    
+    stakings = Staking.objects.filter(user=user)
+    page, next_cursor = keyset_page(stakings.only(*STAKING_LIST_FIELDS), cursor, page_size)
+    counts = stakings.aggregate(**staking_counts())
+    return stakings_payload(user, page, next_cursor, counts)
+
+
 @csrf_exempt
 @api_view(['GET'])
 def get_user_stakings(request, wallet_address):
     """دریافت لیست استیکینگ‌های کاربر"""
+    cursor = request.query_params.get('cursor') or ''
+    page_size = page_size_from(request)
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=400)
+    
+    data = get_or_compute(
+        wallet_key('stakings', wallet_address, cursor, page_size),
+        lambda: _user_stakings_payload(wallet_address, cursor, page_size)
+    )
+    if data is None:
+        return Response({'error': 'User not found'}, status=404)
+    return Response(data)
+
+
+def user_counters(user):
+    """شمارنده‌های آمار ذخیره‌شده روی ردیف کاربر"""
+    return {
+        'referral_count': user.referral_count,
+        'signup_rewards': user.signup_rewards,
+        'staking_self_rewards': user.staking_self_rewards,
+        'staking_referral_rewards': user.staking_referral_rewards,
+    }
+
+
+def stats_payload(user, counters):
+    """قالب پاسخ آمار کاربر (مشترک بین نسخه sync و async)"""
+    referrals_count = counters['referral_count']
+    signup_rewards = counters['signup_rewards']
+    staking_self_rewards = counters['staking_self_rewards']
+    staking_referral_rewards = counters['staking_referral_rewards']
+    
+    total_earned_from_staking = staking_self_rewards + staking_referral_rewards
+    
+    return {
+        'referral_code': user.referral_code,
+        'referral_link': f"https://cryptoocapitalhub.com?ref={user.referral_code}",
+        'total_referrals': referrals_count,
+        'token_balance': user.token_balance,
+        'total_earned': user.total_earned,
+        'total_staked': user.total_staked,
+        'earned_from_staking': total_earned_from_staking,
+        'reward_breakdown': {
+            'from_signups': signup_rewards,
+            'from_own_staking': staking_self_rewards,
+            'from_referral_staking': staking_referral_rewards
+        }
+    }
+
+
+def _user_stats_payload(wallet_address):
+    """داده آمار کامل کاربر؛ None اگر کاربر پیدا نشود"""
     try:
         user = WalletUser.objects.get(wallet_address=wallet_address)
     except WalletUser.DoesNotExist:
-        return Response({'error': 'User not found'}, status=404)
+        return None
     
-    stakings = Staking.objects.filter(user=user).order_by('-staked_at')
+    if settings.REFERRAL_STATS_USE_COUNTERS:
+        # همه شمارنده‌ها روی همان ردیف کاربر نگهداری می‌شوند
+        counters = user_counters(user)
+    else:
+        # مسیر پشتیبان: تجمیع شرطی مستقیم روی پاداش‌ها
+        counters = stats_counters([user.pk])[user.pk]
+    return stats_payload(user, counters)
+
+
+@csrf_exempt
+@api_view(['GET'])
+def get_user_stats(request, wallet_address):
+    """دریافت آمار کامل کاربر"""
+    data = get_or_compute(
+        wallet_key('stats', wallet_address),
+        lambda: _user_stats_payload(wallet_address)
+    )
+    if data is None:
+        return Response({'error': 'User not found'}, status=404)
+    return Response(data)
+
+
+@csrf_exempt
+@api_view(['GET'])
+def get_user_downline(request, wallet_address):
+    """اندازه، تعداد هر سطح و حجم استیک کل زیرمجموعه‌های کاربر"""
+    try:
+        user = WalletUser.objects.only('id').get(wallet_address=wallet_address)
+    except WalletUser.DoesNotExist:
+        return Response({'error': 'User not found'}, status=404)
     
-    staking_list = []
-    for staking in stakings:
-        staking_list.append({
-            'id': staking.id,
-            'amount': float(staking.amount),
-            'bonus_received': float(staking.bonus_received),
-            'referrer_bonus': float(staking.referrer_bonus),
-            'staked_at': staking.staked_at.isoformat(),
-            'unlock_date': staking.unlock_date.isoformat(),
-            'days_remaining': staking.days_remaining(),
-            'is_unlocked': staking.is_unlocked,
-            'can_unlock': staking.can_unlock(),
-            'tx_hash': staking.tx_hash
-        })
+    try:
+        max_depth = int(request.query_params.get('max_depth', 0))
+    except ValueError:
+        return Response({'error': 'Invalid max_depth'}, status=400)
     
+    levels = downline_levels(user, max_depth)
     return Response({
-        'total_staked': float(user.total_staked),
-        'active_stakings': stakings.filter(is_unlocked=False).count(),
-        'completed_stakings': stakings.filter(is_unlocked=True).count(),
-        'stakings': staking_list
+        'wallet_address': wallet_address,
+        'downline_size': sum(level['members'] for level in levels),
+        'depth': levels[-1]['depth'] if levels else 0,
+        'total_staked_volume': sum((level['total_staked'] or Decimal('0') for level in levels), Decimal('0')),
+        'levels': [
+            {
+                'depth': level['depth'],
+                'members': level['members'],
+                'total_staked': level['total_staked'] or Decimal('0')
+            }
+            for level in levels
+        ]
     })
 
 
 @csrf_exempt
 @api_view(['GET'])
-def get_user_stats(request, wallet_address):
-    """دریافت آمار کامل کاربر"""
+def get_downline_level(request, wallet_address, depth):
+    """اعضای یک سطح از زیرمجموعه‌ها با صفحه‌بندی کلیدی روی شناسه (?after=)"""
     try:
-        user = WalletUser.objects.get(wallet_address=wallet_address)
+        user = WalletUser.objects.only('id').get(wallet_address=wallet_address)
     except WalletUser.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
     
-    referrals_count = Referral.objects.filter(referrer=user).count()
+    try:
+        after = int(request.query_params.get('after', 0))
+    except ValueError:
+        return Response({'error': 'Invalid after'}, status=400)
+    page_size = page_size_from(request)
     
-    # محاسبه پاداش‌ها
-    signup_rewards = TokenReward.objects.filter(
-        user=user, 
-        reward_type='signup_referral'
-    ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
+    members = list(
+        ReferralPath.objects.filter(ancestor=user, depth=depth, descendant_id__gt=after)
+        .order_by('descendant_id')
+        .values(
+            'descendant_id',
+            'descendant__wallet_address',
+            'descendant__total_staked',
+            'descendant__created_at'
+        )[:page_size + 1]
+    )
+    has_more = len(members) > page_size
+    members = members[:page_size]
     
-    staking_self_rewards = TokenReward.objects.filter(
-        user=user, 
-        reward_type='staking_self'
-    ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
+    return Response({
+        'depth': depth,
+        'members': [
+            {
+                'wallet_address': member['descendant__wallet_address'],
+                'total_staked': member['descendant__total_staked'],
+                'joined_at': member['descendant__created_at']
+            }
+            for member in members
+        ],
+        'next_after': members[-1]['descendant_id'] if has_more else None
+    })
+
+
+@csrf_exempt
+@api_view(['GET'])
+def get_leaderboard(request, board):
+    """N نفر اول جدول رتبه referrers یا stakers (?limit=)"""
+    if board not in leaderboard.BOARDS:
+        return Response({'error': 'Unknown leaderboard'}, status=404)
     
-    staking_referral_rewards = TokenReward.objects.filter(
-        user=user, 
-        reward_type='staking_referral'
-    ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
+    try:
+        limit = int(request.query_params.get('limit', settings.REFERRAL_LEADERBOARD_SIZE))
+    except ValueError:
+        return Response({'error': 'Invalid limit'}, status=400)
+    limit = max(1, min(limit, settings.REFERRAL_LEADERBOARD_MAX_SIZE))
     
-    total_earned_from_staking = staking_self_rewards + staking_referral_rewards
+    score = leaderboard.BOARDS[board]
+    return Response({
+        'board': board,
+        'entries': [
+            {
+                'rank': row['rank'],
+                'wallet_address': row['wallet_address'],
+                'referral_code': row['referral_code'],
+                'score': row[score]
+            }
+            for row in leaderboard.top(board, limit)
+        ]
+    })
+
+
+@csrf_exempt
+@api_view(['GET'])
+def get_leaderboard_rank(request, board, wallet_address):
+    """رتبه یک کیف‌پول در جدول رتبه؛ rank برابر null یعنی هنوز امتیازی ندارد"""
+    if board not in leaderboard.BOARDS:
+        return Response({'error': 'Unknown leaderboard'}, status=404)
+    
+    try:
+        rank, score = leaderboard.rank_of(board, wallet_address)
+    except WalletUser.DoesNotExist:
+        return Response({'error': 'User not found'}, status=404)
     
     return Response({
-        'referral_code': user.referral_code,
-        'referral_link': f"https://cryptoocapitalhub.com?ref={user.referral_code}",
-        'total_referrals': referrals_count,
-        'token_balance': float(user.token_balance),
-        'total_earned': float(user.total_earned),
-        'total_staked': float(user.total_staked),
-        'earned_from_staking': float(total_earned_from_staking),
-        'reward_breakdown': {
-            'from_signups': float(signup_rewards),
-            'from_own_staking': float(staking_self_rewards),
-            'from_referral_staking': float(staking_referral_rewards)
-        }
+        'board': board,
+        'wallet_address': wallet_address,
+        'rank': rank,
+        'score': score
     })
 
 
+def _date_param(request, name, default):
+    """تاریخ YYYY-MM-DD از query string؛ ValueError اگر نامعتبر باشد"""
+    raw = request.query_params.get(name)
+    if not raw:
+        return default
+    value = parse_date(raw)
+    if value is None:
+        raise ValueError(raw)
+    return value
+
+
+@csrf_exempt
+@api_view(['GET'])
+def get_stats_timeseries(request):
+    """سری زمانی آمار سامانه از جدول روزانه (?resolution=day|week|month&since=&until=)"""
+    resolution = request.query_params.get('resolution', 'day')
+    if resolution not in rollups.RESOLUTIONS:
+        return Response({'error': 'Invalid resolution'}, status=400)
+    
+    try:
+        until = _date_param(request, 'until', timezone.localdate())
+        since = _date_param(request, 'since', until - timezone.timedelta(
+            days=settings.REFERRAL_TIMESERIES_DEFAULT_DAYS - 1
+        ))
+    except ValueError:
+        return Response({'error': 'Invalid date'}, status=400)
+    if since > until or (until - since).days >= settings.REFERRAL_TIMESERIES_MAX_DAYS:
+        return Response({'error': 'Invalid date range'}, status=400)
+    
+    return Response({
+        'resolution': resolution,
+        'since': since,
+        'until': until,
+        'series': rollups.series(resolution, since, until)
+    })
@@ -18,6 +18,8 @@ function App() {
   const [stakingAmount, setStakingAmount] = useState('0.1');
   const [invoice, setInvoice] = useState(null);
   const [userStakings, setUserStakings] = useState([]);
+  const [stakingsCursor, setStakingsCursor] = useState(null);
+  const [loadingMoreStakings, setLoadingMoreStakings] = useState(false);
   const [stats, setStats] = useState(null);
   const [isTestMode, setIsTestMode] = useState(false);
   const [signupRewards, setSignupRewards] = useState(0);
@@ -139,12 +141,21 @@ function App() {
   };
 
   // 📦 دریافت لیست استیکینگ‌ها
-  const fetchUserStakings = async () => {
+  // لیست صفحه‌بندی کلیدی است؛ بدون cursor صفحه اول از نو خوانده می‌شود و با
+  // next_cursor صفحه بعد (دکمه «نمایش بیشتر») به انتهای لیست اضافه می‌شود
+  const fetchUserStakings = async (cursor = null) => {
     try {
-      const response = await axios.get(`/api/staking/list/${walletAddress}/`);
-      setUserStakings(response.data.stakings || []);
+      setLoadingMoreStakings(Boolean(cursor));
+      const response = await axios.get(`/api/staking/list/${walletAddress}/`, {
+        params: cursor ? { cursor } : {}
+      });
+      const page = response.data.stakings || [];
+      setUserStakings(previous => (cursor ? [...previous, ...page] : page));
+      setStakingsCursor(response.data.next_cursor || null);
     } catch (error) {
       console.error('Error fetching stakings:', error);
+    } finally {
+      setLoadingMoreStakings(false);
     }
   };
 
@@ -181,8 +192,11 @@ function App() {
           ` و بالاسری شما ${response.data.referrer_bonus.toFixed(4)} توکن دریافت کرد` : '')
       );
       
-      setTokenBalance(response.data.new_token_balance);
-      setTotalStaked(response.data.total_staked);
+      // در حالت outbox موجودی‌ها بعد از اعمال پاداش‌ها معلوم می‌شوند (null)
+      if (!response.data.rewards_pending) {
+        setTokenBalance(response.data.new_token_balance);
+        setTotalStaked(response.data.total_staked);
+      }
       await fetchUserStats();
       await fetchUserStakings();
       
@@ -257,6 +271,7 @@ function App() {
     setTotalStaked(0);
     setInvoice(null);
     setUserStakings([]);
+    setStakingsCursor(null);
     setStats(null);
     setIsTestMode(false);
     setSignupRewards(0);
@@ -503,6 +518,15 @@ function App() {
                     </div>
                   ))}
                 </div>
+                {stakingsCursor && (
+                  <button 
+                    onClick={() => fetchUserStakings(stakingsCursor)}
+                    disabled={loadingMoreStakings}
+                    className="load-more-button"
+                  >
+                    {loadingMoreStakings ? '⏳ در حال دریافت...' : '⬇️ نمایش بیشتر'}
+                  </button>
+                )}
               </div>
             )}
             